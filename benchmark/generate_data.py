@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ generate_data
+
+ Generator of synthetic observation files (SWD with INDEX.SWD, CSV and TOV
+ XLS) and of their geometry index used by the benchmarks
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+
+# start of generated time series and the step between observations
+startTime = datetime.datetime(2011, 7, 1)
+timeStep = datetime.timedelta(minutes=10)
+
+# TOV workbooks are saved as .xls (at most 65536 rows per sheet)
+maxXlsRows = 65000
+
+
+def generate_data(outputPath, rows=10000, columns=2, directories=4, files=3,
+                  xlsRows=None, seed=0):
+    """
+    generate a tree of synthetic observation files
+    (<output>/templogger/Templogstasjoner Bench/<procedure>/*.SWD,
+    <output>/csv/*.csv, <output>/TOV/TOV Bench/2012/*.xls and
+    <output>/geometry_index_bench.csv), .xls files are skipped without xlwt
+    :param outputPath: path to the directory with generated files
+    :param rows: number of observations in each file
+    :param columns: number of observed properties
+    :param directories: number of procedures (directories with .swd files,
+                        .csv and .xls files)
+    :param files: number of .swd files in each directory
+    :param xlsRows: number of observations in each .xls file (default: rows,
+                    at most 65000)
+    :param seed: seed of random values
+    :return parameters: dictionary describing the generated data
+    """
+
+    random.seed(seed)
+    names = ['Column{} ({})'.format(c + 1, 'unit') for c in range(columns)]
+    procedures = ['B{} 0cm'.format(d + 1) for d in range(directories)]
+
+    swdPath = os.path.join(outputPath, 'templogger',
+                           'Templogstasjoner Bench')
+    for procedure in procedures:
+        directory = os.path.join(swdPath, procedure)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        write_index_swd(os.path.join(directory, 'INDEX.SWD'), names)
+        for f in range(files):
+            month = startTime + datetime.timedelta(days=31 * f)
+            write_swd(os.path.join(directory, 'SD{}.SWD'.format(
+                month.strftime('%Y%m'))), procedure, names, rows,
+                startTime + rows * f * timeStep)
+
+    csvPath = os.path.join(outputPath, 'csv')
+    if not os.path.isdir(csvPath):
+        os.makedirs(csvPath)
+    for d in range(directories):
+        write_csv(os.path.join(csvPath, 'bench{}.csv'.format(d + 1)), names,
+                  rows)
+
+    xlsRows = min(xlsRows or rows, maxXlsRows)
+    xlsFiles = ['BO-{:02d}.xls'.format(d + 1) for d in range(directories)]
+    xlsPath = os.path.join(outputPath, 'TOV', 'TOV Bench', '2012')
+    try:
+        import xlwt
+        if not os.path.isdir(xlsPath):
+            os.makedirs(xlsPath)
+        for xlsFile in xlsFiles:
+            write_xls(os.path.join(xlsPath, xlsFile), names, xlsRows)
+    except ImportError:
+        xlsFiles = list()
+
+    write_geometry_index(os.path.join(outputPath,
+                                      'geometry_index_bench.csv'),
+                         procedures + [f[:-4] for f in xlsFiles])
+
+    parameters = {'rows': rows,
+                  'columns': columns,
+                  'directories': directories,
+                  'files': files,
+                  'xls_rows': xlsRows if xlsFiles else 0,
+                  'seed': seed}
+
+    with open(os.path.join(outputPath, 'parameters.json'), 'w') as p:
+        json.dump(parameters, p)
+
+    return parameters
+
+
+def write_index_swd(path, names):
+    """
+    write INDEX.SWD template of names of observed properties
+    :param path: path to the INDEX.SWD file
+    :param names: names of observed properties with units
+    """
+
+    with open(path, 'w') as i:
+        for c, name in enumerate(names):
+            i.write('C{}\t{}\t\r\n'.format(c + 1, name))
+
+
+def write_swd(path, procedure, names, rows, start):
+    """
+    write .swd file (three header lines, tab separated values with decimal
+    commas and timestamps in format YYYY-MM-DD HH:MM)
+    :param path: path to the .swd file
+    :param procedure: name of the procedure (first column of the header)
+    :param names: names of observed properties with units
+    :param rows: number of observations
+    :param start: datetime of the first observation
+    """
+
+    with open(path, 'w') as s:
+        s.write('{}\t{}\r\n'.format(procedure, '\t'.join(names)))
+        s.write('\t{}\r\n'.format('\t'.join('unit' for n in names)))
+        s.write('\t{}\r\n'.format('\t'.join(
+            'C{}'.format(c + 1) for c in range(len(names)))))
+        s.writelines(
+            '{}\t{}\r\n'.format(
+                (start + r * timeStep).strftime('%Y-%m-%d %H:%M'),
+                '\t'.join(get_value(decimalComma=True) for n in names))
+            for r in range(rows))
+
+
+def write_csv(path, names, rows):
+    """
+    write .csv file (header with istSOS time column, ';' separated values,
+    timestamps in format YYYY-MM-DD HH:MM)
+    :param path: path to the .csv file
+    :param names: names of observed properties with units
+    :param rows: number of observations
+    """
+
+    with open(path, 'w') as c:
+        c.write('urn:ogc:def:parameter:x-istsos:1.0:time:iso8601;{}\n'.format(
+            ';'.join(names)))
+        c.writelines(
+            '{};{}\n'.format(
+                (startTime + r * timeStep).strftime('%Y-%m-%d %H:%M'),
+                ';'.join(get_value() for n in names))
+            for r in range(rows))
+
+
+def write_xls(path, names, rows):
+    """
+    write TOV .xls file (names of columns in the fourth row, dates and times
+    in separated columns)
+    :param path: path to the .xls file
+    :param names: names of observed properties with units
+    :param rows: number of observations
+    """
+
+    import xlwt
+
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet('Data')
+    sheet.write(0, 0, 'Benchmark logger')
+
+    for c, name in enumerate(['Date', 'Time'] + names + ['Month']):
+        sheet.write(3, c, name)
+
+    for r in range(rows):
+        timestamp = startTime + r * timeStep
+        sheet.write(4 + r, 0, timestamp.strftime('%d.%m.%Y'))
+        sheet.write(4 + r, 1, timestamp.strftime('%H:%M:%S'))
+        for c in range(len(names)):
+            sheet.write(4 + r, 2 + c, float(get_value()))
+        sheet.write(4 + r, 2 + len(names), timestamp.strftime('%b'))
+
+    workbook.save(path)
+
+
+def write_geometry_index(path, procedures):
+    """
+    write geometry index with all generated procedures
+    :param path: path to the CSV file
+    :param procedures: names of procedures
+    """
+
+    with open(path, 'w') as g:
+        g.write('procid,[multiple_procnames],crs,x,y\n')
+        for p, procedure in enumerate(procedures):
+            g.write('{},33W,{},{}\n'.format(procedure, 440000 + p * 10,
+                                            7220000 + p * 10))
+
+
+def get_value(decimalComma=False):
+    """
+    :param decimalComma: use decimal comma instead of decimal point
+    :return: random observed value with one decimal place
+    """
+
+    value = '{:.1f}'.format(random.uniform(-30, 30))
+    if decimalComma is True:
+        return value.replace('.', ',')
+    return value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic observation files for benchmarks.')
+
+    parser.add_argument(
+        '-output',
+        type=str,
+        required=True,
+        help='Path to the directory with generated files')
+
+    parser.add_argument(
+        '-rows',
+        type=int,
+        default=10000,
+        help='Number of observations in each file')
+
+    parser.add_argument(
+        '-columns',
+        type=int,
+        default=2,
+        help='Number of observed properties')
+
+    parser.add_argument(
+        '-directories',
+        type=int,
+        default=4,
+        help='Number of procedures (directories with .swd files, .csv and '
+             '.xls files)')
+
+    parser.add_argument(
+        '-files',
+        type=int,
+        default=3,
+        help='Number of .swd files in each directory')
+
+    parser.add_argument(
+        '-xls_rows',
+        type=int,
+        help='Number of observations in each .xls file (default: -rows, at '
+             'most 65000)')
+
+    args = parser.parse_args()
+
+    print(json.dumps(generate_data(args.__dict__['output'],
+                                   args.__dict__['rows'],
+                                   args.__dict__['columns'],
+                                   args.__dict__['directories'],
+                                   args.__dict__['files'],
+                                   args.__dict__['xls_rows'])))
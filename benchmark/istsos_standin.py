@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ istsos_standin
+
+ Local stand-in of the WA REST API of istSOS for testing of direct upload
+ (data2istsos -direct_upload), it serves procedures and templates of
+ observations, checks insertobservation requests (batch sizes, fields,
+ timestamps) and records them into a JSON lines file
+ (run as python -m benchmark.istsos_standin from the repository root)
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import argparse
+import json
+import threading
+from sys import exit
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+
+timeColumn = 'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601'
+qualitySuffix = ':qualityIndex'
+
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server handling each request in its own thread, results of checks
+    are kept in summary
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, observedProperties, batchSize, logPath=None):
+        """
+        :param address: tuple (host, port)
+        :param observedProperties: dictionary in format {procedure: list of
+                                   definitions of observed properties}, the
+                                   key None is used for other procedures
+        :param batchSize: the greatest accepted number of observations in
+                          one request
+        :param logPath: path to the JSON lines file with accepted and
+                        rejected insertobservation requests
+        """
+
+        HTTPServer.__init__(self, address, StandinHandler)
+        self.observedProperties = observedProperties
+        self.batchSize = batchSize
+        self.logPath = logPath
+        self.lock = threading.Lock()
+        # observations in format {procedure: count}
+        self.summary = {'requests': 0, 'observations': dict(),
+                        'errors': list()}
+
+    def get_fields(self, procedure):
+        """
+        :param procedure: name of the procedure
+        :return: list of fields of DataArray of the procedure
+        """
+
+        return [{'definition': d} for d in
+                [timeColumn] + self.observedProperties.get(
+                    procedure, self.observedProperties.get(None))]
+
+    def record(self, procedure, body, error):
+        """
+        Record one insertobservation request
+        :param procedure: name of the procedure
+        :param body: decoded body of the request
+        :param error: message of the failed check or None
+        """
+
+        with self.lock:
+            self.summary['requests'] += 1
+            if error is None:
+                values = body['Observation']['result']['DataArray']['values']
+                observations = self.summary['observations']
+                observations.update(
+                    {procedure: observations.get(procedure, 0) + len(values)})
+            else:
+                self.summary['errors'].append('{}: {}'.format(procedure,
+                                                             error))
+
+            if self.logPath is not None:
+                with open(self.logPath, 'a') as log:
+                    log.write(json.dumps({'procedure': procedure,
+                                          'error': error,
+                                          'body': body}) + '\n')
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """
+    Handler of requests of the WA REST API used by istsoswa
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_data(self, data, code=200, message=None):
+        """
+        Send a response in the format of the WA REST API
+        :param data: data part of the response
+        :param code: HTTP status code
+        :param message: message of the response
+        """
+
+        content = json.dumps({'success': code == 200,
+                              'message': message,
+                              'data': data}).encode('utf-8')
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        parts = [unquote(p) for p in self.path.split('?')[0].split('/')]
+
+        if 'getobservation' in parts:
+            procedure = parts[parts.index('procedures') + 1]
+            self.send_data([{
+                'name': procedure,
+                'procedure': procedure,
+                'samplingTime': dict(),
+                'result': {'DataArray': {
+                    'elementCount': '0',
+                    'field': self.server.get_fields(procedure),
+                    'values': list()}}}])
+        elif len(parts) > 2 and parts[-2] == 'procedures':
+            procedure = parts[-1]
+            self.send_data({
+                'assignedSensorId': get_sensor_id(procedure),
+                'outputs': self.server.get_fields(procedure)})
+        else:
+            self.send_data(None, 404, 'Unknown request {}'.format(self.path))
+
+    def do_POST(self):
+        if not self.path.endswith('/operations/insertobservation'):
+            self.send_data(None, 404, 'Unknown request {}'.format(self.path))
+            return
+
+        length = int(self.headers.get('Content-Length'))
+        body = json.loads(self.rfile.read(length).decode('utf-8'))
+        procedure = body.get('Observation', dict()).get('procedure')
+
+        try:
+            check_insert_observation(body, self.server.get_fields(procedure),
+                                     self.server.batchSize)
+            error = None
+        except (ValueError, KeyError, TypeError) as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+
+        self.server.record(procedure, body, error)
+
+        if error is None:
+            self.send_data(None)
+        else:
+            self.send_data(None, 400, error)
+
+
+def check_insert_observation(body, fields, batchSize):
+    """
+    Check the body of an insertobservation request
+    :param body: decoded body of the request
+    :param fields: list of fields of DataArray of the procedure
+    :param batchSize: the greatest accepted number of observations
+    """
+
+    observation = body['Observation']
+    dataArray = observation['result']['DataArray']
+    values = dataArray['values']
+
+    if body['ForceInsert'] != 'true':
+        raise ValueError('ForceInsert is not true')
+    if body['AssignedSensorId'] != get_sensor_id(observation['procedure']) \
+            or observation['AssignedSensorId'] != body['AssignedSensorId']:
+        raise ValueError('Wrong AssignedSensorId {}'.format(
+            body['AssignedSensorId']))
+    if dataArray['field'] != fields:
+        raise ValueError('Fields differ from the template')
+    if not 0 < len(values) <= batchSize:
+        raise ValueError('Batch of {} observations (limit {})'.format(
+            len(values), batchSize))
+    if dataArray['elementCount'] != str(len(values)):
+        raise ValueError('elementCount {} of {} observations'.format(
+            dataArray['elementCount'], len(values)))
+
+    for row in values:
+        if len(row) != len(fields):
+            raise ValueError('Observation {} does not match fields'.format(
+                ','.join(row)))
+        for field, value in zip(fields, row):
+            if field['definition'].endswith(qualitySuffix) and \
+                    not value.isdigit():
+                raise ValueError('Quality index {} is not an integer'.format(
+                    value))
+
+    times = [row[0] for row in values]
+    if any(t[:26] >= n[:26] for t, n in zip(times, times[1:])):
+        raise ValueError('Observations are not sorted by time')
+    if observation['samplingTime'] != {'beginPosition': times[0],
+                                       'endPosition': times[-1]}:
+        raise ValueError('samplingTime does not match observations')
+
+
+def get_sensor_id(procedure):
+    """
+    :param procedure: name of the procedure
+    :return: assigned sensor id served for the procedure
+    """
+
+    return 'standin-{}'.format(procedure)
+
+
+def get_observed_properties(path=None, default=None):
+    """
+    :param path: path to a JSON file in format {procedure: list of
+                 definitions of observed properties}
+    :param default: list of definitions used for other procedures
+    :return: dictionary in format {procedure: list of definitions}, the key
+             None for other procedures
+    """
+
+    observedProperties = dict()
+
+    if path is not None:
+        with open(path, 'r') as o:
+            observedProperties.update(json.load(o))
+
+    observedProperties.update({None: default or list()})
+
+    return observedProperties
+
+
+def main():
+    observedProperties = get_observed_properties(
+        args.__dict__['procedures'], args.__dict__['observed_properties'])
+
+    server = StandinServer(('127.0.0.1', args.__dict__['port']),
+                           observedProperties, args.__dict__['batch_size'],
+                           args.__dict__['log'])
+
+    print('Serving http://127.0.0.1:{}/wa/istsos/services/<service> '
+          '(Ctrl+C to stop)'.format(args.__dict__['port']))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    summary = server.summary
+    print('{} insertobservation request(s), {} observation(s) of {} '
+          'procedure(s)'.format(summary['requests'],
+                                sum(summary['observations'].values()),
+                                len(summary['observations'])))
+
+    if summary['errors']:
+        print('{} request(s) rejected:'.format(len(summary['errors'])))
+        for error in summary['errors']:
+            print('    {}'.format(error))
+        exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run a local stand-in of the istSOS WA REST API checking '
+                    'insertobservation requests.')
+
+    parser.add_argument(
+        '-port',
+        type=int,
+        default=8089,
+        help='Port of the server (default: 8089)')
+
+    parser.add_argument(
+        '-observed_properties',
+        nargs='+',
+        default=['Temperature'],
+        help='Definitions of observed properties of procedures (use '
+             'names ending with {} for quality indexes, default: '
+             'Temperature)'.format(qualitySuffix))
+
+    parser.add_argument(
+        '-procedures',
+        type=str,
+        help='Path to a JSON file with observed properties of procedures in '
+             'format {procedure: [definitions]}')
+
+    parser.add_argument(
+        '-batch_size',
+        type=int,
+        default=5000,
+        help='The greatest accepted number of observations in one request '
+             '(default: 5000)')
+
+    parser.add_argument(
+        '-log',
+        type=str,
+        help='Path to the JSON lines file with recorded insertobservation '
+             'requests')
+
+    args = parser.parse_args()
+
+    main()
@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ run_benchmarks
+
+ Benchmarks of converters and of parsing of observations on synthetic data,
+ each benchmark runs in a new process to measure its peak memory usage
+ (run as python -m benchmark.run_benchmarks from the repository root)
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from os import sep
+from runstats import get_peak_rss
+
+timeColumn = 'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601'
+timestampSuffix = '20170101000000'
+
+
+def main():
+    dataPath = os.path.abspath(args.__dict__['data'])
+
+    if args.__dict__['case']:
+        # one benchmark in this process, called by run_case
+        print(json.dumps(run_benchmark(args.__dict__['case'], dataPath)))
+        return
+
+    if not os.path.isfile(os.path.join(dataPath, 'parameters.json')):
+        from benchmark.generate_data import generate_data
+        print('Generating data into {}'.format(dataPath))
+        generate_data(dataPath, args.__dict__['rows'],
+                      args.__dict__['columns'],
+                      args.__dict__['directories'], args.__dict__['files'])
+
+    with open(os.path.join(dataPath, 'parameters.json'), 'r') as p:
+        parameters = json.load(p)
+
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'parameters': parameters,
+              'results': list()}
+
+    for name in args.__dict__['benchmarks'] or sorted(benchmarks):
+        try:
+            result = run_case(name, dataPath, args.__dict__['repeat'])
+        except subprocess.CalledProcessError:
+            # e.g. optional dependencies of the benchmark are not installed
+            print('{:<28} failed'.format(name))
+            continue
+        report['results'].append(result)
+        print('{:<28} {:>12.0f} {}/s {:>8.3f} s {:>8} kB peak RSS'.format(
+            name, result['rows_per_second'], result['unit'],
+            result['seconds'], result['peak_rss_kb']))
+
+    if args.__dict__['output']:
+        with open(args.__dict__['output'], 'w') as o:
+            json.dump(report, o, indent=2, sort_keys=True)
+        print('Results saved into {}'.format(args.__dict__['output']))
+
+    if args.__dict__['baseline']:
+        with open(args.__dict__['baseline'], 'r') as b:
+            baseline = json.load(b)
+        regressions = get_regressions(report, baseline,
+                                      args.__dict__['tolerance'])
+        for name, old, new in regressions:
+            print('REGRESSION: {} {:.0f} -> {:.0f} rows/s'.format(name, old,
+                                                                  new))
+        if regressions:
+            sys.exit(1)
+
+
+def run_case(name, dataPath, repeat=1):
+    """
+    run one benchmark in new processes (the fastest of repeated runs is
+    reported, with the highest peak RSS)
+    :param name: name of the benchmark (key of benchmarks)
+    :param dataPath: path to the directory with generated data
+    :param repeat: number of runs
+    :return result: dictionary with name, unit, rows, seconds,
+                    rows_per_second and peak_rss_kb
+    """
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = list()
+
+    for i in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmark.run_benchmarks',
+             '-data', dataPath, '-case', name], cwd=root)
+        runs.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    result = min(runs, key=lambda r: r['seconds'])
+    result.update({'peak_rss_kb': max(r['peak_rss_kb'] for r in runs),
+                   'runs': repeat})
+
+    return result
+
+
+def run_benchmark(name, dataPath):
+    """
+    run one benchmark in this process
+    :param name: name of the benchmark (key of benchmarks)
+    :param dataPath: path to the directory with generated data
+    :return: dictionary with name, unit, rows, seconds, rows_per_second and
+             peak_rss_kb
+    """
+
+    function, unit, prepare = benchmarks[name]
+    # reading of inputs of parsing benchmarks is not measured
+    if prepare is not None:
+        benchmarkInput = prepare(dataPath)
+    else:
+        benchmarkInput = dataPath
+
+    try:
+        start = time.time()
+        rows = function(benchmarkInput)
+        seconds = time.time() - start
+    finally:
+        remove_dat_files(dataPath)
+
+    return {'name': name,
+            'unit': unit,
+            'rows': rows,
+            'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds else 0,
+            'peak_rss_kb': get_peak_rss()}
+
+
+def bench_swd2dat(dataPath, engine='text'):
+    """
+    convert all generated .swd files (directory by directory)
+    :param engine: engine of swd2dat
+    :return: number of converted observations
+    """
+
+    from scripts.swd2dat import swd2dat
+
+    for directory in get_swd_directories(dataPath):
+        nick = directory.split(sep)[-1]
+        check_results(swd2dat(directory + sep, None, nick,
+                              'YYYY-MM-DD HH:MM', '+01:00', nick, True, True,
+                              timestampSuffix, engine=engine))
+
+    return get_parameters(dataPath, 'swd')
+
+
+def bench_swd2dat_numpy(dataPath):
+    """
+    convert all generated .swd files with the numpy engine
+    :return: number of converted observations
+    """
+
+    return bench_swd2dat(dataPath, 'numpy')
+
+
+def bench_csv2dat(dataPath, engine='text'):
+    """
+    convert all generated .csv files
+    :param engine: engine of csv2dat
+    :return: number of converted observations
+    """
+
+    from scripts.csv2dat import csv2dat
+
+    parameters = get_parameters(dataPath)
+    check_results(csv2dat(
+        os.path.join(dataPath, 'csv', ''),
+        ','.join('Column{}'.format(c + 1)
+                 for c in range(parameters['columns'])),
+        timeColumn, 'YYYY-MM-DD HH:MM', '+01:00', 'bench', True,
+        timestampSuffix, engine))
+
+    return get_parameters(dataPath, 'csv')
+
+
+def bench_csv2dat_numpy(dataPath):
+    """
+    convert all generated .csv files with the numpy engine
+    :return: number of converted observations
+    """
+
+    return bench_csv2dat(dataPath, 'numpy')
+
+
+def bench_xls2dat(dataPath):
+    """
+    convert all generated TOV .xls files
+    :return: number of converted observations
+    """
+
+    from scripts.xls2dat import xls2dat
+
+    xlsPath = os.path.join(dataPath, 'TOV', 'TOV Bench', '2012', '')
+    if os.path.isdir(xlsPath):
+        check_results(xls2dat(xlsPath, 'Date', 'DATE+TIME', '+01:00', None,
+                              True, timestampSuffix))
+
+    return get_parameters(dataPath, 'xls')
+
+
+def read_swd_lines(dataPath):
+    """
+    read lines of .swd files of the first directory
+    :param dataPath: path to the directory with generated data
+    :return: tuple (list of lines with observations, ObservationPlan)
+    """
+
+    from istsosdat import get_header, get_metadata
+
+    directory = get_swd_directories(dataPath)[0]
+    nick = directory.split(sep)[-1]
+    observationColumns = get_metadata(os.path.join(directory, 'INDEX.SWD'))
+    lines = list()
+
+    for swdFile in sorted(os.listdir(directory)):
+        if swdFile == 'INDEX.SWD':
+            continue
+        with open(os.path.join(directory, swdFile), 'r') as s:
+            header, columnsIndexes = get_header(s.readline(), nick,
+                                                observationColumns)
+            lines.extend(list(s)[2:])
+
+    return lines, columnsIndexes
+
+
+def bench_get_observations(swdLines):
+    """
+    parse lines of .swd files one by one
+    :param swdLines: tuple from read_swd_lines
+    :return: number of parsed lines
+    """
+
+    from istsosdat import get_observations
+
+    lines, columnsIndexes = swdLines
+    for line in lines:
+        get_observations(line, 'YYYY-MM-DD HH:MM', '+01:00', columnsIndexes)
+
+    return len(lines)
+
+
+def bench_get_standardized_timestamp(swdLines):
+    """
+    standardize timestamps of .swd files one by one
+    :param swdLines: tuple from read_swd_lines
+    :return: number of standardized timestamps
+    """
+
+    from istsosdat import get_standardized_timestamp
+
+    timestamps = [line[:16] for line in swdLines[0]]
+    for timestamp in timestamps:
+        get_standardized_timestamp(timestamp, 'YYYY-MM-DD HH:MM', '+01:00')
+
+    return len(timestamps)
+
+
+def bench_discovery(dataPath):
+    """
+    discovery pass of data2istsos (finding directories with observations and
+    their procedures in the geometry index) for templogger and TOV trees
+    :return: number of found directories and .xls files
+    """
+
+    import argparse
+    import data2istsos
+
+    geometryIndex = os.path.join(dataPath, 'geometry_index_bench.csv')
+    count = 0
+
+    for deviceType, path in [('templogger', 'templogger'), ('TOV', 'TOV')]:
+        data2istsos.args = argparse.Namespace(device_type=deviceType,
+                                              engine='text')
+        procedureDirectories = data2istsos.get_procedure_directories(
+            os.path.join(dataPath, path, ''))
+        count += len(data2istsos.get_conversion_configs(
+            procedureDirectories, geometryIndex))
+
+    return count
+
+
+# benchmarks in format {name: (function, unit of counted items, function
+# preparing its input from the path to the data or None to pass the path)}
+benchmarks = {
+    'swd2dat': (bench_swd2dat, 'rows', None),
+    'swd2dat_numpy': (bench_swd2dat_numpy, 'rows', None),
+    'csv2dat': (bench_csv2dat, 'rows', None),
+    'csv2dat_numpy': (bench_csv2dat_numpy, 'rows', None),
+    'xls2dat': (bench_xls2dat, 'rows', None),
+    'get_observations': (bench_get_observations, 'rows', read_swd_lines),
+    'get_standardized_timestamp': (bench_get_standardized_timestamp,
+                                   'timestamps', read_swd_lines),
+    'discovery': (bench_discovery, 'procedures', None)}
+
+
+def get_swd_directories(dataPath):
+    """
+    :param dataPath: path to the directory with generated data
+    :return: sorted list of paths to directories with .swd files
+    """
+
+    stations = os.path.join(dataPath, 'templogger', 'Templogstasjoner Bench')
+
+    return [os.path.join(stations, d) for d in sorted(os.listdir(stations))]
+
+
+def get_parameters(dataPath, fileType=None):
+    """
+    :param dataPath: path to the directory with generated data
+    :param fileType: 'swd', 'csv' or 'xls' to get number of observations in
+                     all files of the type
+    :return: parameters of generated data or number of observations
+    """
+
+    with open(os.path.join(dataPath, 'parameters.json'), 'r') as p:
+        parameters = json.load(p)
+
+    if fileType == 'swd':
+        return parameters['rows'] * parameters['files'] * \
+            parameters['directories']
+    elif fileType == 'csv':
+        return parameters['rows'] * parameters['directories']
+    elif fileType == 'xls':
+        return parameters['xls_rows'] * parameters['directories']
+
+    return parameters
+
+
+def check_results(results):
+    """
+    :param results: list of tuples (path to the file, error message or None)
+                    returned by converters
+    """
+
+    for path, error in results:
+        if error is not None:
+            raise RuntimeError('Conversion of {} failed ({})'.format(path,
+                                                                     error))
+
+
+def remove_dat_files(dataPath):
+    """
+    remove .dat files created by benchmarks
+    :param dataPath: path to the directory with generated data
+    """
+
+    for root, subdirs, files in os.walk(dataPath):
+        for f in files:
+            if f[-4:] == '.dat':
+                os.remove(os.path.join(root, f))
+
+
+def get_regressions(report, baseline, tolerance):
+    """
+    compare results with results of a previous run
+    :param report: results of this run
+    :param baseline: results of the previous run
+    :param tolerance: allowed relative slowdown (0.2 for 20 %)
+    :return: list of tuples (name, baseline rows/s, current rows/s) of
+             slower benchmarks
+    """
+
+    old = dict((r['name'], r['rows_per_second']) for r in
+               baseline['results'])
+
+    return [(r['name'], old[r['name']], r['rows_per_second']) for r in
+            report['results'] if r['name'] in old and
+            r['rows_per_second'] < old[r['name']] * (1 - tolerance)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run benchmarks of converters on synthetic data.')
+
+    parser.add_argument(
+        '-data',
+        type=str,
+        required=True,
+        help='Path to the directory with generated data (generated if it '
+             'does not contain parameters.json)')
+
+    parser.add_argument(
+        '-benchmarks',
+        nargs='+',
+        choices=sorted(benchmarks),
+        help='Benchmarks to run (default: all)')
+
+    parser.add_argument(
+        '-output',
+        type=str,
+        help='Path to the JSON file with results')
+
+    parser.add_argument(
+        '-baseline',
+        type=str,
+        help='Path to the JSON file with results of a previous run, exit with '
+             'status 1 if any benchmark is slower')
+
+    parser.add_argument(
+        '-tolerance',
+        type=float,
+        default=0.2,
+        help='Allowed relative slowdown against the baseline (default: 0.2)')
+
+    parser.add_argument(
+        '-repeat',
+        type=int,
+        default=1,
+        help='Number of runs of each benchmark, the fastest one is reported')
+
+    parser.add_argument(
+        '-rows',
+        type=int,
+        default=10000,
+        help='Number of observations in each generated file')
+
+    parser.add_argument(
+        '-columns',
+        type=int,
+        default=2,
+        help='Number of generated observed properties')
+
+    parser.add_argument(
+        '-directories',
+        type=int,
+        default=4,
+        help='Number of generated procedures')
+
+    parser.add_argument(
+        '-files',
+        type=int,
+        default=3,
+        help='Number of generated .swd files in each directory')
+
+    parser.add_argument(
+        '-case',
+        type=str,
+        help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    main()
@@ -0,0 +1,649 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ bulkparse
+
+ Parsing of whole .swd and .csv files into NumPy arrays (UTC timestamps and
+ float values of each column) and their formatting into .dat files at once,
+ a faster alternative to line by line conversion (requires numpy)
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import time
+from operator import itemgetter, methodcaller
+import runstats
+from istsosdat import get_header, get_timestamp_parser, decode_line, \
+    remove_failed_dat, duplicatePolicies
+from staging import timeColumn, get_utc_microseconds, get_offset_minutes, \
+    get_float, format_values
+
+# fixed width timestamp formats rearranged into ISO 8601 byte by byte, each
+# item is a position in the original timestamp or a literal character
+isoLayouts = {
+    'YYYY-MM-DD HH:MM': list(range(10)) + ['T'] + list(range(11, 16)),
+    'YYYYMMDD': [0, 1, 2, 3, '-', 4, 5, '-', 6, 7],
+    'YYYYMMDDHH': [0, 1, 2, 3, '-', 4, 5, '-', 6, 7, 'T', 8, 9],
+    'DD.MM.YYYY': [6, 7, 8, 9, '-', 3, 4, '-', 0, 1]}
+
+# fields of istSOS timestamps (YYYY-MM-DDTHH:MM:SS.SSSSSS, the offset
+# follows) in format (index after the field, number of digits) and their
+# separators in format (index, character)
+timestampFields = [(4, 4), (7, 2), (10, 2), (13, 2), (16, 2), (19, 2),
+                   (26, 6)]
+timestampSeparators = [(4, '-'), (7, '-'), (10, 'T'), (13, ':'), (16, ':'),
+                       (19, '.')]
+
+# values whose scaled integers would lose precision are formatted one by one
+maxExactInteger = 2 ** 53
+
+
+class ObservationArrays(object):
+    """
+    Observations of one file in columns, timestamps in UTC as
+    datetime64[us] and values as float64 (NaN for empty or not numeric
+    values) with the number of decimal places of each column
+    """
+
+    def __init__(self, header, timestamps, values, decimals, offset,
+                 timeIndex=0):
+        """
+        :param header: names of columns as in .dat header
+        :param timestamps: numpy array of UTC timestamps (datetime64[us])
+        :param values: list of numpy arrays of floats, one for each column
+                       of the header except the time column
+        :param decimals: numbers of decimal places of the value columns
+        :param offset: offset of timestamps in format +HH:MM
+        :param timeIndex: index of the time column in the header
+        """
+
+        self.header = header
+        self.time = timestamps
+        self.values = values
+        self.decimals = decimals
+        self.offset = offset
+        self.timeIndex = timeIndex
+
+    def __len__(self):
+        return len(self.time)
+
+    def format_lines(self):
+        """
+        format all observations at once as lines of .dat file (characters
+        are written into a matrix of bytes with one row for each line, the
+        padding zero bytes are removed at the end)
+        :return: string with lines ended with '\n'
+        """
+
+        import numpy
+
+        integers = list()
+        for values, decimals in zip(self.values, self.decimals):
+            magnitudes = numpy.where(numpy.isfinite(values),
+                                     numpy.abs(values), 0)
+            if len(values) and \
+                    magnitudes.max() * 10 ** decimals >= maxExactInteger:
+                return self.format_lines_slowly()
+            integers.append(numpy.rint(magnitudes * 10 ** decimals).astype(
+                'i8'))
+
+        # widths of columns with the sign and the following delimiter
+        widths = list()
+        for scaled, decimals in zip(integers, self.decimals):
+            wholeDigits = get_digits_count(scaled // 10 ** decimals).max() \
+                if len(scaled) else 1
+            widths.append(1 + int(wholeDigits) + 1 +
+                          (decimals + 1 if decimals else 0))
+        widths.insert(self.timeIndex, 26 + len(self.offset) + 1)
+
+        matrix = numpy.zeros((len(self), sum(widths)), 'u1')
+        start = 0
+        valueIndex = 0
+
+        for column, width in enumerate(widths):
+            if column == self.timeIndex:
+                self.write_timestamps(matrix, start)
+            else:
+                write_values(matrix, start, start + width - 1,
+                             self.values[valueIndex], integers[valueIndex],
+                             self.decimals[valueIndex])
+                valueIndex += 1
+            start += width
+            matrix[:, start - 1] = ord(',')
+
+        matrix[:, -1] = ord('\n')
+        text = matrix.tobytes().replace(b'\x00', b'')
+        if not isinstance(text, str):
+            text = text.decode('ascii')
+
+        return text
+
+    def write_timestamps(self, matrix, start):
+        """
+        write local timestamps in istSOS format into the matrix of lines
+        :param matrix: numpy array of bytes with one row for each line
+        :param start: index of the first column of timestamps
+        """
+
+        import numpy
+
+        local = self.time + numpy.timedelta64(
+            get_offset_minutes(self.offset), 'm')
+        days = local.astype('datetime64[D]')
+        months = local.astype('datetime64[M]')
+        microseconds = (local - days).astype('i8')
+
+        fields = [local.astype('datetime64[Y]').astype('i8') + 1970,
+                  months.astype('i8') % 12 + 1,
+                  (days - months).astype('i8') + 1,
+                  microseconds // 3600000000,
+                  microseconds // 60000000 % 60,
+                  microseconds // 1000000 % 60,
+                  microseconds % 1000000]
+
+        for (end, digits), field in zip(timestampFields, fields):
+            write_integers(matrix, start + end, field, digits)
+        for position, character in timestampSeparators:
+            matrix[:, start + position] = ord(character)
+        for position, character in enumerate(self.offset):
+            matrix[:, start + 26 + position] = ord(character)
+
+    def format_lines_slowly(self):
+        """
+        format observations as lines of .dat file value by value
+        :return: string with lines ended with '\n'
+        """
+
+        import numpy
+
+        timestamps = numpy.datetime_as_string(
+            self.time + numpy.timedelta64(get_offset_minutes(self.offset),
+                                          'm'), unit='us')
+        columns = [format_values(values, decimals) for values, decimals in
+                   zip(self.values, self.decimals)]
+        columns.insert(self.timeIndex, ['{}{}'.format(t, self.offset) for t
+                                        in timestamps.tolist()])
+
+        return ''.join(','.join(row) + '\n' for row in zip(*columns))
+
+    def iter_rows(self):
+        """
+        read observations in istSOS format (generator)
+        :return: yields list of names of columns first (as in .dat header),
+                 then lists of values
+        """
+
+        yield self.header
+
+        for line in self.format_lines().splitlines():
+            yield line.split(',')
+
+    def to_dat(self, datPath, append=False):
+        """
+        write observations into .dat file, the file is removed (or an
+        appended file is truncated back) if anything fails
+        :param datPath: path to the .dat file
+        :param append: append observations to an existing .dat file (keeping
+                       its header)
+        :return count: number of written observations
+        """
+
+        text = self.format_lines()
+
+        appending = append and os.path.isfile(datPath)
+        if appending:
+            originalSize = os.path.getsize(datPath)
+            o = open(datPath, 'a')
+        else:
+            o = open(datPath, 'w')
+
+        start = time.time()
+        try:
+            if not appending:
+                o.write(','.join(self.header) + '\n')
+            o.write(text)
+        except Exception:
+            if appending:
+                o.flush()
+                o.truncate(originalSize)
+                o.close()
+            else:
+                o.close()
+                remove_failed_dat(datPath)
+            raise
+
+        o.close()
+
+        runstats.add('write', time.time() - start, len(self),
+                     os.path.getsize(datPath) -
+                     (originalSize if appending else 0), 1)
+
+        return len(self)
+
+
+def merge_arrays(arraysList, duplicates='first'):
+    """
+    merge observations of several files into one sorted by time with
+    strictly increasing timestamps
+    :param arraysList: list of ObservationArrays with the same columns and
+                       offset
+    :param duplicates: policy for observations with the same timestamp,
+                       'first' keeps the one from the earliest arrays, 'last'
+                       the one from the latest arrays and 'error' raises
+                       ValueError if they differ
+    :return: ObservationArrays
+    """
+
+    import numpy
+
+    if duplicates not in duplicatePolicies:
+        raise ValueError('Unknown policy for duplicates {}'.format(
+            duplicates))
+
+    first = arraysList[0]
+    for arrays in arraysList[1:]:
+        if arrays.header != first.header:
+            raise ValueError('Merged observations have different columns '
+                             '({} and {})'.format(','.join(first.header),
+                                                  ','.join(arrays.header)))
+        if arrays.offset != first.offset:
+            raise ValueError('Cannot merge timestamps with different '
+                             'offsets ({} and {})'.format(first.offset,
+                                                          arrays.offset))
+
+    # observations older than previous ones of the same file are dropped as
+    # in merge_observations
+    sortedRows = list()
+    for arrays in arraysList:
+        unsorted = numpy.zeros(len(arrays), bool)
+        unsorted[1:] = arrays.time[1:] < numpy.maximum.accumulate(
+            arrays.time)[:-1]
+        if duplicates == 'error' and unsorted.any():
+            index = numpy.flatnonzero(unsorted)[0]
+            raise ValueError('Observations are not sorted by time ({} after '
+                             '{})'.format(
+                                 get_local_timestamp(arrays.time[index],
+                                                     arrays.offset),
+                                 get_local_timestamp(
+                                     arrays.time[:index].max(),
+                                     arrays.offset)))
+        sortedRows.append(~unsorted)
+
+    # a stable sort keeps observations with the same timestamp in the order
+    # of arrays
+    timestamps = numpy.concatenate([a.time[r] for a, r in
+                                    zip(arraysList, sortedRows)])
+    order = numpy.argsort(timestamps, kind='mergesort')
+    timestamps = timestamps[order]
+    values = [numpy.concatenate([a.values[c][r] for a, r in
+                                 zip(arraysList, sortedRows)])[order]
+              for c in range(len(first.values))]
+
+    duplicated = timestamps[1:] == timestamps[:-1]
+    if duplicates == 'error':
+        for columnValues in values:
+            differ = (columnValues[1:] != columnValues[:-1]) & ~(
+                numpy.isnan(columnValues[1:]) & numpy.isnan(
+                    columnValues[:-1]))
+            conflicts = numpy.flatnonzero(duplicated & differ)
+            if len(conflicts):
+                raise ValueError('Conflicting observations at {}'.format(
+                    get_local_timestamp(timestamps[conflicts[0]],
+                                        first.offset)))
+
+    if duplicates == 'last':
+        kept = numpy.append(~duplicated, True)
+    else:
+        kept = numpy.insert(~duplicated, 0, True)
+
+    decimals = [max(a.decimals[c] for a in arraysList)
+                for c in range(len(first.values))]
+
+    return ObservationArrays(first.header, timestamps[kept],
+                             [v[kept] for v in values], decimals,
+                             first.offset, first.timeIndex)
+
+
+def get_local_timestamp(timestamp, offset):
+    """
+    :param timestamp: UTC timestamp (numpy.datetime64)
+    :param offset: offset in format +HH:MM
+    :return: timestamp in istSOS format
+    """
+
+    import numpy
+
+    return '{}{}'.format(numpy.datetime_as_string(
+        timestamp + numpy.timedelta64(get_offset_minutes(offset), 'm'),
+        unit='us'), offset)
+
+
+def read_swd_arrays(path, observationColumns, timestampColumn,
+                    timestampFormat, offset):
+    """
+    read observations from .swd file at once
+    :param path: path to the .swd file
+    :param observationColumns: names of columns with observation data
+    :param timestampColumn: name of column with timestamps
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :return: ObservationArrays
+    """
+
+    with open(path, 'rb') as f:
+        headerLine = decode_line(f.readline())
+        f.readline()
+        f.readline()
+        data = f.read()
+
+    return parse_arrays(headerLine, data, observationColumns,
+                        timestampColumn, timestampFormat, offset)
+
+
+def read_csv_arrays(path, observationColumns, timestampColumn,
+                    timestampFormat, offset):
+    """
+    read observations from .csv file at once
+    :param path: path to the .csv file
+    :param observationColumns: names of columns with observation data
+    :param timestampColumn: name of column with timestamps
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :return: ObservationArrays
+    """
+
+    with open(path, 'rb') as f:
+        headerLine = None
+        for line in iter(f.readline, b''):
+            line = decode_line(line)
+            if all(col in line for col in
+                   observationColumns.split(',') + [timestampColumn]):
+                headerLine = line
+                break
+
+        if not headerLine:
+            raise ValueError('Could not find header line in file {}'.format(
+                path))
+
+        data = f.read()
+
+    return parse_arrays(headerLine, data, observationColumns,
+                        timestampColumn, timestampFormat, offset)
+
+
+def parse_arrays(headerLine, data, observationColumns, timestampColumn,
+                 timestampFormat, offset):
+    """
+    parse lines of observations into columns, decimal commas are replaced
+    in the whole data at once
+    :param headerLine: line with names of columns
+    :param data: bytes of lines with observations (without header)
+    :param observationColumns: names of columns with observation data
+    :param timestampColumn: name of column with timestamps
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :return: ObservationArrays
+    """
+
+    header, columnsIndexes = get_header(headerLine, timestampColumn,
+                                        observationColumns)
+    header = header.rstrip('\n').split(',')
+    indexes = [index for index, transform in
+               columnsIndexes.compile(timestampFormat, offset)]
+    timeIndex = indexes.index(columnsIndexes[timeColumn])
+
+    if columnsIndexes.delimiter is None:
+        raise ValueError('Delimiter of columns not found in the header')
+    delimiter = columnsIndexes.delimiter.encode('ascii')
+
+    if delimiter != b',':
+        data = data.replace(b',', b'.')
+    data = data.replace(b'\r', b'')
+    if not data.endswith(b'\n'):
+        data += b'\n'
+    columns = split_columns(data, delimiter, indexes)
+
+    timestamps, offset = parse_timestamps(columns.pop(timeIndex),
+                                          timestampFormat, offset)
+    values = list()
+    decimals = list()
+    for column in columns:
+        columnValues, columnDecimals = parse_column(column)
+        values.append(columnValues)
+        decimals.append(columnDecimals)
+
+    return ObservationArrays(header, timestamps, values, decimals, offset,
+                             timeIndex)
+
+
+def split_columns(data, delimiter, indexes):
+    """
+    split lines into columns, positions of all cells are found at once if
+    all lines have the same number of them (blank lines are skipped)
+    :param data: bytes of lines ended with '\n'
+    :param delimiter: delimiter of columns (bytes)
+    :param indexes: sorted indexes of wanted columns
+    :return: list of numpy arrays of bytes, one for each wanted column
+    """
+
+    import numpy
+
+    characters = numpy.frombuffer(data, 'u1')
+    lineEnds = numpy.flatnonzero(characters == ord('\n'))
+    lineStarts = numpy.concatenate([[0], lineEnds[:-1] + 1])
+    blank = lineEnds == lineStarts
+    lineStarts = lineStarts[~blank]
+    lineEnds = lineEnds[~blank]
+
+    delimiters = numpy.flatnonzero(characters == ord(delimiter))
+    counts = numpy.searchsorted(delimiters, lineEnds) - \
+        numpy.searchsorted(delimiters, lineStarts)
+
+    if len(counts) and (counts != counts[0]).any() or \
+            len(counts) and counts[0] < indexes[-1]:
+        return split_lines(data, delimiter, indexes)
+
+    # ends of cells of each line, the last one ends with the line
+    cellEnds = numpy.column_stack(
+        [delimiters.reshape(len(lineEnds), -1), lineEnds])
+    cellStarts = numpy.column_stack([lineStarts, cellEnds[:, :-1] + 1])
+
+    return [get_cells(characters, cellStarts[:, index], cellEnds[:, index])
+            for index in indexes]
+
+
+def split_lines(data, delimiter, indexes):
+    """
+    split lines into columns line by line
+    :param data: bytes of lines ended with '\n'
+    :param delimiter: delimiter of columns (bytes)
+    :param indexes: sorted indexes of wanted columns
+    :return: list of numpy arrays of bytes, one for each wanted column
+    """
+
+    import numpy
+
+    lines = list(filter(None, data.split(b'\n')))
+    # columns after the last wanted one are not split at all
+    cells = list(map(methodcaller('split', delimiter, indexes[-1] + 1),
+                     lines))
+
+    try:
+        return [numpy.array(list(map(itemgetter(index), cells)), dtype='S')
+                for index in indexes]
+    except IndexError:
+        line = next(l for l, c in zip(lines, cells) if len(c) <= indexes[-1])
+        raise ValueError('Line "{}" has less columns than the header'.format(
+            decode_line(line).rstrip('\n')))
+
+
+def get_cells(characters, starts, ends):
+    """
+    copy cells of one column from the data into an array at once
+    :param characters: numpy array of bytes of the data
+    :param starts: numpy array of indexes of the first characters of cells
+    :param ends: numpy array of indexes after the last characters of cells
+    :return: numpy array of bytes
+    """
+
+    import numpy
+
+    widths = ends - starts
+    width = max(int(widths.max()), 1) if len(widths) else 1
+    positions = numpy.minimum(starts[:, None] + numpy.arange(width),
+                              len(characters) - 1)
+    cells = characters[positions]
+    cells[numpy.arange(width) >= widths[:, None]] = 0
+
+    return cells.view('S{}'.format(width)).ravel()
+
+
+def parse_timestamps(timestamps, timestampFormat, offset):
+    """
+    convert timestamps into UTC, fixed width formats are rearranged at once,
+    the others are parsed one by one by the parser of timestamps
+    :param timestamps: numpy array of bytes with original timestamps
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :return: tuple (numpy array of datetime64[us], offset of timestamps)
+    """
+
+    import numpy
+
+    layout = isoLayouts.get(timestampFormat)
+    width = max(p for p in layout if isinstance(p, int)) + 1 if layout \
+        else None
+
+    if layout and (numpy.char.str_len(timestamps) == width).all():
+        original = timestamps.astype('S{}'.format(width)).view('u1').reshape(
+            -1, width)
+        iso = numpy.empty((len(timestamps), len(layout)), 'u1')
+        for position, item in enumerate(layout):
+            if isinstance(item, int):
+                iso[:, position] = original[:, item]
+            else:
+                iso[:, position] = ord(item)
+
+        local = iso.view('S{}'.format(len(layout))).ravel().astype(
+            'datetime64[us]')
+        utc = local - numpy.timedelta64(get_offset_minutes(offset), 'm')
+
+        return utc, offset
+
+    parser = get_timestamp_parser(timestampFormat, offset)
+    standardized = [parser(t) for t in timestamps.astype(str).tolist()]
+
+    offsets = set(map(itemgetter(slice(-6, None)), standardized))
+    if len(offsets) > 1:
+        raise ValueError('Timestamps have different offsets ({})'.format(
+            ', '.join(sorted(offsets))))
+    elif offsets:
+        offset = offsets.pop()
+
+    utc = get_utc_microseconds(
+        list(map(itemgetter(slice(None, -6)), standardized)), offset)
+
+    return utc.view('datetime64[us]'), offset
+
+
+def parse_column(column):
+    """
+    convert values of one column into floats
+    :param column: numpy array of bytes
+    :return: tuple (numpy array of floats with NaN for empty or not numeric
+             values, maximal number of decimal places)
+    """
+
+    import numpy
+
+    try:
+        floats = numpy.where(column == b'', b'nan', column).astype('f8')
+    except ValueError:
+        floats = numpy.array([get_float(v) for v in column.tolist()],
+                             dtype='f8')
+
+    points = numpy.char.find(column, b'.')
+    decimals = numpy.where(points >= 0,
+                           numpy.char.str_len(column) - points - 1, 0)
+
+    return floats, int(decimals.max()) if len(column) else 0
+
+
+def write_values(matrix, start, end, values, integers, decimals):
+    """
+    write values right-aligned into the matrix of lines, not finite values
+    are left empty
+    :param matrix: numpy array of bytes with one row for each line
+    :param start: index of the first column reserved for values
+    :param end: index of the column after the last character of values
+    :param values: numpy array of floats
+    :param integers: numpy array of absolute values scaled to integers
+    :param decimals: number of decimal places
+    """
+
+    import numpy
+
+    wholeEnd = end
+    if decimals:
+        write_integers(matrix, end, integers % 10 ** decimals, decimals)
+        wholeEnd -= decimals + 1
+        matrix[:, wholeEnd] = ord('.')
+
+    digits = write_integers(matrix, wholeEnd, integers // 10 ** decimals)
+
+    negative = numpy.flatnonzero(numpy.signbit(values))
+    matrix[negative, wholeEnd - 1 - digits[negative]] = ord('-')
+
+    empty = numpy.flatnonzero(~numpy.isfinite(values))
+    matrix[empty, start:end] = 0
+
+
+def write_integers(matrix, end, integers, minDigits=1):
+    """
+    write decimal digits of non-negative integers right-aligned into the
+    matrix of lines
+    :param matrix: numpy array of bytes with one row for each line
+    :param end: index of the column after the last digit
+    :param integers: numpy array of integers
+    :param minDigits: numbers are padded with zeros to this number of digits
+    :return digits: numpy array of numbers of written digits
+    """
+
+    import numpy
+
+    if len(integers) and integers.max() < 10 ** minDigits:
+        digits = numpy.full(len(integers), minDigits, 'i8')
+    else:
+        digits = numpy.maximum(get_digits_count(integers), minDigits)
+
+    for position in range(int(digits.max()) if len(integers) else 0):
+        digit = integers // 10 ** position % 10 + ord('0')
+        if position < minDigits:
+            matrix[:, end - 1 - position] = digit
+        else:
+            matrix[:, end - 1 - position] = numpy.where(
+                digits > position, digit, 0)
+
+    return digits
+
+
+def get_digits_count(integers):
+    """
+    :param integers: numpy array of non-negative integers
+    :return: numpy array of numbers of their decimal digits
+    """
+
+    import numpy
+
+    powers = 10 ** numpy.arange(1, 19, dtype='i8')
+
+    return numpy.searchsorted(powers, integers, side='right') + 1
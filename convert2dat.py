@@ -23,9 +23,19 @@
 
 import argparse
 from os import sep
-from scripts.csv2dat import csv2dat
-from scripts.swd2dat import swd2dat
-from scripts.xls2dat import xls2dat
+from sys import exit
+from istsosdat import get_metadata, convert_files, get_dat_filepath, \
+    duplicatePolicies
+from runstats import count_rows
+from scripts.csv2dat import csv2dat, iter_csv_observations, get_csv_files
+from scripts.swd2dat import swd2dat, iter_swd_observations, get_swd_files
+from scripts.xls2dat import xls2dat, iter_xls_observations, get_xls_files
+
+
+timestampFormats = ['YYYY-MM-DDTHH:MM:SS.SSSSSS+HH:MM', 'YYYYMMDD',
+                    'DD.MM.YYYY', 'DD.MM.YY HH:MM:SS', 'YYYYMMDDHH',
+                    'DD.MM.YY HH:MM:SS AM/PM', 'YYYY-MM-DD HH:MM',
+                    'DATE+TIME']
 
 
 def main():
@@ -38,42 +48,295 @@ def main():
                               args.__dict__['path'].rsplit(sep, 1)[0],
                               sep))
 
-    if 'csv' in args.__dict__['file_extension'] or \
-                    'CSV' in args.__dict__['file_extension']:
-        csv2dat(args.__dict__['path'],
-                args.__dict__['observation_columns'],
-                args.__dict__['timestamp_column'],
-                args.__dict__['timestamp_format'],
-                args.__dict__['timestamp_offset'],
-                args.__dict__['procedure'],
-                args.__dict__['d'])
-    elif 'swd' in args.__dict__['file_extension'] or \
-                    'SWD' in args.__dict__['file_extension']:
-        swd2dat(args.__dict__['path'],
-                args.__dict__['observation_columns'],
-                args.__dict__['timestamp_column'],
-                args.__dict__['timestamp_format'],
-                args.__dict__['timestamp_offset'],
-                args.__dict__['procedure'],
-                args.__dict__['d'],
-                args.__dict__['t'])
-    elif 'xls' in args.__dict__['file_extension'] or \
-                    'XLS' in args.__dict__['file_extension']:
-        xls2dat(args.__dict__['path'],
-                args.__dict__['timestamp_column'],
-                args.__dict__['timestamp_format'],
-                args.__dict__['timestamp_offset'],
-                args.__dict__['procedure'],
-                args.__dict__['d'])
+    if args.__dict__['staging'] is True:
+        results = stage(args)
+    else:
+        results = convert(args)
+
+    failures = [r for r in results if r[1] is not None]
+
+    if failures:
+        for path, error in failures:
+            print('ERROR: Conversion of {} failed ({})'.format(path, error))
+        exit(1)
+
+
+def convert(config):
+    """
+    convert files described by the config into .dat files
+    :param config: object with attributes named as arguments of this script
+                   (see get_config)
+    :return results: list of tuples (path to the original file, error message
+                     or None if the file was converted successfully)
+    """
+
+    fileExtension = config.__dict__['file_extension']
+
+    if 'csv' in fileExtension or 'CSV' in fileExtension:
+        return csv2dat(config.__dict__['path'],
+                       config.__dict__['observation_columns'],
+                       config.__dict__['timestamp_column'],
+                       config.__dict__['timestamp_format'],
+                       config.__dict__['timestamp_offset'],
+                       config.__dict__['procedure'],
+                       config.__dict__['d'],
+                       config.__dict__['timestamp_suffix'],
+                       config.__dict__['engine'])
+    elif 'swd' in fileExtension or 'SWD' in fileExtension:
+        return swd2dat(config.__dict__['path'],
+                       config.__dict__['observation_columns'],
+                       config.__dict__['timestamp_column'],
+                       config.__dict__['timestamp_format'],
+                       config.__dict__['timestamp_offset'],
+                       config.__dict__['procedure'],
+                       config.__dict__['d'],
+                       config.__dict__['t'],
+                       config.__dict__['timestamp_suffix'],
+                       config.__dict__['checkpoints'],
+                       config.__dict__['engine'],
+                       get_quality_checks(config),
+                       config.__dict__['merge'],
+                       config.__dict__['defer_checkpoints'])
+    elif 'xls' in fileExtension or 'XLS' in fileExtension:
+        return xls2dat(config.__dict__['path'],
+                       config.__dict__['timestamp_column'],
+                       config.__dict__['timestamp_format'],
+                       config.__dict__['timestamp_offset'],
+                       config.__dict__['procedure'],
+                       config.__dict__['d'],
+                       config.__dict__['timestamp_suffix'])
     else:
         print("END: Your file extension is not supported")
+        return [(config.__dict__['path'],
+                 'File extension {} is not supported'.format(fileExtension))]
 
 
-if __name__ == '__main__':
-    timestampFormats = ['YYYY-MM-DDTHH:MM:SS.SSSSSS+HH:MM', 'YYYYMMDD',
-                        'DD.MM.YYYY', 'DD.MM.YY HH:MM:SS', 'YYYYMMDDHH',
-                        'DD.MM.YY HH:MM:SS AM/PM', 'YYYY-MM-DD HH:MM',
-                        'DATE+TIME']
+def get_quality_checks(config):
+    """
+    load checks of quality control if required by the config
+    :param config: object with attributes named as arguments of this script
+    :return: checks of units (see qualitycontrol.load_quality_checks) or
+             None without -qc
+    """
+
+    if config.__dict__['qc'] is not True:
+        return None
+
+    from qualitycontrol import load_quality_checks
+
+    return load_quality_checks(config.__dict__['qc_config'])
+
+
+def get_quality_control_error(config):
+    """
+    check that quality control can be used with other arguments, it is done
+    only when converting .swd files into .dat files (units of columns are
+    taken from INDEX.SWD)
+    :param config: object with attributes named as arguments of this script
+    :return: error message or None if the arguments can be used
+    """
+
+    if config.__dict__['qc'] is not True:
+        return None
+
+    if 'swd' not in config.__dict__['file_extension'].lower():
+        return '-qc can be used only with .swd files'
+    if config.__dict__['checkpoints']:
+        return '-qc cannot be used with -checkpoints'
+    if config.__dict__['staging'] is True:
+        return '-qc cannot be used with -staging'
+
+    return None
+
+
+def stage(config):
+    """
+    convert files described by the config into staging directories (.npy
+    arrays) instead of .dat files, requires numpy
+    :param config: object with attributes named as arguments of this script
+                   (see get_config)
+    :return results: list of tuples (path to the original file, error message
+                     or None if the file was staged successfully)
+    """
+
+    return convert_files(get_files(config), stage_file, config)
+
+
+def stage_file(path, config):
+    """
+    convert one file into a staging directory
+    :param path: path to the .swd, .csv or .xls file
+    :param config: object with attributes named as arguments of this script
+    :return stagingPath: path to the created staging directory
+    """
+
+    from staging import write_staging
+
+    stagingPath = get_staging_path(config, path)
+    count = write_staging(stagingPath,
+                          iter_observations(
+                              path,
+                              config.__dict__['timestamp_column'],
+                              config.__dict__['timestamp_format'],
+                              config.__dict__['timestamp_offset'],
+                              config.__dict__['observation_columns'],
+                              config.__dict__['t']),
+                          config.__dict__['procedure'],
+                          config.__dict__['offering'])
+    count_rows(count)
+
+    return stagingPath
+
+
+def get_staging_path(config, path):
+    """
+    get path to the staging directory of the file (named as its .dat file)
+    :param config: object with attributes named as arguments of this script
+    :param path: path to the .swd, .csv or .xls file
+    :return: path to the staging directory
+    """
+
+    from staging import get_staging_path as get_path
+
+    return get_path(get_dat_filepath(path[:-4], config.__dict__['procedure'],
+                                     config.__dict__['timestamp_suffix']))
+
+
+def upload(config, uploader):
+    """
+    upload observations from files described by the config straight to the
+    server without creating .dat files
+    :param config: object with attributes named as arguments of this script
+                   (see get_config), offering and procedure are required
+    :param uploader: istsoswa.ObservationUploader
+    :return results: list of tuples (path to the original file, error message
+                     or None if the file was uploaded successfully)
+    """
+
+    return convert_files(get_files(config), upload_file, config, uploader)
+
+
+def upload_file(path, config, uploader):
+    """
+    upload observations from one file straight to the server
+    :param path: path to the .swd, .csv or .xls file
+    :param config: object with attributes named as arguments of this script
+    :param uploader: istsoswa.ObservationUploader
+    :return count: number of uploaded observations
+    """
+
+    checkpoint = None
+    if config.__dict__['checkpoints'] and path[-3:].lower() == 'swd':
+        from importmanifest import ImportManifest
+        manifest = ImportManifest(config.__dict__['checkpoints'])
+        checkpoint = manifest.get_checkpoint(path)
+
+    rows = iter_observations(path,
+                             config.__dict__['timestamp_column'],
+                             config.__dict__['timestamp_format'],
+                             config.__dict__['timestamp_offset'],
+                             config.__dict__['observation_columns'],
+                             config.__dict__['t'],
+                             checkpoint)
+
+    try:
+        count = uploader.upload(config.__dict__['offering'],
+                                config.__dict__['procedure'],
+                                rows)
+        count_rows(count)
+        if checkpoint is not None:
+            manifest.save_checkpoint(checkpoint)
+    finally:
+        if checkpoint is not None:
+            manifest.close()
+
+    return count
+
+
+def get_files(config):
+    """
+    get files described by the config
+    :param config: object with attributes named as arguments of this script
+    :return files: sorted list of paths to files with observations
+    """
+
+    path = config.__dict__['path']
+    fileExtension = config.__dict__['file_extension']
+
+    if config.__dict__['d'] is False:
+        return [path]
+    elif 'csv' in fileExtension or 'CSV' in fileExtension:
+        return get_csv_files(path)
+    elif 'swd' in fileExtension or 'SWD' in fileExtension:
+        return get_swd_files(path)
+    elif 'xls' in fileExtension or 'XLS' in fileExtension:
+        return get_xls_files(path)
+    else:
+        return [path]
+
+
+def iter_observations(path, timestampColumn, timestampFormat, offset,
+                      observationColumns=None, useTemplate=False,
+                      checkpoint=None):
+    """
+    read observations from one file without creating any .dat file
+    (generator with constant memory usage for .swd and .csv files)
+    :param path: path to the .swd, .csv or .xls file
+    :param timestampColumn: name of column with timestamps (dates for .xls)
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :param observationColumns: names of columns with observation data
+                               (separated with ',', not used for .xls)
+    :param useTemplate: if given, use observation columns names from INDEX.SWD
+    :param checkpoint: checkpoint from ImportManifest.get_checkpoint, only
+                       lines appended after it are read (.swd only, updated
+                       in place)
+    :return: yields list of names of columns first (as in .dat header), then
+             lists of values in istSOS format
+    """
+
+    fileExtension = path[-3:].lower()
+
+    if fileExtension == 'swd':
+        if useTemplate is True:
+            observationColumns = get_metadata('{}{}INDEX.SWD'.format(
+                path.rsplit(sep, 1)[0], sep))
+        rows = iter_swd_observations(path, observationColumns,
+                                     timestampColumn, timestampFormat, offset,
+                                     checkpoint)
+    elif fileExtension == 'csv':
+        rows = iter_csv_observations(path, observationColumns,
+                                     timestampColumn, timestampFormat, offset)
+    elif fileExtension == 'xls':
+        rows = iter_xls_observations(path, timestampColumn, timestampFormat,
+                                     offset)
+    else:
+        raise ValueError('File extension {} is not supported'.format(
+            fileExtension))
+
+    for row in rows:
+        yield row
+
+
+def get_config(path, **kwargs):
+    """
+    get config for convert() with default values of this script arguments
+    :param path: Path to a file with observations (directory with -d)
+    :param kwargs: other arguments of this script in format {dest: value}
+    :return config: argparse.Namespace usable as a config for convert()
+    """
+
+    config = get_parser().parse_args(['-path={}'.format(path)])
+    config.__dict__.update(kwargs)
+
+    return config
+
+
+def get_parser():
+    """
+    create parser of the arguments of this script
+    :return parser: argparse.ArgumentParser
+    """
 
     parser = argparse.ArgumentParser(
         description='Import data from a file (or files) on an istSOS server.')
@@ -123,6 +386,72 @@ if __name__ == '__main__':
         type=str,
         help='Who provides the observations')
 
+    parser.add_argument(
+        '-offering',
+        type=str,
+        help='Offering of the procedure (used only for uploading)')
+
+    parser.add_argument(
+        '-timestamp_suffix',
+        type=str,
+        help='Suffix of .dat files in format YYYYMMDDhhmmss used for files '
+             'without date in their names (default: current time)')
+
+    parser.add_argument(
+        '-checkpoints',
+        type=str,
+        help='Path to the SQLite manifest with reading checkpoints, only '
+             'lines appended since the last run are converted (.swd only)')
+
+    parser.add_argument(
+        '-defer_checkpoints',
+        action='store_true',
+        help='Write lines appended since the last uploaded checkpoint into '
+             'new .dat files and save checkpoints as pending, they are '
+             'committed after a successful upload (with -checkpoints)')
+
+    parser.add_argument(
+        '-engine',
+        type=str,
+        default='text',
+        choices=['text', 'numpy'],
+        help='Convert .swd and .csv files line by line (text) or parse '
+             'whole files into arrays (numpy, requires numpy, not used with '
+             '-checkpoints, values are written with the greatest number of '
+             'decimal places of their column)')
+
+    parser.add_argument(
+        '-qc',
+        action='store_true',
+        help='Check range, steps, spikes and flatlines of values and add '
+             'istSOS quality index columns (.swd only, by units in '
+             'INDEX.SWD, requires numpy, not usable with -checkpoints and '
+             '-staging)')
+
+    parser.add_argument(
+        '-qc_config',
+        type=str,
+        help='Path to a JSON file with quality checks of units in format '
+             '{unit: {check: limit}} updating the default ones (checks min, '
+             'max, step, spike and flatline)')
+
+    parser.add_argument(
+        '-merge',
+        type=str,
+        choices=duplicatePolicies,
+        help='Merge .swd files into one .dat file sorted by time, the value '
+             'is the policy for duplicate timestamps (keep the first or the '
+             'last observation or fail if they differ, not usable with '
+             '-checkpoints)')
+
+    parser.add_argument(
+        '-staging',
+        action='store_true',
+        help='Create staging directories with .npy arrays instead of .dat '
+             'files (requires numpy, values are stored as floats, they are '
+             'read back with the greatest number of decimal places of their '
+             'column and not numeric values as empty ones)')
+
     parser.add_argument(
         '-d',
         action='store_true',
@@ -134,6 +463,15 @@ if __name__ == '__main__':
         action='store_true',
         help='Use template for observation_columns names (INDEX.SWD)')
 
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
     args = parser.parse_args()
 
+    qualityControlError = get_quality_control_error(args)
+    if qualityControlError is not None:
+        parser.error(qualityControlError)
+
     main()
@@ -25,19 +25,59 @@
 import argparse
 import os
 import subprocess
+import multiprocessing
 import glob
+import time
 from sys import exit
-from istsosdat import standardize_norwegian, get_procedure_id
+import convert2dat
+import runstats
+from istsosdat import standardize_norwegian, get_procedure_id, \
+    duplicatePolicies
+from geometryindex import get_geometry_index_path
+from importmanifest import ImportManifest, get_manifest_path
 
 
 def main():
     walk_dir = args.__dict__['path']
 
-    # TODO: See issue about changing csv to something better
-    geometryIndex = args.__dict__['geometry_index']
-    if geometryIndex[-4:] != '.csv':
-        geometryIndex = '{}_{}.csv'.format(args.__dict__['geometry_index'],
-                                           args.__dict__['service'])
+    geometryIndex = get_geometry_index_path(args.__dict__['geometry_index'],
+                                            args.__dict__['service'])
+
+    procedureDirectories = discover(walk_dir)
+
+    if args.__dict__['watch'] is True:
+        watch(walk_dir, procedureDirectories, geometryIndex)
+        return
+
+    failures = import_data(
+        get_conversion_configs(procedureDirectories, geometryIndex),
+        procedureDirectories, geometryIndex)
+
+    if failures:
+        exit(1)
+
+
+def discover(walk_dir):
+    """
+    Find directories (or TOV files) with observations as a measured stage
+    :param walk_dir: Path to a directory containing observations
+    :return procedureDirectories: Dictionary of directories containing data
+    """
+
+    with runstats.measure('discovery') as stage:
+        procedureDirectories = get_procedure_directories(walk_dir)
+        for directories in procedureDirectories.values():
+            stage.files += len(directories)
+
+    return procedureDirectories
+
+
+def get_procedure_directories(walk_dir):
+    """
+    Find directories (or TOV files) with observations
+    :param walk_dir: Path to a directory containing observations
+    :return procedureDirectories: Dictionary of directories containing data
+    """
 
     if args.__dict__['device_type'] == 'templogger':
         procedureDirectories = {'hoydegradient': list(), 'lemenplott': list(),
@@ -72,20 +112,398 @@ def main():
                 else:
                     procedureDirectories[offering].update({root: obsFiles})
 
-    create_dats(procedureDirectories, geometryIndex)
+    return procedureDirectories
+
+
+def import_data(configs, procedureDirectories, geometryIndex):
+    """
+    Convert and upload files described by configs
+    :param configs: list of configs for convert2dat.convert
+    :param procedureDirectories: Dictionary of directories containing data
+    :param geometryIndex: Path to the CSV file with procedures coords metadata
+    :return failures: list of tuples (path to the file, error message)
+    """
+
+    uploading = args.__dict__['u'] is True or \
+        args.__dict__['direct_upload'] is True
+
+    manifestPath = args.__dict__['manifest'] or \
+        get_manifest_path(geometryIndex)
+
+    # checkpoints of .dat files uploaded by csv2istsos are committed only
+    # after their upload, so that failed rows are read again next time
+    deferCheckpoints = args.__dict__['tail'] is True and \
+        args.__dict__['u'] is True and \
+        args.__dict__['direct_upload'] is not True and \
+        args.__dict__['staging'] is not True
+
+    if args.__dict__['tail'] is True:
+        for config in configs:
+            config.__dict__.update({'checkpoints': manifestPath,
+                                    'defer_checkpoints': deferCheckpoints})
+
+    if args.__dict__['incremental'] is True:
+        manifest = ImportManifest(manifestPath)
+        records, configs = get_changed_configs(configs, manifest, uploading)
+        procedureDirectories = filter_procedure_directories(
+            procedureDirectories, records.keys())
+        print('{} new or changed file(s) to import'.format(len(records)))
+
+    if args.__dict__['direct_upload'] is True:
+        results = upload_observations(configs, args.__dict__['batch_size'])
+        failures = report_failures(results, 'Upload')
+        uploadedPaths = [r[0] for r in results if r[1] is None]
+    else:
+        results = create_dats(configs, args.__dict__['jobs'],
+                              args.__dict__['staging'])
+        failures = report_failures(results, 'Conversion')
+        uploadedPaths = list()
+
+        if args.__dict__['staging'] is True:
+            stagedPaths = set(r[0] for r in results if r[1] is None)
+            if args.__dict__['u'] is True:
+                uploadResults = upload_staged(configs, stagedPaths,
+                                              args.__dict__['batch_size'])
+                failures += report_failures(uploadResults, 'Upload')
+                uploadedPaths = [r[0] for r in uploadResults if r[1] is None]
+
+            if args.__dict__['f'] is True:
+                delete_staged(configs, stagedPaths)
+        else:
+            if args.__dict__['u'] is True and args.__dict__['pack_rows']:
+                uploadedPaths = upload_packed(procedureDirectories,
+                                              geometryIndex,
+                                              args.__dict__['pack_rows'])
+            elif args.__dict__['u'] is True:
+                uploadedPaths = upload_data(procedureDirectories,
+                                            geometryIndex)
+
+            if args.__dict__['u'] is True:
+                failures += report_failures(
+                    get_upload_failures(results, uploadedPaths), 'Upload')
+
+            if deferCheckpoints is True:
+                commit_checkpoints(manifestPath, uploadedPaths)
+                # uploaded rows must not be sent again with the next ones
+                delete_dat_files(filter_procedure_directories(
+                    procedureDirectories, uploadedPaths), geometryIndex)
+
+            if args.__dict__['f'] is True:
+                delete_dat_files(procedureDirectories, geometryIndex)
+
+    if args.__dict__['incremental'] is True:
+        update_manifest(manifest, records, results, uploadedPaths)
+        manifest.close()
+
+    return failures
+
+
+def commit_checkpoints(manifestPath, uploadedPaths):
+    """
+    Commit pending checkpoints of files in uploaded directories
+    :param manifestPath: Path to the SQLite manifest with checkpoints
+    :param uploadedPaths: list of directories uploaded without an error
+    """
+
+    if not uploadedPaths:
+        return
+
+    manifest = ImportManifest(manifestPath)
+    try:
+        manifest.commit_checkpoints(uploadedPaths)
+    finally:
+        manifest.close()
+
+
+def watch(walk_dir, procedureDirectories, geometryIndex):
+    """
+    Import new or changed files in a loop until interrupted, directories
+    are polled every interval and discovered again every rescan interval
+    :param walk_dir: Path to a directory containing observations
+    :param procedureDirectories: Dictionary of directories containing data
+    :param geometryIndex: Path to the CSV file with procedures coords metadata
+    """
+
+    # configs are created in the loop, a failed discovery is tried again
+    configs = None
+    lastRescan = time.time()
+    # files in format {path: (size, mtime)} in the state they were imported
+    imported = dict()
+    # files in format {path: (size, mtime, time when seen in this state)}
+    candidates = dict()
+
+    print('Watching {} (Ctrl+C to stop)'.format(walk_dir))
+
+    try:
+        while True:
+            if configs is None or \
+                    time.time() - lastRescan >= args.__dict__['rescan']:
+                try:
+                    if configs is not None:
+                        lastRescan = time.time()
+                        procedureDirectories = discover(walk_dir)
+                    configs = get_conversion_configs(procedureDirectories,
+                                                     geometryIndex)
+                except Exception as e:
+                    print('ERROR: Discovery of {} failed ({})'.format(
+                        walk_dir, e))
+
+            try:
+                poll(configs or list(), procedureDirectories, geometryIndex,
+                     imported, candidates)
+            except Exception as e:
+                print('ERROR: Import failed ({})'.format(e))
+
+            time.sleep(args.__dict__['interval'])
+    except KeyboardInterrupt:
+        print('Watching stopped')
+
+
+def poll(configs, procedureDirectories, geometryIndex, imported, candidates):
+    """
+    Import files changed since their import which are not being written
+    anymore, files of a failed import are imported again in the next poll
+    :param configs: list of configs for convert2dat.convert
+    :param procedureDirectories: Dictionary of directories containing data
+    :param geometryIndex: Path to the CSV file with procedures coords metadata
+    :param imported: Dictionary {path: (size, mtime)} of imported files
+    :param candidates: Dictionary {path: (size, mtime, time)} of changed
+                       files still being written
+    """
+
+    readyConfigs = get_ready_configs(configs, imported, candidates,
+                                     args.__dict__['settle'])
+
+    if not readyConfigs:
+        return
+
+    print('{}: importing {} new or changed file(s)'.format(
+        time.strftime('%Y-%m-%d %H:%M:%S'), len(readyConfigs)))
+    readyPaths = [c.__dict__['path'] for c in readyConfigs]
+
+    try:
+        failures = import_data(readyConfigs,
+                               filter_procedure_directories(
+                                   procedureDirectories, readyPaths),
+                               geometryIndex)
+    except Exception:
+        for path in readyPaths:
+            imported.pop(path, None)
+        raise
+
+    for path, error in failures:
+        imported.pop(path, None)
+
+
+def get_ready_configs(configs, imported, candidates, settle):
+    """
+    Get configs for files changed since their import which are not being
+    written anymore, one config per file
+    :param configs: list of configs for convert2dat.convert
+    :param imported: Dictionary {path: (size, mtime)} of imported files,
+                     updated with returned files
+    :param candidates: Dictionary {path: (size, mtime, time)} of changed
+                       files still being written, updated in place
+    :param settle: Seconds without a change after which a file is imported
+    :return readyConfigs: list of configs
+    """
+
+    readyConfigs = list()
+    now = time.time()
+
+    for config in configs:
+        for path in convert2dat.get_files(config):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            state = (stat.st_size, stat.st_mtime)
+            if imported.get(path) == state:
+                continue
+
+            if candidates.get(path, (None, None))[:2] != state:
+                candidates.update({path: state + (now,)})
+
+            # debounce files still being written by the logger
+            if now - stat.st_mtime >= settle or \
+                    now - candidates[path][2] >= settle:
+                del candidates[path]
+                imported.update({path: state})
+                readyConfigs.append(get_file_config(config, path))
+
+    return readyConfigs
+
 
-    if args.__dict__['u'] is True:
-        upload_data(procedureDirectories, geometryIndex)
+def get_file_config(config, path):
+    """
+    Get copy of the config for one of its files
+    :param config: config for convert2dat.convert
+    :param path: Path to the file
+    :return: config for convert2dat.convert
+    """
 
-    if args.__dict__['f'] is True:
-        delete_dat_files(procedureDirectories, geometryIndex)
+    fileConfig = argparse.Namespace(**config.__dict__)
+    fileConfig.__dict__.update({'path': path, 'd': False})
 
+    return fileConfig
 
-def create_dats(procedureDirectories, geometryIndex):
+
+def create_dats(configs, jobs=1, staging=False):
     """
     create .dat files from all output files from your device
+    :param configs: list of configs for convert2dat.convert
+    :param jobs: Number of processes converting the files in parallel
+    :param staging: Create staging directories instead of .dat files
+    :return results: list of tuples (path to the file, error message or None)
+    """
+
+    if staging is True:
+        convert = convert2dat.stage
+        stageName = 'stage'
+    else:
+        convert = convert2dat.convert
+        stageName = 'convert'
+
+    collector = runstats.get_collector()
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            # map keeps the order of configs, so the summary is ordered
+            if collector is None:
+                results = pool.map(convert, configs, chunksize=1)
+            else:
+                results = list()
+                for result, records in pool.map(
+                        measure_config,
+                        [(convert, stageName, c) for c in configs],
+                        chunksize=1):
+                    collector.merge(records)
+                    results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [run_stage(convert, stageName, config)
+                   for config in configs]
+
+    return [r for result in results for r in result]
+
+
+def measure_config(task):
+    """
+    Run function on the config as a measured stage with statistics collected
+    separately, to be returned from a process of the pool
+    :param task: tuple (function called as function(config), name of the
+                 stage, config for convert2dat.convert)
+    :return: tuple (result of the function, records for RunStats.merge)
+    """
+
+    return runstats.collect(run_stage, *task)
+
+
+def run_stage(function, stageName, config, *functionArgs):
+    """
+    Run function on the config as a stage measured for its procedure
+    :param function: function called as function(config, *functionArgs)
+    :param stageName: Name of the stage in statistics
+    :param config: config for convert2dat.convert
+    :param functionArgs: other arguments of the function
+    :return: result of the function
+    """
+
+    with runstats.measure(stageName, config.__dict__['procedure']) as stage:
+        if runstats.get_collector() is not None:
+            files = convert2dat.get_files(config)
+            stage.files = len(files)
+            stage.bytes = runstats.get_files_size(files)
+
+        return function(config, *functionArgs)
+
+
+def upload_observations(configs, batchSize):
+    """
+    upload observations from all output files from your device straight to
+    the server, without creating .dat files
+    :param configs: list of configs for convert2dat.upload
+    :param batchSize: Maximum number of observations in one request
+    :return results: list of tuples (path to the file, error message or None)
+    """
+
+    from istsoswa import ObservationUploader
+
+    uploader = ObservationUploader(args.__dict__['url'],
+                                   args.__dict__['service'],
+                                   args.__dict__['username'],
+                                   args.__dict__['password'],
+                                   batchSize)
+
+    return [r for config in configs
+            for r in run_stage(convert2dat.upload, 'upload', config,
+                               uploader)]
+
+
+def upload_staged(configs, stagedPaths, batchSize):
+    """
+    upload observations from staging directories to the server
+    :param configs: list of configs for convert2dat.stage
+    :param stagedPaths: paths to successfully staged original files
+    :param batchSize: Maximum number of observations in one request
+    :return results: list of tuples (path to the file, error message or None)
+    """
+
+    from istsoswa import ObservationUploader
+    from staging import StagedObservations
+
+    uploader = ObservationUploader(args.__dict__['url'],
+                                   args.__dict__['service'],
+                                   args.__dict__['username'],
+                                   args.__dict__['password'],
+                                   batchSize)
+    results = list()
+
+    for config in configs:
+        for path in convert2dat.get_files(config):
+            if path not in stagedPaths:
+                continue
+            try:
+                staged = StagedObservations(
+                    convert2dat.get_staging_path(config, path))
+                with runstats.measure('upload',
+                                      staged.meta['procedure']) as stage:
+                    stage.files = 1
+                    stage.rows = uploader.upload(staged.meta['offering'],
+                                                 staged.meta['procedure'],
+                                                 staged.iter_rows())
+                results.append((path, None))
+            except Exception as e:
+                results.append((path, '{}: {}'.format(type(e).__name__, e)))
+
+    return results
+
+
+def delete_staged(configs, stagedPaths):
+    """
+    Delete staging directories created as intermediates in data folders
+    :param configs: list of configs for convert2dat.stage
+    :param stagedPaths: paths to successfully staged original files
+    """
+
+    import shutil
+
+    for config in configs:
+        for path in convert2dat.get_files(config):
+            if path in stagedPaths:
+                shutil.rmtree(convert2dat.get_staging_path(config, path))
+
+
+def get_conversion_configs(procedureDirectories, geometryIndex):
+    """
+    Get configs for convert2dat.convert for all directories or files
     :param procedureDirectories: Dictionary of directories containing data
     :param geometryIndex: Path to the CSV file with procedures coords metadata
+    :return configs: list of configs in the order of offerings and paths
     """
 
     if args.__dict__['device_type'] == 'templogger':
@@ -93,46 +511,165 @@ def create_dats(procedureDirectories, geometryIndex):
     elif args.__dict__['device_type'] == 'TOV':
         fileExtension = 'xls'
 
-    for off in procedureDirectories.keys():
+    # the same suffix for all .dat files of this run, whichever process
+    # converts them
+    timestampSuffix = time.strftime('%Y%m%d%H%M%S')
+    configs = list()
+
+    for off in sorted(procedureDirectories.keys()):
         if fileExtension == 'swd':
             for observationsPath in procedureDirectories[off]:
                 procedureNick = observationsPath.split(os.sep)[-2]
                 procedure = get_procedure_id(procedureNick, geometryIndex)
 
-                p = subprocess.call(
-                    ['python',
-                     'convert2dat.py',
-                     '-path={}'.format(observationsPath),
-                     '-timestamp_column={}'.format(procedureNick),
-                     '-timestamp_format=YYYY-MM-DD HH:MM',
-                     '-procedure={}'.format(procedure),
-                     '-file_extension={}'.format(fileExtension),
-                     '-d',
-                     '-t'])
-
-                if p != 0:
-                    print('Unexpected error. Execution stopped')
-                    delete_dat_files(procedureDirectories)
-                    exit(1)
+                configs.append(convert2dat.get_config(
+                    observationsPath,
+                    timestamp_column=procedureNick,
+                    timestamp_format='YYYY-MM-DD HH:MM',
+                    procedure=procedure,
+                    offering=off,
+                    file_extension=fileExtension,
+                    timestamp_suffix=timestampSuffix,
+                    engine=args.__dict__['engine'],
+                    qc=args.__dict__['qc'],
+                    qc_config=args.__dict__['qc_config'],
+                    merge=args.__dict__['merge'],
+                    d=True,
+                    t=True))
         elif fileExtension == 'xls':
-            for year in procedureDirectories[off].keys():
+            for year in sorted(procedureDirectories[off].keys()):
                 for procedureNick in procedureDirectories[off][year]:
                     procedure = get_procedure_id(procedureNick[:-4],
                                                  geometryIndex)
-                    p = subprocess.call([
-                        'python',
-                        'convert2dat.py',
-                        '-path={}{}{}'.format(year, os.sep, procedureNick),
-                        '-timestamp_column=Date',
-                        '-timestamp_format=DATE+TIME',
-                        '-procedure={}'.format(procedure),
-                        '-file_extension={}'.format(fileExtension)
-                        ])
-
-                    if p != 0:
-                        print('Unexpected error. Execution stopped')
-                        delete_dat_files(procedureDirectories)
-                        exit(1)
+
+                    configs.append(convert2dat.get_config(
+                        '{}{}{}'.format(year, os.sep, procedureNick),
+                        timestamp_column='Date',
+                        timestamp_format='DATE+TIME',
+                        procedure=procedure,
+                        offering=off,
+                        file_extension=fileExtension,
+                        timestamp_suffix=timestampSuffix))
+
+    return configs
+
+
+def get_changed_configs(configs, manifest, uploading=False):
+    """
+    Get configs only for files which are new or changed since their last
+    import, one config per file
+    :param configs: list of configs for convert2dat.convert
+    :param manifest: ImportManifest
+    :param uploading: whether files have to be uploaded to be up to date
+    :return: tuple (dictionary {path: manifest record} of changed files,
+             list of their configs)
+    """
+
+    records = dict()
+    changedConfigs = list()
+
+    for config in configs:
+        for path in convert2dat.get_files(config):
+            record = manifest.get_record(path)
+            if record['uploaded'] if uploading else record['converted']:
+                continue
+
+            records.update({path: record})
+            changedConfigs.append(get_file_config(config, path))
+
+    return records, changedConfigs
+
+
+def filter_procedure_directories(procedureDirectories, paths):
+    """
+    Keep only directories (or TOV files) containing given files
+    :param procedureDirectories: Dictionary of directories containing data
+    :param paths: Paths to files which should be kept
+    :return: Dictionary of directories in the same format
+    """
+
+    filtered = dict()
+
+    for off in procedureDirectories.keys():
+        if args.__dict__['device_type'] == 'templogger':
+            filtered.update({off: [d for d in procedureDirectories[off] if
+                                   any(p.startswith(d) for p in paths)]})
+        elif args.__dict__['device_type'] == 'TOV':
+            filtered.update({off: dict()})
+            for year in procedureDirectories[off].keys():
+                filtered[off].update({year: [
+                    f for f in procedureDirectories[off][year] if
+                    '{}{}{}'.format(year, os.sep, f) in paths]})
+
+    return filtered
+
+
+def update_manifest(manifest, records, results, uploadedPaths):
+    """
+    Save status of imported files into the manifest
+    :param manifest: ImportManifest
+    :param records: dictionary {path: manifest record} from
+                    get_changed_configs
+    :param results: list of tuples (path to the file, error message or None)
+                    of the conversion or direct upload
+    :param uploadedPaths: paths to uploaded files or directories
+    """
+
+    for path, error in results:
+        if error is not None:
+            continue
+
+        record = records[path]
+        if args.__dict__['direct_upload'] is True:
+            record.update({'uploaded': 1})
+        else:
+            record.update({'converted': 1})
+            if any(path.startswith(p) for p in uploadedPaths):
+                record.update({'uploaded': 1})
+
+        manifest.save(record)
+
+
+def report_failures(results, action):
+    """
+    Print a summary of failed files
+    :param results: list of tuples (path to the file, error message or None)
+    :param action: Name of the action printed in the summary
+    :return failures: list of tuples (path to the file, error message)
+    """
+
+    failures = get_failures(results)
+
+    if failures:
+        print('{} of {} file(s) failed:'.format(action, len(failures)))
+        for path, error in failures:
+            print('    {}: {}'.format(path, error))
+
+    return failures
+
+
+def get_upload_failures(results, uploadedPaths):
+    """
+    Get converted files of directories (TOV files) whose upload failed
+    :param results: list of tuples (path to the file, error message or None)
+    :param uploadedPaths: list of directories (TOV files) uploaded without
+                          an error
+    :return: list of tuples (path to the file, error message)
+    """
+
+    return [(path, 'not uploaded') for path, error in results if
+            error is None and
+            not any(path.startswith(p) for p in uploadedPaths)]
+
+
+def get_failures(results):
+    """
+    Filter failed conversions from results of convert2dat.convert
+    :param results: list of tuples (path to the file, error message or None)
+    :return: list of tuples (path to the file, error message)
+    """
+
+    return [r for r in results if r[1] is not None]
 
 
 def upload_data(procedureDirectories, geometryIndex):
@@ -140,8 +677,12 @@ def upload_data(procedureDirectories, geometryIndex):
     Upload data from .dat files to your istSOS server
     :param procedureDirectories: Dictionary of directories containing data
     :param geometryIndex: Path to the CSV file with procedures coords metadata
+    :return uploadedPaths: list of directories (TOV files) uploaded without
+                           an error
     """
 
+    uploadedPaths = list()
+
     for off in procedureDirectories.keys():
         if args.__dict__['device_type'] == 'templogger':
             for observationsPath in procedureDirectories[off]:
@@ -149,34 +690,164 @@ def upload_data(procedureDirectories, geometryIndex):
                     observationsPath.split(os.sep)[-2],
                     geometryIndex)
 
-                subprocess.call(
-                    ['python',
-                     'scripts/csv2istsos.py',
-                     '-w={}'.format(os.path.abspath(observationsPath)),
-                     '-s={}'.format(args.__dict__['service']),
-                     '-u={}'.format(args.__dict__['url']),
-                     '-o={}'.format(off),
-                     '-p={}'.format(procedure),
-                     '-user={}'.format(args.__dict__['username']),
-                     '-password={}'.format(args.__dict__['password'])],
-                    cwd=args.__dict__['istsos_path'])
+                with runstats.measure('upload', procedure) as stage:
+                    measure_dat_files(stage, observationsPath, procedure)
+                    returnCode = subprocess.call(
+                        get_upload_command(observationsPath, off,
+                                           [procedure]),
+                        cwd=args.__dict__['istsos_path'])
+                if returnCode == 0:
+                    uploadedPaths.append(observationsPath)
         elif args.__dict__['device_type'] == 'TOV':
             for year in procedureDirectories[off].keys():
+                # files of the same procedure are uploaded together once
+                returnCodes = dict()
                 for procedureNick in procedureDirectories[off][year]:
                     procedure = get_procedure_id(procedureNick[:-4],
                                                  geometryIndex)
-                    subprocess.call(
-                        ['python',
-                         'scripts/csv2istsos.py',
-                         '-w={}'.format(os.path.abspath(
-                             '{}{}'.format(year, os.sep))),
-                         '-s={}'.format(args.__dict__['service']),
-                         '-u={}'.format(args.__dict__['url']),
-                         '-o={}'.format(off),
-                         '-p={}'.format(procedure),
-                         '-user={}'.format(args.__dict__['username']),
-                         '-password={}'.format(args.__dict__['password'])],
-                        cwd=args.__dict__['istsos_path'])
+                    if procedure not in returnCodes:
+                        with runstats.measure('upload', procedure) as stage:
+                            measure_dat_files(stage,
+                                              '{}{}'.format(year, os.sep),
+                                              procedure)
+                            returnCodes.update({procedure: subprocess.call(
+                                get_upload_command(
+                                    '{}{}'.format(year, os.sep), off,
+                                    [procedure]),
+                                cwd=args.__dict__['istsos_path'])})
+                    if returnCodes[procedure] == 0:
+                        uploadedPaths.append('{}{}{}'.format(year, os.sep,
+                                                             procedureNick))
+
+    return uploadedPaths
+
+
+def upload_packed(procedureDirectories, geometryIndex, packRows):
+    """
+    Pack .dat files of each offering into one temporary directory and upload
+    them to your istSOS server with one run of csv2istsos for the offering
+    :param procedureDirectories: Dictionary of directories containing data
+    :param geometryIndex: Path to the CSV file with procedures coords metadata
+    :param packRows: Maximal number of observations in one packed file
+    :return uploadedPaths: list of directories (TOV files) uploaded without
+                           an error
+    """
+
+    import shutil
+    import tempfile
+    from packing import pack_procedure
+
+    uploadedPaths = list()
+    duplicates = args.__dict__['merge'] or 'first'
+
+    for off in sorted(procedureDirectories.keys()):
+        datFiles, paths = get_offering_dat_files(procedureDirectories[off],
+                                                 geometryIndex)
+        procedures = sorted(p for p in datFiles.keys() if datFiles[p])
+        if not procedures:
+            continue
+
+        packPath = tempfile.mkdtemp(prefix='data2istsos_')
+        try:
+            with runstats.measure('pack') as stage:
+                for procedure in procedures:
+                    pack_procedure(datFiles[procedure], packPath, procedure,
+                                   packRows, duplicates)
+                measure_dat_files(stage, os.path.join(packPath, ''), '')
+        except ValueError as e:
+            # nothing of the offering is uploaded, e.g. conflicting
+            # observations with -merge error
+            shutil.rmtree(packPath)
+            print('ERROR: .dat files of offering {} not packed ({})'.format(
+                off, e))
+            continue
+
+        try:
+            with runstats.measure('upload') as stage:
+                measure_dat_files(stage, os.path.join(packPath, ''), '')
+                returnCode = subprocess.call(
+                    get_upload_command(packPath, off, procedures),
+                    cwd=args.__dict__['istsos_path'])
+        finally:
+            shutil.rmtree(packPath)
+
+        if returnCode == 0:
+            uploadedPaths.extend(paths)
+
+    return uploadedPaths
+
+
+def get_offering_dat_files(directories, geometryIndex):
+    """
+    Find .dat files of procedures of one offering
+    :param directories: directories of the offering from
+                        get_procedure_directories
+    :param geometryIndex: Path to the CSV file with procedures coords metadata
+    :return: tuple (dictionary {procedure: set of paths to .dat files}, list
+             of directories (TOV files) of the offering)
+    """
+
+    datFiles = dict()
+    paths = list()
+
+    if args.__dict__['device_type'] == 'templogger':
+        for observationsPath in directories:
+            procedure = get_procedure_id(observationsPath.split(os.sep)[-2],
+                                         geometryIndex)
+            datFiles.setdefault(procedure, set()).update(glob.glob(
+                '{}{}_*.dat'.format(observationsPath, procedure)))
+            paths.append(observationsPath)
+    elif args.__dict__['device_type'] == 'TOV':
+        for year in directories.keys():
+            for procedureNick in directories[year]:
+                procedure = get_procedure_id(procedureNick[:-4],
+                                             geometryIndex)
+                datFiles.setdefault(procedure, set()).update(glob.glob(
+                    '{}{}{}_*.dat'.format(year, os.sep, procedure)))
+                paths.append('{}{}{}'.format(year, os.sep, procedureNick))
+
+    return datFiles, paths
+
+
+def get_upload_command(path, offering, procedures):
+    """
+    Get command uploading .dat files with csv2istsos
+    :param path: Path to the directory with .dat files
+    :param offering: Name of the offering
+    :param procedures: Names of procedures whose files are uploaded
+    :return: list of arguments for subprocess.call
+    """
+
+    return ['python',
+            'scripts/csv2istsos.py',
+            '-w={}'.format(os.path.abspath(path)),
+            '-s={}'.format(args.__dict__['service']),
+            '-u={}'.format(args.__dict__['url']),
+            '-o={}'.format(offering),
+            '-p'] + procedures + [
+            '-user={}'.format(args.__dict__['username']),
+            '-password={}'.format(args.__dict__['password'])]
+
+
+def measure_dat_files(stage, path, procedure):
+    """
+    Count files, bytes and observations of .dat files of the procedure in the
+    stage (only if statistics are collected)
+    :param stage: runstats.Stage
+    :param path: Path to the directory with .dat files
+    :param procedure: Name of the procedure
+    """
+
+    if runstats.get_collector() is None:
+        return
+
+    files = glob.glob('{}{}*.dat'.format(path, procedure))
+    stage.files += len(files)
+    stage.bytes += runstats.get_files_size(files)
+    for datFile in files:
+        with open(datFile, 'r') as d:
+            # without the header
+            stage.rows += sum(1 for line in d) - 1
 
 
 def delete_dat_files(procedureDirectories, geometryIndex):
@@ -192,15 +863,19 @@ def delete_dat_files(procedureDirectories, geometryIndex):
                 procedure = get_procedure_id(
                     observationsPath.split(os.sep)[-2],
                     geometryIndex)
-                files = glob.glob('{}{}*.dat'.format(observationsPath,
-                                                     procedure))
-                for f in files:
-                    os.remove(f)
+                with runstats.measure('delete', procedure) as stage:
+                    files = glob.glob('{}{}*.dat'.format(observationsPath,
+                                                         procedure))
+                    stage.files = len(files)
+                    for f in files:
+                        os.remove(f)
         elif args.__dict__['device_type'] == 'TOV':
             for year in procedureDirectories[off].keys():
-                files = glob.glob('{}{}*.dat'.format(year, os.sep))
-                for f in files:
-                    os.remove(f)
+                with runstats.measure('delete') as stage:
+                    files = glob.glob('{}{}*.dat'.format(year, os.sep))
+                    stage.files = len(files)
+                    for f in files:
+                        os.remove(f)
 
 
 if __name__ == '__main__':
@@ -228,7 +903,7 @@ if __name__ == '__main__':
         default=os.path.join(os.path.dirname(__file__),
                              'metadata',
                              'geometry_index'),
-        help='Path to the CSV file with sensors metadata '
+        help='Path to the CSV or SQLite file with sensors metadata '
              '(names, crs, coordinates)')
 
     parser.add_argument(
@@ -257,6 +932,77 @@ if __name__ == '__main__':
         type=str,
         help='Password used to access istSOS server')
 
+    parser.add_argument(
+        '-jobs',
+        type=int,
+        default=1,
+        help='Number of processes converting the files in parallel')
+
+    parser.add_argument(
+        '-batch_size',
+        type=int,
+        default=5000,
+        help='Maximum number of observations in one insertObservation '
+             'request (used with -direct_upload or -staging)')
+
+    parser.add_argument(
+        '-manifest',
+        type=str,
+        help='Path to the SQLite manifest of imported files used with '
+             '-incremental and -tail (default: next to the geometry index)')
+
+    parser.add_argument(
+        '-engine',
+        type=str,
+        default='text',
+        choices=['text', 'numpy'],
+        help='Convert .swd files line by line (text) or parse whole files '
+             'into arrays (numpy, requires numpy, not used with -tail, '
+             'values are written with the greatest number of decimal places '
+             'of their column)')
+
+    parser.add_argument(
+        '-qc',
+        action='store_true',
+        help='Check range, steps, spikes and flatlines of values and add '
+             'istSOS quality index columns to .dat files (templogger only, '
+             'by units in INDEX.SWD, requires numpy, not usable with -tail, '
+             '-direct_upload and -staging)')
+
+    parser.add_argument(
+        '-qc_config',
+        type=str,
+        help='Path to a JSON file with quality checks of units in format '
+             '{unit: {check: limit}} updating the default ones (checks min, '
+             'max, step, spike and flatline)')
+
+    parser.add_argument(
+        '-merge',
+        type=str,
+        choices=duplicatePolicies,
+        help='Merge .swd files of each procedure into one .dat file sorted '
+             'by time, the value is the policy for duplicate timestamps '
+             '(keep the first or the last observation or fail if they '
+             'differ, not usable with -tail)')
+
+    parser.add_argument(
+        '-pack_rows',
+        type=int,
+        help='Pack .dat files of each offering into files with at most '
+             'this number of observations merged by time for each procedure '
+             'and upload them with one run of csv2istsos per offering '
+             '(duplicate timestamps are resolved with -merge, default: '
+             'first)')
+
+    parser.add_argument(
+        '-staging',
+        action='store_true',
+        help='Create staging directories with .npy arrays instead of .dat '
+             'files, uploaded directly to a server with -u (requires numpy, '
+             'values are stored as floats, they are uploaded with the '
+             'greatest number of decimal places of their column and not '
+             'numeric values as empty ones)')
+
     parser.add_argument(
         '-u',
         action='store_true',
@@ -267,6 +1013,64 @@ if __name__ == '__main__':
         action='store_true',
         help='Force deletion of intermediates .dat files after execution')
 
+    parser.add_argument(
+        '-incremental',
+        action='store_true',
+        help='Import only files which are new or changed since their last '
+             'import (recorded in the manifest)')
+
+    parser.add_argument(
+        '-tail',
+        action='store_true',
+        help='Read only lines appended to .swd files since the last run '
+             '(checkpoints are stored in the manifest, with -u they are '
+             'advanced only after a successful upload)')
+
+    parser.add_argument(
+        '-watch',
+        action='store_true',
+        help='Keep running and import new or changed files as they appear '
+             '(with -u implies -incremental unless -tail is used)')
+
+    parser.add_argument(
+        '-interval',
+        type=float,
+        default=60,
+        help='Seconds between polls of directories in -watch mode')
+
+    parser.add_argument(
+        '-settle',
+        type=float,
+        default=30,
+        help='Seconds a file has to be unchanged before it is imported in '
+             '-watch mode')
+
+    parser.add_argument(
+        '-rescan',
+        type=float,
+        default=3600,
+        help='Seconds between discoveries of new directories in -watch mode')
+
+    parser.add_argument(
+        '-direct_upload',
+        action='store_true',
+        help='Upload observations straight to a server without creating '
+             '.dat files (url parameter is required)')
+
+    parser.add_argument(
+        '-stats',
+        type=str,
+        help='Path to a JSON file with wall time, rows, bytes, rows/s and '
+             'peak memory of each stage of the run (discovery, '
+             'procedure_lookup, convert or stage, write, upload, delete) and '
+             'of each procedure')
+
+    parser.add_argument(
+        '-profile',
+        type=str,
+        help='Path to a file with cProfile statistics of the run (readable '
+             'by pstats, processes of -jobs are not profiled)')
+
     args = parser.parse_args()
 
     if args.__dict__['service'] == '' or args.__dict__['service'] is None:
@@ -280,4 +1084,36 @@ if __name__ == '__main__':
                               args.__dict__['path'].rsplit(os.sep, 1)[0],
                               os.sep))
 
-    main()
+    if args.__dict__['qc'] is True:
+        # quality indexes are added only to .dat files converted from .swd
+        for option in ['tail', 'direct_upload', 'staging']:
+            if args.__dict__[option] is True:
+                parser.error('-qc cannot be used with -{}'.format(option))
+        if args.__dict__['device_type'] != 'templogger':
+            parser.error('-qc can be used only with templogger')
+
+    if args.__dict__['watch'] is True and \
+            (args.__dict__['u'] is True or
+             args.__dict__['direct_upload'] is True) and \
+            args.__dict__['tail'] is not True and \
+            args.__dict__['incremental'] is not True:
+        print('WARNING: -watch uploads only new or changed files, '
+              '-incremental is used')
+        args.__dict__['incremental'] = True
+
+    if args.__dict__['stats']:
+        runstats.enable()
+
+    try:
+        if args.__dict__['profile']:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(main)
+            finally:
+                runstats.save_profile(profiler, args.__dict__['profile'])
+        else:
+            main()
+    finally:
+        if args.__dict__['stats']:
+            runstats.get_collector().save(args.__dict__['stats'])
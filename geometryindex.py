@@ -0,0 +1,546 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ geometryindex
+
+ Geometry index of procedures (in-memory from a CSV file or an SQLite file)
+ with O(1) or indexed lookups by any of their names used in the archive
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import argparse
+import os
+from istsosdat import standardize_norwegian
+
+# the greatest number of parameters of one SQLite query (the default limit
+# of SQLite before 3.32.0)
+maxQueryVariables = 999
+# loaded indexes in format {path: (mtime, size, GeometryIndex)}
+_loadedIndexes = dict()
+# pyproj transformers in format {(source EPSG code, target EPSG code): ...}
+_transformers = dict()
+
+
+class GeometryIndex(object):
+    """
+    Procedures from a geometry index CSV file, loaded once and searchable by
+    procid and all aliases (procid,[multiple_procnames],crs,x,y)
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to the CSV file with procedures coords metadata
+        """
+
+        self.path = path
+        self.procedures = list()
+        self.aliases = dict()
+        # EPSG codes of coordinate systems the procedures were reprojected to
+        self.reprojected = set()
+
+        self.load()
+
+    def load(self):
+        """
+        Read the CSV file and build the dictionary {alias: procedure record}
+        """
+
+        self.procedures = list()
+        self.aliases = dict()
+        self.reprojected = set()
+
+        with open(self.path, 'r') as geometry:
+            for line in geometry:
+                lineFeatures = line.rstrip('\r\n').split(',')
+                if len(lineFeatures) < 4 or lineFeatures[0] == 'procid':
+                    continue
+
+                self.add_record(lineFeatures[:-3], lineFeatures[-3],
+                                lineFeatures[-2], lineFeatures[-1])
+
+    def add_record(self, names, crs, x, y):
+        """
+        Add a procedure to the in-memory index
+        :param names: List of names of the procedure, procid first
+        :param crs: Coordinate system tag (32V, 33W, 34W, WGS84, ...)
+        :param x: x coordinate
+        :param y: y coordinate
+        :return record: dictionary describing the procedure
+        """
+
+        record = {'procid': names[0],
+                  'names': names,
+                  'crs': crs,
+                  'x': x,
+                  'y': y,
+                  'row': len(self.procedures),
+                  'coordinates': dict()}
+        self.procedures.append(record)
+
+        # the first procedure using the alias wins, as when scanning the file
+        for name in names:
+            if name not in self.aliases:
+                self.aliases.update({name: record})
+
+        return record
+
+    def reproject(self, targetCrs):
+        """
+        Convert coordinates of all procedures into the target coordinate
+        system, in one call for each source coordinate system (records get
+        {target EPSG code: (x, y)} in 'coordinates', procedures with unknown
+        coordinate systems or coordinates are skipped)
+        :param targetCrs: EPSG code of the target coordinate system
+        """
+
+        targetCrs = get_target_code(targetCrs)
+        if targetCrs in self.reprojected:
+            return
+
+        for record, x, y in reproject_records(self.procedures, targetCrs):
+            record['coordinates'].update({targetCrs: (x, y)})
+
+        self.reprojected.add(targetCrs)
+
+    def get_record(self, procedureName):
+        """
+        Find the procedure by its procid, alias or alias with -temp suffix
+        :param procedureName: Name of the procedure used in archive
+        :return record: dictionary describing the procedure or None
+        """
+
+        procedureName = standardize_norwegian(procedureName)
+
+        record = self.aliases.get(procedureName)
+        tempRecord = self.aliases.get('{}-temp'.format(procedureName))
+
+        if record is None or (tempRecord is not None and
+                              tempRecord['row'] < record['row']):
+            return tempRecord
+        return record
+
+    def get_procedure_id(self, procedureName):
+        """
+        Find name of sensor used on the server for given name used in archive
+        :param procedureName: Name of the procedure used in archive
+        :return: Name of procedure for server usage or None if not found
+        """
+
+        record = self.get_record(procedureName)
+        if record:
+            return record['procid']
+
+    def __contains__(self, procedureName):
+        return self.get_record(procedureName) is not None
+
+    def __len__(self):
+        return len(self.procedures)
+
+
+class SQLiteGeometryIndex(GeometryIndex):
+    """
+    Procedures from a geometry index SQLite file, searched with indexed
+    queries instead of loading the whole file (tables procedures, aliases
+    and geometry with reprojected coordinates)
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to the SQLite file (created if it does not exist)
+        """
+
+        import sqlite3
+
+        self.path = path
+        # parallel workers query the same file
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.text_factory = str
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS procedures ('
+            'id INTEGER PRIMARY KEY, '
+            'procid TEXT, '
+            'crs TEXT, '
+            'x TEXT, '
+            'y TEXT)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS aliases ('
+            'procedure INTEGER, '
+            'position INTEGER, '
+            'name TEXT, '
+            'PRIMARY KEY (procedure, position))')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS aliases_name ON aliases '
+            '(name, procedure)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS geometry ('
+            'procedure INTEGER, '
+            'crs TEXT, '
+            'x REAL, '
+            'y REAL, '
+            'PRIMARY KEY (procedure, crs))')
+        self.connection.commit()
+
+    def load(self):
+        pass
+
+    @property
+    def procedures(self):
+        """
+        :return: list of records of all procedures ordered as imported
+        """
+
+        return self.get_records()
+
+    def get_records(self, ids=None):
+        """
+        Get records of procedures
+        :param ids: list of ids of procedures (None for all procedures)
+        :return records: list of dictionaries describing the procedures
+        """
+
+        if ids is None:
+            chunks = [list()]
+        else:
+            ids = list(ids)
+            chunks = [ids[i:i + maxQueryVariables] for i in
+                      range(0, len(ids), maxQueryVariables)]
+
+        records = dict()
+        for chunk in chunks:
+            if ids is None:
+                condition = ''
+            else:
+                condition = ' WHERE {} IN ({})'.format(
+                    '{}', ','.join('?' * len(chunk)))
+
+            for row in self.connection.execute(
+                    'SELECT id, procid, crs, x, y FROM procedures' +
+                    condition.format('id'), chunk):
+                records.update({row[0]: {'procid': row[1],
+                                         'names': list(),
+                                         'crs': row[2],
+                                         'x': row[3],
+                                         'y': row[4],
+                                         'row': row[0],
+                                         'coordinates': dict()}})
+
+            for procedure, name in self.connection.execute(
+                    'SELECT procedure, name FROM aliases' +
+                    condition.format('procedure') + ' ORDER BY position',
+                    chunk):
+                records[procedure]['names'].append(name)
+            for procedure, crs, x, y in self.connection.execute(
+                    'SELECT procedure, crs, x, y FROM geometry' +
+                    condition.format('procedure'), chunk):
+                records[procedure]['coordinates'].update({crs: (x, y)})
+
+        return [records[i] for i in sorted(records)]
+
+    def get_names(self):
+        """
+        :return: set of all names (procids and aliases) of procedures
+        """
+
+        return set(row[0] for row in self.connection.execute(
+            'SELECT DISTINCT name FROM aliases'))
+
+    def add_record(self, names, crs, x, y):
+        """
+        Add a procedure to the SQLite file (saved by commit)
+        :param names: List of names of the procedure, procid first
+        :param crs: Coordinate system tag (32V, 33W, 34W, WGS84, ...)
+        :param x: x coordinate
+        :param y: y coordinate
+        """
+
+        procedure = self.connection.execute(
+            'INSERT INTO procedures (procid, crs, x, y) VALUES (?, ?, ?, ?)',
+            (names[0], crs, str(x), str(y))).lastrowid
+        self.connection.executemany(
+            'INSERT INTO aliases (procedure, position, name) VALUES (?, ?, ?)',
+            [(procedure, position, name) for position, name in
+             enumerate(names)])
+
+    def commit(self):
+        self.connection.commit()
+
+    def reproject(self, targetCrs):
+        """
+        Convert coordinates of procedures not converted yet into the target
+        coordinate system and save them in the geometry table
+        :param targetCrs: EPSG code of the target coordinate system
+        """
+
+        targetCrs = get_target_code(targetCrs)
+        missing = [row[0] for row in self.connection.execute(
+            'SELECT id FROM procedures WHERE id NOT IN '
+            '(SELECT procedure FROM geometry WHERE crs = ?)', (targetCrs,))]
+
+        if missing:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO geometry (procedure, crs, x, y) '
+                'VALUES (?, ?, ?, ?)',
+                [(record['row'], targetCrs, x, y) for record, x, y in
+                 reproject_records(self.get_records(missing), targetCrs)])
+            self.connection.commit()
+
+    def get_record(self, procedureName):
+        """
+        Find the procedure by its procid, alias or alias with -temp suffix
+        :param procedureName: Name of the procedure used in archive
+        :return record: dictionary describing the procedure or None
+        """
+
+        procedureName = standardize_norwegian(procedureName)
+
+        # the first procedure using the alias wins, as when scanning the file
+        procedures = [row[0] for row in self.connection.execute(
+            'SELECT MIN(procedure) FROM aliases WHERE name IN (?, ?) '
+            'GROUP BY name',
+            (procedureName, '{}-temp'.format(procedureName)))]
+
+        if procedures:
+            return self.get_records([min(procedures)])[0]
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM procedures').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def reproject_records(records, targetCrs):
+    """
+    Convert coordinates of procedures into the target coordinate system, in
+    one call for each source coordinate system (procedures with unknown
+    coordinate systems or coordinates are skipped)
+    :param records: list of dictionaries describing procedures
+    :param targetCrs: EPSG code of the target coordinate system
+    :return: list of tuples (record, x, y)
+    """
+
+    # records in format {source EPSG code: [(record, x, y)]}
+    groups = dict()
+    for record in records:
+        try:
+            groups.setdefault(get_epsg_code(record['crs']), []).append(
+                (record, float(record['x']), float(record['y'])))
+        except ValueError:
+            continue
+
+    reprojected = list()
+    for sourceCrs, points in groups.items():
+        xs = [point[1] for point in points]
+        ys = [point[2] for point in points]
+
+        if sourceCrs != targetCrs:
+            xs, ys = transform(sourceCrs, targetCrs, xs, ys)
+
+        reprojected.extend((point[0], x, y) for point, x, y in
+                           zip(points, xs, ys))
+
+    return reprojected
+
+
+def get_target_code(targetCrs):
+    """
+    :param targetCrs: EPSG code of coordinate system (e.g. 4326 or
+                      'EPSG:4326')
+    :return: EPSG code as string of digits
+    """
+
+    return str(targetCrs).upper().replace('EPSG:', '')
+
+
+def get_epsg_code(crs):
+    """
+    Get EPSG code of a coordinate system tag from the geometry index
+    :param crs: Coordinate system tag (UTM zone with latitude band like 32V,
+                33W or 34W, or WGS84)
+    :return: EPSG code (e.g. '32633' for 33W)
+    """
+
+    if crs == 'WGS84':
+        return '4326'
+
+    try:
+        zone = int(crs[:-1])
+    except ValueError:
+        raise ValueError('Unexpected coordinate system {}'.format(crs))
+
+    if not 1 <= zone <= 60 or not crs[-1].isalpha():
+        raise ValueError('Unexpected coordinate system {}'.format(crs))
+
+    if crs[-1].upper() >= 'N':
+        return str(32600 + zone)
+    return str(32700 + zone)
+
+
+def transform(sourceCrs, targetCrs, xs, ys):
+    """
+    Transform coordinates between two coordinate systems in one call, with
+    pyproj if available (transformers are created only once), otherwise
+    only UTM into WGS84 is supported
+    :param sourceCrs: EPSG code of the source coordinate system
+    :param targetCrs: EPSG code of the target coordinate system
+    :param xs: sequence of x coordinates (eastings or longitudes)
+    :param ys: sequence of y coordinates (northings or latitudes)
+    :return: tuple (list of x coordinates, list of y coordinates)
+    """
+
+    try:
+        transformer = get_transformer(sourceCrs, targetCrs)
+    except ImportError:
+        if targetCrs != '4326' or not 32601 <= int(sourceCrs) <= 32760:
+            raise
+
+        from spatialindex import utm_to_wgs84
+        zone = int(sourceCrs) % 100
+        northern = int(sourceCrs) < 32700
+        points = [utm_to_wgs84(x, y, zone, northern) for x, y in zip(xs, ys)]
+
+        return [p[0] for p in points], [p[1] for p in points]
+
+    xs, ys = transformer.transform(xs, ys)
+
+    return list(xs), list(ys)
+
+
+def get_transformer(sourceCrs, targetCrs):
+    """
+    Get pyproj transformer between two coordinate systems, create it only the
+    first time
+    :param sourceCrs: EPSG code of the source coordinate system
+    :param targetCrs: EPSG code of the target coordinate system
+    :return: pyproj.Transformer with x (easting, longitude) first axis order
+    """
+
+    try:
+        return _transformers[(sourceCrs, targetCrs)]
+    except KeyError:
+        import pyproj
+
+        transformer = pyproj.Transformer.from_crs(
+            'EPSG:{}'.format(sourceCrs), 'EPSG:{}'.format(targetCrs),
+            always_xy=True)
+        _transformers.update({(sourceCrs, targetCrs): transformer})
+
+        return transformer
+
+
+def get_geometry_index(geometryIndex):
+    """
+    Get the loaded geometry index, load it only if not loaded yet or changed
+    (SQLite files are only opened, they are queried when needed)
+    :param geometryIndex: Path to the CSV or SQLite file or already
+                          a GeometryIndex
+    :return: GeometryIndex
+    """
+
+    if isinstance(geometryIndex, GeometryIndex):
+        return geometryIndex
+
+    if is_sqlite_index(geometryIndex):
+        if geometryIndex not in _loadedIndexes:
+            _loadedIndexes.update({geometryIndex: (
+                None, None, SQLiteGeometryIndex(geometryIndex))})
+        return _loadedIndexes[geometryIndex][2]
+
+    stat = os.stat(geometryIndex)
+    loaded = _loadedIndexes.get(geometryIndex)
+
+    if loaded is None or loaded[:2] != (stat.st_mtime, stat.st_size):
+        loaded = (stat.st_mtime, stat.st_size, GeometryIndex(geometryIndex))
+        _loadedIndexes.update({geometryIndex: loaded})
+
+    return loaded[2]
+
+
+def get_geometry_index_path(geometryIndex, service):
+    """
+    Get path to the geometry index of the service
+    :param geometryIndex: Path to the CSV or SQLite file, or its prefix
+                          completed with the name of the service
+    :param service: The name of the service instance
+    :return: path to the SQLite file if it exists, otherwise to the CSV file
+    """
+
+    if geometryIndex[-4:] == '.csv' or is_sqlite_index(geometryIndex):
+        return geometryIndex
+
+    sqlitePath = '{}_{}.sqlite'.format(geometryIndex, service)
+    if os.path.isfile(sqlitePath):
+        return sqlitePath
+
+    return '{}_{}.csv'.format(geometryIndex, service)
+
+
+def is_sqlite_index(path):
+    """
+    :param path: Path to a geometry index
+    :return: True if the path has an extension of SQLite files
+    """
+
+    return os.path.splitext(path)[1].lower() in ['.sqlite', '.sqlite3', '.db']
+
+
+def import_csv(csvPath, sqlitePath):
+    """
+    Import a geometry index CSV file into an SQLite file, the SQLite file is
+    rebuilt from scratch (all its procedures, aliases and geometries are
+    deleted first, also those missing in the CSV file)
+    :param csvPath: Path to the CSV file with procedures coords metadata
+    :param sqlitePath: Path to the SQLite file
+    :return: number of imported procedures
+    """
+
+    csvIndex = GeometryIndex(csvPath)
+    sqliteIndex = SQLiteGeometryIndex(sqlitePath)
+
+    try:
+        for table in ['procedures', 'aliases', 'geometry']:
+            sqliteIndex.connection.execute('DELETE FROM {}'.format(table))
+        for record in csvIndex.procedures:
+            sqliteIndex.add_record(record['names'], record['crs'],
+                                   record['x'], record['y'])
+        sqliteIndex.commit()
+    finally:
+        sqliteIndex.close()
+
+    _loadedIndexes.pop(sqlitePath, None)
+
+    return len(csvIndex)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Import a geometry index CSV file into an SQLite file.')
+
+    parser.add_argument(
+        '-csv',
+        type=str,
+        required=True,
+        help='Path to the CSV file with procedures coords metadata')
+
+    parser.add_argument(
+        '-output',
+        type=str,
+        help='Path to the SQLite file, its content is replaced with the CSV '
+             'file (default: the CSV path with .sqlite extension)')
+
+    args = parser.parse_args()
+
+    output = args.__dict__['output'] or '{}.sqlite'.format(
+        os.path.splitext(args.__dict__['csv'])[0])
+    print('{} procedures imported into {}'.format(
+        import_csv(args.__dict__['csv'], output), output))
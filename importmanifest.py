@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ importmanifest
+
+ Persistent manifest of imported files, used to skip files which were not
+ changed since their last successful import
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import hashlib
+import os
+import sqlite3
+
+
+class ImportManifest(object):
+    """
+    SQLite file with records of source files (path, size, mtime, hash of the
+    content and status of their conversion and upload)
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to the SQLite file (created if it does not exist)
+        """
+
+        self.path = path
+        # parallel conversions save their checkpoints into the same file
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'path TEXT PRIMARY KEY, '
+            'size INTEGER, '
+            'mtime REAL, '
+            'hash TEXT, '
+            'converted INTEGER DEFAULT 0, '
+            'uploaded INTEGER DEFAULT 0)')
+        # pending checkpoints wait for the upload of their rows
+        for table in ['checkpoints', 'pending_checkpoints']:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS {} ('
+                'path TEXT PRIMARY KEY, '
+                '"offset" INTEGER, '
+                'fingerprint TEXT, '
+                'timestamp TEXT)'.format(table))
+        self.connection.commit()
+
+    def get_record(self, path):
+        """
+        Get the record of the file in its current state, the content is
+        hashed only if its size or mtime differ from the manifest
+        :param path: Path to the source file
+        :return record: dictionary describing the file, statuses are reset
+                        if the content changed
+        """
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        record = {'path': path,
+                  'size': stat.st_size,
+                  'mtime': stat.st_mtime,
+                  'hash': None,
+                  'converted': 0,
+                  'uploaded': 0}
+
+        stored = self.connection.execute(
+            'SELECT size, mtime, hash, converted, uploaded FROM files '
+            'WHERE path = ?', (path,)).fetchone()
+
+        if stored is not None and stored[:2] == (stat.st_size,
+                                                 stat.st_mtime):
+            record.update({'hash': stored[2]})
+        else:
+            record.update({'hash': get_file_hash(path)})
+
+        if stored is not None and stored[2] == record['hash']:
+            record.update({'converted': stored[3], 'uploaded': stored[4]})
+
+        return record
+
+    def save(self, record):
+        """
+        Save the record of the file
+        :param record: dictionary from get_record
+        """
+
+        self.connection.execute(
+            'INSERT OR REPLACE INTO files '
+            '(path, size, mtime, hash, converted, uploaded) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (record['path'], record['size'], record['mtime'], record['hash'],
+             record['converted'], record['uploaded']))
+        self.connection.commit()
+
+    def get_checkpoint(self, path):
+        """
+        Get the checkpoint of reading of a growing file
+        :param path: Path to the source file
+        :return checkpoint: dictionary with offset of the first unread byte,
+                            fingerprint of the read part and the last read
+                            timestamp (None values if not read yet)
+        """
+
+        path = os.path.abspath(path)
+        stored = self.connection.execute(
+            'SELECT "offset", fingerprint, timestamp FROM checkpoints '
+            'WHERE path = ?', (path,)).fetchone() or (None, None, None)
+
+        return {'path': path,
+                'offset': stored[0],
+                'fingerprint': stored[1],
+                'timestamp': stored[2]}
+
+    def save_checkpoint(self, checkpoint, pending=False):
+        """
+        Save the checkpoint of reading of a growing file
+        :param checkpoint: dictionary from get_checkpoint
+        :param pending: save the checkpoint as pending, it is used only after
+                        commit_checkpoints (when its rows are uploaded)
+        """
+
+        self.connection.execute(
+            'INSERT OR REPLACE INTO {} '
+            '(path, "offset", fingerprint, timestamp) VALUES (?, ?, ?, ?)'
+            ''.format('pending_checkpoints' if pending else 'checkpoints'),
+            (checkpoint['path'], checkpoint['offset'],
+             checkpoint['fingerprint'], checkpoint['timestamp']))
+        self.connection.commit()
+
+    def commit_checkpoints(self, paths):
+        """
+        Replace checkpoints of files with their pending checkpoints
+        :param paths: Paths to source files (or directories containing them)
+                      whose rows were uploaded
+        """
+
+        prefixes = [os.path.abspath(p) for p in paths]
+        pending = [r[0] for r in self.connection.execute(
+            'SELECT path FROM pending_checkpoints')]
+
+        for path in pending:
+            if not any(path == p or path.startswith(p.rstrip(os.sep) + os.sep)
+                       for p in prefixes):
+                continue
+            self.connection.execute(
+                'INSERT OR REPLACE INTO checkpoints '
+                '(path, "offset", fingerprint, timestamp) '
+                'SELECT path, "offset", fingerprint, timestamp '
+                'FROM pending_checkpoints WHERE path = ?', (path,))
+            self.connection.execute(
+                'DELETE FROM pending_checkpoints WHERE path = ?', (path,))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def get_file_hash(path, blockSize=1048576):
+    """
+    Get SHA-1 hash of the file content
+    :param path: Path to the file
+    :param blockSize: Number of bytes read at once
+    :return: hexadecimal digest
+    """
+
+    sha = hashlib.sha1()
+
+    with open(path, 'rb') as f:
+        block = f.read(blockSize)
+        while block:
+            sha.update(block)
+            block = f.read(blockSize)
+
+    return sha.hexdigest()
+
+
+def get_manifest_path(geometryIndex):
+    """
+    Get the default path to the manifest, next to the geometry index
+    :param geometryIndex: Path to the CSV file with procedures coords metadata
+    :return: path to the SQLite file
+    """
+
+    return '{}_manifest.sqlite'.format(os.path.splitext(geometryIndex)[0])
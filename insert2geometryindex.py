@@ -21,12 +21,13 @@
  ***************************************************************************/
 """
 
-import gpxpy
-import gpxpy.gpx
 import argparse
+import multiprocessing
 from pathlib import Path
 from os import sep
-from istsosdat import standardize_norwegian
+from names import get_name_variants
+from spatialindex import SpatialIndex, build_spatial_index
+from geometryindex import get_geometry_index, is_sqlite_index
 
 
 def main():
@@ -38,103 +39,159 @@ def main():
                               args.__dict__['gpx_path'].rsplit(sep, 1)[0],
                               sep))
 
-    yetImported = list()
-    if Path(args.__dict__['index_file']).is_file():
-        yetImported = get_imported_procedures(args.__dict__['index_file'])
-        f = open(args.__dict__['index_file'], 'a')
+    if args.__dict__['d'] is False:
+        files = [args.__dict__['gpx_path']]
+    else:
+        files = get_gpx_files(args.__dict__['gpx_path'])
+
+    waypoints = read_gpx_files(files, args.__dict__['jobs'])
+
+    indexFile = args.__dict__['index_file']
+    yetImported = set()
+    spatialIndex = None
+    if Path(indexFile).is_file() or is_sqlite_index(indexFile):
+        yetImported = get_imported_procedures(indexFile)
+        if args.__dict__['tolerance']:
+            spatialIndex = build_spatial_index(indexFile)
+        mode = 'a'
     else:
         print('New geometry index file named {} will be created.'.format(
-            args.__dict__['index_file']))
-        f = open(args.__dict__['index_file'], 'w')
-        f.write('procid,[multiple_procnames],crs,x,y\n')
+            indexFile))
+        if args.__dict__['tolerance']:
+            spatialIndex = SpatialIndex()
+        mode = 'w'
+
+    newProcedures = list()
+    for name, longitude, latitude in waypoints:
+        waypointNames = get_name_variants(name)
+
+        if not yetImported.isdisjoint(waypointNames):
+            continue
+
+        if spatialIndex is not None:
+            nearest = spatialIndex.nearest(longitude, latitude,
+                                           args.__dict__['tolerance'])
+            if nearest is not None:
+                print('Waypoint {} skipped, it is {:.1f} m from procedure '
+                      '{}'.format(name, nearest[0], nearest[1]['procid']))
+                continue
+            spatialIndex.add(longitude, latitude,
+                             {'procid': waypointNames[0]})
+
+        yetImported.update(waypointNames)
+        newProcedures.append((list(waypointNames), longitude, latitude))
+
+    if is_sqlite_index(indexFile):
+        geometryIndex = get_geometry_index(indexFile)
+        for names, longitude, latitude in newProcedures:
+            geometryIndex.add_record(names, 'WGS84', longitude, latitude)
+        geometryIndex.commit()
+    else:
+        with open(indexFile, mode) as f:
+            if mode == 'w':
+                f.write('procid,[multiple_procnames],crs,x,y\n')
+            f.write(''.join('{},WGS84,{},{}\n'.format(','.join(names),
+                                                      longitude, latitude)
+                            for names, longitude, latitude in newProcedures))
 
-    if args.__dict__['d'] is False:
-        gpx_file = open(args.__dict__['gpx_path'], 'r')
-        gpx = gpxpy.parse(gpx_file)
+    print('{} new procedures written into {}'.format(len(newProcedures),
+                                                     indexFile))
 
-        for waypoint in gpx.waypoints:
-            waypointNames = get_possible_procedure_names(waypoint)
 
-            if not any(i in yetImported for i in waypointNames):
-                names = ','.join(waypointNames)
-                f.write('{},33W,{},{}\n'.format(names,
-                                                waypoint.latitude,
-                                                waypoint.longitude))
+def read_gpx_files(files, jobs=1):
+    """
+    Read waypoints from GPX files, in parallel processes if jobs > 1
+    :param files: list of paths to GPX files
+    :param jobs: Number of processes reading the files in parallel
+    :return waypoints: list of tuples (name, longitude, latitude) in the
+                       order of files
+    """
+
+    if jobs > 1 and len(files) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(files)))
+        try:
+            # map keeps the order of files, so the first waypoint wins
+            results = pool.map(read_gpx_waypoints, files, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
     else:
-        import glob
-        files = glob.glob("{}*.gpx".format(args.__dict__['gpx_path']))
-        for f in glob.glob("{}*.GPX".format(args.__dict__['gpx_path'])):
-            files.append(f)
+        results = [read_gpx_waypoints(gpxFile) for gpxFile in files]
+
+    return [waypoint for result in results for waypoint in result]
 
-        for file in files:
-            gpx_file = open(file, 'r')
-            gpx = gpxpy.parse(gpx_file)
 
-            for waypoint in gpx.waypoints:
-                waypointNames = get_possible_procedure_names(waypoint)
+def read_gpx_waypoints(gpxFile):
+    """
+    Read named waypoints from a GPX file
+    :param gpxFile: Path to the GPX file
+    :return: list of tuples (name, longitude, latitude)
+    """
 
-                if not any(i in yetImported for i in waypointNames):
-                    names = ','.join(waypointNames)
-                    f.write('{},WGS84,{},{}\n'.format(names,
-                                                      waypoint.longitude,
-                                                      waypoint.latitude))
+    return list(iter_gpx_waypoints(gpxFile))
 
 
-def get_imported_procedures(csvFile):
+def iter_gpx_waypoints(gpxFile):
     """
-    Get names of procedures that were imported anytime before
-    :param csvFile: csvFile containing procedures geometry
-    :return namesList: List of names of imported procedures
+    Read named waypoints from a GPX file as a stream of elements, tracks and
+    routes are skipped without building their points (generator)
+    :param gpxFile: Path to the GPX file
+    :return: yields tuples (name, longitude, latitude)
     """
 
-    namesList = list()
+    from xml.etree.ElementTree import iterparse
 
-    with open(csvFile, 'r') as openedCsv:
-        openedCsv.readline()
-        for line in openedCsv.readlines():
-            for i in line.split(',')[:-3]:
-                namesList.append(i)
+    with open(gpxFile, 'rb') as openedGpx:
+        for event, element in iterparse(openedGpx):
+            tag = element.tag.rsplit('}', 1)[-1]
 
-    return namesList
+            if tag == 'wpt':
+                name = None
+                for child in element:
+                    if child.tag.rsplit('}', 1)[-1] == 'name':
+                        name = (child.text or '').strip()
+                if name:
+                    yield (name,
+                           float(element.get('lon')),
+                           float(element.get('lat')))
+                element.clear()
+            elif tag in ['trkpt', 'rtept', 'trkseg', 'trk', 'rte']:
+                element.clear()
 
 
-def get_possible_procedure_names(procedure):
+def get_gpx_files(path):
     """
-    Get all often used variants of procedure name
-    :param procedure: Name of procedure
-    :return names: List containing mostly used variations of procedure name
+    Get all GPX files in the directory
+    :param path: path to the directory (or a prefix of files in it)
+    :return files: sorted list of paths to GPX files
     """
 
-    name = standardize_norwegian(procedure.name)
-
-    if 'TOV' in name:
-        name = ''.join(name.split('TOV'))
-    if 'Nyveg' in name:
-        name = ''.join(name.split('Nyveg'))
-    if 'NYV' in name:
-        name = ''.join(name.split('NYV'))
-    if 'Veg' in name:
-        name = ''.join(name.split('Veg'))
-    while name[0].isalpha() is False:
-        name = name[1:]
-    if '--' in name:
-        name = '-'.join(name.split('--'))
-
-    names = [name]
-
-    if '-' in name:
-        names.append(''.join(name.split('-')))
-        names.append('_'.join(name.split('-')))
-    else:
-        for i in reversed(range(len(name))):
-            try:
-                int(name[i])
-            except:
-                names.append('-'.join([name[:i + 1], name[i + 1:]]))
-                names.append('_'.join([name[:i + 1], name[i + 1:]]))
-                break
+    import glob
+    files = glob.glob("{}*.gpx".format(path))
+    for gpxFile in glob.glob("{}*.GPX".format(path)):
+        files.append(gpxFile)
 
-    return names
+    return sorted(files)
+
+
+def get_imported_procedures(csvFile):
+    """
+    Get names of procedures that were imported anytime before
+    :param csvFile: csvFile (or SQLite file) containing procedures geometry
+    :return namesSet: Set of names (and aliases) of imported procedures
+    """
+
+    if is_sqlite_index(csvFile):
+        return get_geometry_index(csvFile).get_names()
+
+    namesSet = set()
+
+    with open(csvFile, 'r') as openedCsv:
+        openedCsv.readline()
+        for line in openedCsv:
+            namesSet.update(line.split(',')[:-3])
+
+    return namesSet
 
 
 if __name__ == '__main__':
@@ -146,7 +203,8 @@ if __name__ == '__main__':
         type=str,
         dest='index_file',
         required=True,
-        help='Path to the index file')
+        help='Path to the index file (CSV, or SQLite with .sqlite '
+             'extension)')
 
     parser.add_argument(
         '-gpx_path',
@@ -160,6 +218,19 @@ if __name__ == '__main__':
         action='store_true',
         help='Use if you would like to parse all GPX files in the directory')
 
+    parser.add_argument(
+        '-jobs',
+        type=int,
+        default=1,
+        help='Number of processes reading GPX files in parallel')
+
+    parser.add_argument(
+        '-tolerance',
+        type=float,
+        help='Skip waypoints closer than the tolerance (in meters) to any '
+             'procedure of the index, even with a different name (re-surveyed '
+             'stations)')
+
     args = parser.parse_args()
 
     main()
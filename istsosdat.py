@@ -21,14 +21,63 @@
  ***************************************************************************/
 """
 
+import hashlib
+import heapq
+import locale
+import os
+import time
 from os import sep
+import runstats
+from names import standardize_name
 
+# compiled timestamp parsers in format {(timestampFormat, offset): parser}
+_timestampParsers = dict()
 
-def get_dat_filepath(originalPath, procedure=None):
+# policies of merging observations with the same timestamp
+duplicatePolicies = ['first', 'last', 'error']
+
+
+def convert_files(files, convertFile, *args):
+    """
+    convert each of given files with convertFile and collect their results
+    :param files: list of paths to the original files
+    :param convertFile: function converting one file, called as
+                        convertFile(file, *args) and returning the .dat path
+    :param args: other arguments passed to convertFile
+    :return results: list of tuples (path to the original file, error message
+                     or None if the file was converted successfully)
+    """
+
+    results = list()
+
+    for file in files:
+        try:
+            convertFile(file, *args)
+            results.append((file, None))
+        except Exception as e:
+            results.append((file, '{}: {}'.format(type(e).__name__, e)))
+
+    return results
+
+
+def remove_failed_dat(datPath):
+    """
+    remove partially written .dat file after a failed conversion
+    :param datPath: path to the .dat file
+    """
+
+    if os.path.isfile(datPath):
+        os.remove(datPath)
+
+
+def get_dat_filepath(originalPath, procedure=None, timestampSuffix=None):
     """
     get the path to .dat file and give it today's timestamp suffix if not given
     :param originalPath: path to the original file
     :param procedure: who provides the observations
+    :param timestampSuffix: suffix in format YYYYMMDDhhmmss used instead of
+                            today's timestamp (to get the same name in
+                            parallel runs)
     :return datPath: path to .dat file with timestamp as suffix
     """
 
@@ -61,8 +110,8 @@ def get_dat_filepath(originalPath, procedure=None):
                 datPath = '{}29235959000.dat'.format(prefix)
 
     except ValueError:
-        import time
-        timestampSuffix = time.strftime('%Y%m%d%H%M%S')
+        if not timestampSuffix:
+            timestampSuffix = time.strftime('%Y%m%d%H%M%S')
 
         if procedure:
             prefix = '{}{}{}'.format(originalPath.rsplit(sep, 1)[0],
@@ -88,23 +137,21 @@ def get_header(headerLine, timestampColumn, observationColumns,
     :param observationColumns: Names of columns with observation data
     :param timeColumn: Name of column with times if date and time in separates
     :return header: istSOS acceptable header with user's desired columns
-    :return indexes: dictionary in format {observation name: column index}
+    :return indexes: ObservationPlan (dictionary in format
+                     {observation name: column index} with the delimiter)
     :return timeColumnIndex: index of column with times if they are separated
     """
 
-    indexes = dict()
+    indexes = ObservationPlan(delimiter=sniff_delimiter(headerLine))
     header = str()
     index = 0
+    timestampColumn = standardize_norwegian(timestampColumn, shorten=True)
 
-    if '\t' in headerLine:
-        headerLine = headerLine.split('\t')
-    elif ';' in headerLine:
-        headerLine = headerLine.split(';')
-    elif ',' in headerLine:
-        headerLine = headerLine.split(',')
+    if indexes.delimiter:
+        headerLine = headerLine.split(indexes.delimiter)
 
     for column in headerLine:
-        if column == standardize_norwegian(timestampColumn, shorten=True):
+        if column == timestampColumn:
             indexes.update(
                 {'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601': index})
             header += 'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601,'
@@ -136,83 +183,151 @@ def get_standardized_timestamp(originalTimestamp, timestampFormat, offset):
     :return standardizedTimestamp: timestamp in istSOS compatible format
     """
 
+    return get_timestamp_parser(timestampFormat, offset)(originalTimestamp)
+
+
+def get_timestamp_parser(timestampFormat, offset):
+    """
+    get parser of timestamps in given format, compile it only the first time
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :return parser: function transforming timestamp in original format into
+                    YYYY-MM-DDTHH:MM:SS.SSSSSS+HH:MM format
+    """
+
+    try:
+        return _timestampParsers[(timestampFormat, offset)]
+    except KeyError:
+        parser = compile_timestamp_parser(timestampFormat, offset)
+        _timestampParsers.update({(timestampFormat, offset): parser})
+        return parser
+
+
+def compile_timestamp_parser(timestampFormat, offset):
+    """
+    create parser of timestamps in given format with all format dependent
+    work (offset suffix, century of two digits years) done only once
+    (parsers concatenate strings, it is faster than format() for each row)
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :return parser: function transforming timestamp in original format into
+                    YYYY-MM-DDTHH:MM:SS.SSSSSS+HH:MM format
+    """
+
     # TODO: Support more formats
     if timestampFormat == 'YYYY-MM-DDTHH:MM:SS.SSSSSS+HH:MM':
-        standardizedTimestamp = timestampFormat
+        def parser(originalTimestamp):
+            return originalTimestamp
     elif timestampFormat == 'YYYY-MM-DD HH:MM':
-        standardizedTimestamp = '{}T{}:00.000000{}'.format(
-            originalTimestamp[:10],
-            originalTimestamp[11:],
-            offset)
+        suffix = ':00.000000{}'.format(offset)
+
+        def parser(originalTimestamp):
+            return originalTimestamp[:10] + 'T' + originalTimestamp[11:] + \
+                suffix
     elif timestampFormat == 'YYYYMMDD':
-        standardizedTimestamp = '{}-{}-{}T00:00:00.000000{}'.format(
-            originalTimestamp[:4],
-            originalTimestamp[4:6],
-            originalTimestamp[6:],
-            offset)
+        suffix = 'T00:00:00.000000{}'.format(offset)
+        dates = DateMemo(lambda d: '{}-{}-{}'.format(d[:4], d[4:6], d[6:]))
+
+        def parser(originalTimestamp):
+            return dates[originalTimestamp] + suffix
     elif timestampFormat == 'DATE+TIME':
-        standardizedTimestamp = '{}-{}-{}T{}:{}:{}.000000{}'.format(
-            originalTimestamp[10:14],
-            originalTimestamp[7:9],
-            originalTimestamp[4:6],
-            originalTimestamp[18:20],
-            originalTimestamp[21:23],
-            originalTimestamp[24:26],
-            offset)
+        suffix = '.000000{}'.format(offset)
+        dates = DateMemo(lambda d: '{}-{}-{}'.format(d[6:10], d[3:5], d[:2]))
+
+        def parser(originalTimestamp):
+            return dates[originalTimestamp[4:14]] + 'T' + \
+                originalTimestamp[18:20] + ':' + originalTimestamp[21:23] + \
+                ':' + originalTimestamp[24:26] + suffix
     elif timestampFormat == 'YYYYMMDDHH':
-        standardizedTimestamp = '{}-{}-{}T{}:00:00.000000{}'.format(
-            originalTimestamp[:4],
-            originalTimestamp[4:6],
-            originalTimestamp[6:8],
-            originalTimestamp[8:],
-            offset)
+        suffix = ':00:00.000000{}'.format(offset)
+        dates = DateMemo(lambda d: '{}-{}-{}'.format(d[:4], d[4:6], d[6:8]))
+
+        def parser(originalTimestamp):
+            return dates[originalTimestamp[:8]] + 'T' + \
+                originalTimestamp[8:] + suffix
     elif timestampFormat == 'DD.MM.YYYY':
-        originalTimestamp = originalTimestamp.split('.')
-        standardizedTimestamp = '{}-{}-{}T00:00:00.000000{}'.format(
-            originalTimestamp[2],
-            originalTimestamp[1],
-            originalTimestamp[0],
-            offset)
-    elif timestampFormat == 'DD.MM.YY HH:MM:SS':
-        import time
-        thisYear = time.strftime('%Y')
-
-        timestampParts = [originalTimestamp[:2], originalTimestamp[3:5],
-                          originalTimestamp[6:8], originalTimestamp[9:11],
-                          originalTimestamp[12:14], originalTimestamp[15:17]]
-
-        if int(timestampParts[2]) <= int(thisYear[2:]):
-            timestampParts[2] = '20{}'.format(timestampParts[2])
+        suffix = 'T00:00:00.000000{}'.format(offset)
+
+        def parse_date(date):
+            date = date.split('.')
+            return '{}-{}-{}'.format(date[2], date[1], date[0])
+
+        dates = DateMemo(parse_date)
+
+        def parser(originalTimestamp):
+            return dates[originalTimestamp] + suffix
+    elif timestampFormat in ['DD.MM.YY HH:MM:SS', 'DD.MM.YY HH:MM:SS AM/PM']:
+        suffix = '.000000{}'.format(offset)
+        dates = DateMemo(get_two_digits_year_date_parser())
+
+        if timestampFormat == 'DD.MM.YY HH:MM:SS':
+            def parser(originalTimestamp):
+                return dates[originalTimestamp[:8]] + 'T' + \
+                    originalTimestamp[9:11] + ':' + \
+                    originalTimestamp[12:14] + ':' + \
+                    originalTimestamp[15:17] + suffix
         else:
-            timestampParts[2] = '19{}'.format(timestampParts[2])
-
-        standardizedTimestamp = '{}-{}-{}T{}:{}:{}.000000{}'.format(
-            timestampParts[2], timestampParts[1],
-            timestampParts[0], timestampParts[3],
-            timestampParts[4], timestampParts[5], offset)
-    elif timestampFormat == 'DD.MM.YY HH:MM:SS AM/PM':
-        import time
-        thisYear = time.strftime('%Y')
-
-        timestampParts = [originalTimestamp[:2], originalTimestamp[3:5],
-                          originalTimestamp[6:8], originalTimestamp[9:11],
-                          originalTimestamp[12:14], originalTimestamp[15:17]]
-
-        if originalTimestamp[-2:] == 'PM':
-            timestampParts[3] = str(int(originalTimestamp[9:11]) + 12)
-        if int(timestampParts[2]) <= int(thisYear[2:]):
-            timestampParts[2] = '20{}'.format(timestampParts[2])
+            def parser(originalTimestamp):
+                hour = int(originalTimestamp[9:11]) % 12
+                if originalTimestamp[-2:] == 'PM':
+                    hour += 12
+
+                return '{}T{:02d}:{}:{}{}'.format(dates[originalTimestamp[:8]],
+                                                  hour,
+                                                  originalTimestamp[12:14],
+                                                  originalTimestamp[15:17],
+                                                  suffix)
+    else:
+        raise ValueError("Your timestamp format {} isn't supported".format(
+            timestampFormat))
+
+    return parser
+
+
+def get_two_digits_year_date_parser():
+    """
+    get function transforming DD.MM.YY dates into YYYY-MM-DD, years not later
+    than the current one are considered as 20YY, the others as 19YY
+    :return: function transforming DD.MM.YY date into YYYY-MM-DD
+    """
+
+    pivot = int(time.strftime('%y'))
+
+    def parse_date(date):
+        if int(date[6:8]) <= pivot:
+            century = '20'
         else:
-            timestampParts[2] = '19{}'.format(timestampParts[2])
+            century = '19'
 
-        standardizedTimestamp = '{}-{}-{}T{}:{}:{}.000000{}'.format(
-            timestampParts[2], timestampParts[1],
-            timestampParts[0], timestampParts[3],
-            timestampParts[4], timestampParts[5], offset)
-    else:
-        print("Your timestamp format isn't supported")
+        return '{}{}-{}-{}'.format(century, date[6:8], date[3:5], date[:2])
+
+    return parse_date
+
+
+class DateMemo(dict):
+    """
+    Memo of already transformed date parts of timestamps (loggers write many
+    rows per day), cleared when it grows over maxSize items
+    """
+
+    def __init__(self, parseDate, maxSize=4096):
+        """
+        :param parseDate: function transforming the date part of a timestamp
+        :param maxSize: maximum number of remembered dates
+        """
+
+        dict.__init__(self)
+        self.parseDate = parseDate
+        self.maxSize = maxSize
 
-    return standardizedTimestamp
+    def __missing__(self, date):
+        if len(self) >= self.maxSize:
+            self.clear()
+
+        standardizedDate = self.parseDate(date)
+        self[date] = standardizedDate
+
+        return standardizedDate
 
 
 def get_observations(line, timestampFormat, offset, columnsIndexes):
@@ -221,40 +336,412 @@ def get_observations(line, timestampFormat, offset, columnsIndexes):
     :param line: Line with all observations from the original file
     :param timestampFormat: Format in which are timestamps saved
     :param offset: offset of timestamp
-    :param columnsIndexes: dict in format {observation name: column index}
+    :param columnsIndexes: ObservationPlan from get_header (or a dict in
+                           format {observation name: column index})
     :return outLine: Line with desired observations separated with ','
     """
 
-    index = 0
-    columns = list()
+    for outLine in format_observations(project_observations(
+            [line], timestampFormat, offset, columnsIndexes)):
+        return outLine
+
+    return ''
+
+
+def project_observations(lines, timestampFormat, offset, columnsIndexes):
+    """
+    extract only desired observed properties from lines of file (generator)
+    :param lines: iterable of lines with all observations (without header)
+    :param timestampFormat: Format in which are timestamps saved
+    :param offset: offset of timestamp
+    :param columnsIndexes: ObservationPlan from get_header (or a dict in
+                           format {observation name: column index})
+    :return: yields lists of desired values, blank lines are skipped
+    """
+
+    if not isinstance(columnsIndexes, ObservationPlan):
+        columnsIndexes = ObservationPlan(columnsIndexes)
+
+    columns = columnsIndexes.compile(timestampFormat, offset)
+    delimiter = columnsIndexes.delimiter
+    # columns after the last wanted one are not split at all
+    maxSplit = columns[-1][0] + 1
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+
+        cells = line.split(delimiter or sniff_delimiter(line), maxSplit)
+
+        try:
+            yield [transform(cells[index]) for index, transform in columns]
+        except IndexError:
+            raise ValueError('Line "{}" has less columns than the '
+                             'header'.format(line))
+
+
+def project_cells(rows, timestampFormat, offset, columnsIndexes):
+    """
+    extract only desired observed properties from rows of typed cells of a
+    spreadsheet (generator)
+    :param rows: iterable of sequences of cells (text, numbers; the column
+                 with timestamps has to be text)
+    :param timestampFormat: Format in which are timestamps saved
+    :param offset: offset of timestamp
+    :param columnsIndexes: ObservationPlan with indexes of cells in rows
+    :return: yields lists of desired values
+    """
+
+    columns = columnsIndexes.compile(timestampFormat, offset, typed=True)
+
+    for cells in rows:
+        yield [transform(cells[index]) for index, transform in columns]
+
+
+def format_observations(rows):
+    """
+    format rows of observations as lines of .dat file (generator)
+    :param rows: iterable of lists of values
+    :return: yields lines with values separated with ','
+    """
+
+    for row in rows:
+        yield ','.join(row) + '\n'
+
+
+def write_dat(datPath, rows, batchSize=1000, append=False):
+    """
+    write observations into .dat file in batches of lines, the file is
+    removed (or an appended file is truncated back) if anything fails
+    :param datPath: path to the .dat file
+    :param rows: iterable of lists of values, the first one with the names
+                 of columns (as yielded by iter_observations)
+    :param batchSize: number of lines written at once
+    :param append: append observations to an existing .dat file (keeping
+                   its header)
+    :return count: number of written observations
+    """
+
+    appending = append and os.path.isfile(datPath)
+    if appending:
+        originalSize = os.path.getsize(datPath)
+        o = open(datPath, 'a')
+    else:
+        o = open(datPath, 'w')
+    count = 0
+
+    try:
+        rows = iter(rows)
+        header = ','.join(next(rows)) + '\n'
+        if not appending:
+            o.write(header)
+
+        batch = list()
+        # time spent in writing, the rest is reading and parsing of rows
+        writeSeconds = 0
+        for line in format_observations(rows):
+            batch.append(line)
+            if len(batch) == batchSize:
+                start = time.time()
+                o.writelines(batch)
+                writeSeconds += time.time() - start
+                count += batchSize
+                batch = list()
+
+        start = time.time()
+        o.writelines(batch)
+        writeSeconds += time.time() - start
+        count += len(batch)
+    except Exception:
+        if appending:
+            o.flush()
+            o.truncate(originalSize)
+            o.close()
+        else:
+            o.close()
+            remove_failed_dat(datPath)
+        raise
+
+    o.close()
+
+    runstats.add('write', writeSeconds, count,
+                 os.path.getsize(datPath) - (originalSize if appending else 0),
+                 1)
+
+    return count
+
+
+def merge_observations(streams, duplicates='first', counts=None):
+    """
+    merge streams of observations sorted by time into one stream with
+    strictly increasing timestamps (generator), only the first row of each
+    stream is held in memory
+    :param streams: iterables of lists of values, the first one with the
+                    names of columns (as yielded by iter_observations), all
+                    with the same columns and offset of timestamps
+    :param duplicates: policy for observations with the same timestamp,
+                       'first' keeps the one from the earliest stream,
+                       'last' the one from the latest stream and 'error'
+                       raises ValueError if they differ (observations older
+                       than already merged ones are dropped or raise
+                       ValueError with 'error' too)
+    :param counts: dictionary updated with the number of dropped
+                   observations under the key 'dropped'
+    :return: yields list of names of columns first, then lists of values
+    """
+
+    if duplicates not in duplicatePolicies:
+        raise ValueError('Unknown policy for duplicates {}'.format(
+            duplicates))
+
+    streams = [iter(s) for s in streams]
+    header = None
+    for stream in streams:
+        streamHeader = next(stream)
+        if header is None:
+            header = streamHeader
+        elif streamHeader != header:
+            raise ValueError('Merged observations have different columns '
+                             '({} and {})'.format(','.join(header),
+                                                  ','.join(streamHeader)))
+
+    if header is None:
+        return
+    yield header
+
+    timeIndex = header.index('urn:ogc:def:parameter:x-istsos:1.0:time:iso8601')
+
+    # rows are compared by timestamps, equal ones by their streams
+    merged = heapq.merge(*[get_time_keys(stream, timeIndex, s) for s, stream
+                           in enumerate(streams)])
+
+    pending = None
+    dropped = 0
+    for (timestamp, s, n), row in merged:
+        if pending is None:
+            pending = row
+            offset = timestamp[26:]
+            continue
+
+        if timestamp[26:] != offset:
+            raise ValueError('Cannot merge timestamps with different '
+                             'offsets ({} and {})'.format(
+                                 pending[timeIndex], timestamp))
+
+        if timestamp > pending[timeIndex]:
+            yield pending
+            pending = row
+        elif timestamp < pending[timeIndex]:
+            if duplicates == 'error':
+                raise ValueError('Observations are not sorted by time ({} '
+                                 'after {})'.format(timestamp,
+                                                    pending[timeIndex]))
+            dropped += 1
+        elif duplicates == 'error' and row != pending:
+            raise ValueError('Conflicting observations at {} ({} and '
+                             '{})'.format(timestamp, ','.join(pending),
+                                          ','.join(row)))
+        elif duplicates == 'last':
+            dropped += 1
+            pending = row
+        else:
+            dropped += 1
+
+    if counts is not None:
+        counts.update({'dropped': dropped})
+
+    if pending is not None:
+        yield pending
+
+
+def get_time_keys(rows, timeIndex, streamIndex):
+    """
+    add keys for merging to rows of observations (generator)
+    :param rows: iterable of lists of values
+    :param timeIndex: index of timestamps in rows
+    :param streamIndex: index of the stream of rows
+    :return: yields tuples ((timestamp, stream index, row index), row)
+    """
+
+    for n, row in enumerate(rows):
+        yield (row[timeIndex], streamIndex, n), row
+
+
+def iter_tail_lines(path, headerLinesCount, checkpoint):
+    """
+    read header lines and then only complete lines appended after the
+    checkpoint (generator), the checkpoint is updated in place
+    :param path: path to the file
+    :param headerLinesCount: number of lines before the first observation
+    :param checkpoint: dictionary with offset of the first unread byte and
+                       fingerprint of the read part (see
+                       ImportManifest.get_checkpoint), lines are read from
+                       the first observation if the file was truncated or
+                       rotated and 'restarted' is set to True then
+    :return: yields header lines first, then new lines (with '\n' endings)
+    """
+
+    with open(path, 'rb') as f:
+        header = [f.readline() for i in range(headerLinesCount)]
+        dataOffset = f.tell()
+        offset = checkpoint['offset']
+
+        checkpoint.update({'restarted': True})
+        if offset is not None and \
+                dataOffset <= offset <= os.fstat(f.fileno()).st_size:
+            if get_fingerprint(f, dataOffset, offset) == \
+                    checkpoint['fingerprint']:
+                checkpoint.update({'restarted': False})
+
+        if checkpoint['restarted'] is True:
+            offset = dataOffset
+
+        for line in header:
+            yield decode_line(line)
+
+        f.seek(offset)
+        for line in iter(f.readline, b''):
+            # the last line can be still being written by the logger
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            yield decode_line(line)
+
+        checkpoint.update({'offset': offset,
+                           'fingerprint': get_fingerprint(f, dataOffset,
+                                                          offset)})
+
+
+def get_fingerprint(f, dataOffset, offset, tailSize=256):
+    """
+    get fingerprint of the header and bytes before the offset, used to
+    detect rewritten files
+    :param f: file opened in binary mode
+    :param dataOffset: offset of the first observation (end of the header)
+    :param offset: offset of the first unread byte
+    :param tailSize: number of bytes before the offset included
+    :return: hexadecimal SHA-1 digest
+    """
+
+    sha = hashlib.sha1()
+
+    f.seek(0)
+    sha.update(f.read(dataOffset))
+    f.seek(max(dataOffset, offset - tailSize))
+    sha.update(f.read(offset - max(dataOffset, offset - tailSize)))
+
+    return sha.hexdigest()
+
+
+def decode_line(line):
+    """
+    decode line read in binary mode as it would be read in text mode
+    :param line: bytes of the line
+    :return: line with '\n' ending
+    """
+
+    if not isinstance(line, str):
+        line = line.decode(locale.getpreferredencoding(False))
+
+    return line.rstrip('\r\n') + '\n'
+
+
+def sniff_delimiter(line):
+    """
+    get delimiter of columns used in the line
+    :param line: Line of the original file
+    :return: one of '\t', ';', ',' or None if there is only one column
+    """
 
     if '\t' in line:
-        line = line.split('\t')
+        return '\t'
     elif ';' in line:
-        line = line.split(';')
+        return ';'
     elif ',' in line:
-        line = line.split(',')
+        return ','
 
-    try:
-        for column in line:
-            if index == columnsIndexes[
-              'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601']:
-                columns.append(get_standardized_timestamp(column,
-                                                          timestampFormat,
-                                                          offset))
-            elif index in columnsIndexes.values():
-                columns.append('.'.join(column.split(',')))
-            index += 1
-    except KeyError as e:
-        print('\nKEY ERROR ({}): Column not found\nTry to check index files '
-              'or observation_columns inputs\n'.format(e.__str__()))
-        raise e
-
-    outLine = ','.join(columns)
-    if not outLine.endswith('\n'):
-        outLine += '\n'
-
-    return outLine
+
+def fix_decimal_comma(value):
+    """
+    use decimal point instead of decimal comma
+    :param value: observed value from the original file
+    :return: value with decimal point
+    """
+
+    return value.replace(',', '.')
+
+
+def format_cell(value):
+    """
+    format typed cell of a spreadsheet as an observed value
+    :param value: value of the cell (text or number)
+    :return: value with decimal point
+    """
+
+    if isinstance(value, (float, int)):
+        return str(value)
+
+    return value.replace(',', '.')
+
+
+class ObservationPlan(dict):
+    """
+    Dictionary in format {observation name: column index} remembering the
+    delimiter of the file, compiled into sorted list of wanted columns and
+    their transformations for each timestamp format
+    """
+
+    def __init__(self, indexes=(), delimiter=None):
+        """
+        :param indexes: dict in format {observation name: column index}
+        :param delimiter: delimiter of columns in the file (None to sniff it
+                          on each line)
+        """
+
+        dict.__init__(self, indexes)
+        self.delimiter = delimiter
+        self.compiled = dict()
+
+    def compile(self, timestampFormat, offset, typed=False):
+        """
+        get wanted columns with functions transforming their values
+        :param timestampFormat: Format in which are timestamps saved
+        :param offset: offset of timestamp
+        :param typed: transform typed cells of spreadsheets instead of text
+        :return columns: list of tuples (column index, transform) sorted by
+                         column index
+        """
+
+        try:
+            return self.compiled[(timestampFormat, offset, typed)]
+        except KeyError:
+            pass
+
+        try:
+            timestampIndex = self[
+                'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601']
+        except KeyError as e:
+            print('\nKEY ERROR ({}): Column not found\nTry to check index '
+                  'files or observation_columns inputs\n'.format(e.__str__()))
+            raise e
+
+        parseTimestamp = get_timestamp_parser(timestampFormat, offset)
+        if typed is True:
+            formatValue = format_cell
+        else:
+            formatValue = fix_decimal_comma
+        columns = list()
+
+        for index in sorted(set(self.values())):
+            if index == timestampIndex:
+                columns.append((index, parseTimestamp))
+            else:
+                columns.append((index, formatValue))
+
+        self.compiled.update({(timestampFormat, offset, typed): columns})
+
+        return columns
 
 
 def get_metadata(indexFile, returnUnits=False):
@@ -311,61 +798,22 @@ def get_procedure_id(procedureName, geometryIndex):
     Find name of sensor used on the server for given name used in archive
     :param procedureName: Name of the procedure used in archive
     :param geometryIndex: Path to the CSV file with procedures coords metadata
+                          (or already loaded GeometryIndex)
     :return: Name of procedure for server usage
     """
 
-    procedureName = standardize_norwegian(procedureName)
+    from geometryindex import get_geometry_index
 
-    with open(geometryIndex, 'r') as geometry:
-        for line in geometry.readlines():
-            lineFeatures = line.split(',')
-            if procedureName in lineFeatures or \
-                            '{}-temp'.format(procedureName) in lineFeatures:
-                return lineFeatures[0]
+    with runstats.measure('procedure_lookup') as stage:
+        stage.rows = 1
+        return get_geometry_index(geometryIndex).get_procedure_id(
+            procedureName)
 
 def standardize_norwegian(word, shorten=False):
     """
     Convert word containing norwegian characters to istSOS acceptable standard
+    (see names.standardize_name, results are cached)
     :param shorten: return input string with missing norwegian characters
     """
 
-    if shorten is False:
-        if 'ø' in word:
-            word = 'o'.join(word.split('ø'))
-        if 'Ø' in word:
-            word = 'o'.join(word.split('Ø'))
-        if 'æ' in word:
-            word = 'ae'.join(word.split('æ'))
-        if 'å' in word:
-            word = 'a'.join(word.split('å'))
-        if 'Ы' in word:
-            word = 'o'.join(word.split('Ы'))
-        if 'Э' in word:
-            word = 'O'.join(word.split('Э'))
-        if 'Ж' in word:
-            word = 'a'.join(word.split('Ж'))
-        if 'П' in word:
-            word = 'A'.join(word.split('П'))
-        if 'Å' in word:
-            word = 'A'.join(word.split('Å'))
-    else:
-        if 'ø' in word:
-            word = ''.join(word.split('ø'))
-        if 'Ø' in word:
-            word = ''.join(word.split('Ø'))
-        if 'æ' in word:
-            word = ''.join(word.split('æ'))
-        if 'å' in word:
-            word = ''.join(word.split('å'))
-        if 'Ы' in word:
-            word = ''.join(word.split('Ы'))
-        if 'Э' in word:
-            word = ''.join(word.split('Э'))
-        if 'Ж' in word:
-            word = ''.join(word.split('Ж'))
-        if 'П' in word:
-            word = ''.join(word.split('П'))
-        if 'Å' in word:
-            word = ''.join(word.split('Å'))
-
-    return word
+    return standardize_name(word, shorten)
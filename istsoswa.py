@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ istsoswa
+
+ Upload of observations straight into insertObservation requests of the
+ istSOS WA REST API (without intermediate .dat files)
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import json
+import time
+import requests
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+
+class ObservationUploader(object):
+    """
+    Send observations to the istSOS server in batched insertObservation
+    requests, the same way as scripts/csv2istsos.py does with .dat files
+    """
+
+    def __init__(self, url, service, username=None, password=None,
+                 batchSize=5000):
+        """
+        :param url: istSOS Server address (e.g. http://localhost/istsos)
+        :param service: The name of the service instance
+        :param username: Username used to access istSOS server
+        :param password: Password used to access istSOS server
+        :param batchSize: Maximum number of observations in one request
+        """
+
+        self.serviceURL = '{}/wa/istsos/services/{}'.format(url.rstrip('/'),
+                                                            service)
+        self.batchSize = batchSize
+        # templates in format {(offering, procedure): (aid, observation)}
+        self.templates = dict()
+
+        if username:
+            self.session = get_session((username, password))
+        else:
+            self.session = get_session()
+
+    def get_template(self, offering, procedure):
+        """
+        Get assigned sensor id and an observation template of the procedure
+        (described only once per procedure)
+        :param offering: Offering of the procedure
+        :param procedure: Name of the procedure on the server
+        :return: tuple (assigned sensor id, observation dictionary with
+                 empty values)
+        """
+
+        if (offering, procedure) in self.templates:
+            return self.templates[(offering, procedure)]
+
+        description = get_data(
+            self.session.get('{}/procedures/{}'.format(self.serviceURL,
+                                                       procedure)),
+            'Cannot describe procedure {}'.format(procedure))
+
+        observedProperties = [o['definition'] for o in
+                              description['outputs']]
+        observation = get_data(
+            self.session.get(
+                '{}/operations/getobservation/offerings/{}/procedures/{}/'
+                'observedproperties/{}/eventtime/last'.format(
+                    self.serviceURL, offering, procedure,
+                    ','.join(observedProperties))),
+            'Cannot get observations of procedure {}'.format(procedure))[0]
+
+        template = (description['assignedSensorId'], observation)
+        self.templates.update({(offering, procedure): template})
+
+        return template
+
+    def upload(self, offering, procedure, rows):
+        """
+        Upload observations of one procedure in batches
+        :param offering: Offering of the procedure
+        :param procedure: Name of the procedure on the server
+        :param rows: iterable of lists of values, the first one with the names
+                     of columns (as yielded by convert2dat.iter_observations)
+        :return count: number of uploaded observations
+        """
+
+        if procedure is None:
+            raise ValueError('Procedure not found in the geometry index')
+
+        rows = iter(rows)
+        header = next(rows)
+        aid, template = self.get_template(offering, procedure)
+        columnsIndexes = get_columns_indexes(
+            header, template['result']['DataArray']['field'])
+
+        count = 0
+        batch = list()
+        for row in rows:
+            # missing quality indexes are filled with 100 (raw data)
+            batch.append([row[i] if i is not None else '100'
+                          for i in columnsIndexes])
+            if len(batch) == self.batchSize:
+                self.insert_observations(aid, template, batch)
+                count += len(batch)
+                batch = list()
+
+        if batch:
+            self.insert_observations(aid, template, batch)
+            count += len(batch)
+
+        return count
+
+    def insert_observations(self, aid, template, values):
+        """
+        Send one insertObservation request
+        :param aid: Assigned sensor id of the procedure
+        :param template: Observation dictionary from get_template
+        :param values: list of observations ordered as fields of the template
+        """
+
+        dataArray = dict(template['result']['DataArray'])
+        dataArray.update({'values': values,
+                          'elementCount': str(len(values))})
+
+        # the first field of istSOS observations is always the time
+        observation = dict(template)
+        observation.update({
+            'AssignedSensorId': aid,
+            'samplingTime': {'beginPosition': values[0][0],
+                             'endPosition': values[-1][0]},
+            'result': {'DataArray': dataArray}})
+
+        get_data(
+            post_with_retry(
+                self.session,
+                '{}/operations/insertobservation'.format(self.serviceURL),
+                json.dumps({'ForceInsert': 'true',
+                            'AssignedSensorId': aid,
+                            'Observation': observation})),
+            'Cannot insert observations of procedure {}'.format(
+                observation.get('procedure')))
+
+
+def get_session(auth=None, poolSize=10):
+    """
+    Get a session keeping alive connections to the server
+    :param auth: Authentication accepted by requests (tuple (username,
+                 password) or an instance of HTTPBasicAuth)
+    :param poolSize: Maximum number of connections kept in the pool (use the
+                     number of threads sharing the session)
+    :return session: requests.Session
+    """
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=poolSize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.auth = auth
+
+    return session
+
+
+def post_with_retry(session, url, data, retries=3, backoff=1.0):
+    """
+    Send a POST request, repeat it with exponential backoff only if the
+    connection could not be established (requests are not idempotent, an
+    insertobservation with ForceInsert or a registration of a procedure
+    could be processed twice after a broken connection or a server error)
+    :param session: requests.Session
+    :param url: URL of the request
+    :param data: Body of the request
+    :param retries: Maximum number of repeated requests
+    :param backoff: Seconds to wait before the first repeated request,
+                    doubled for each next one
+    :return response: requests.Response
+    """
+
+    for attempt in range(retries + 1):
+        try:
+            return session.post(url, data=data)
+        except requests.ConnectionError as e:
+            if attempt == retries or not is_connection_failure(e):
+                raise
+
+        time.sleep(backoff * 2 ** attempt)
+
+
+def is_connection_failure(error):
+    """
+    :param error: requests.ConnectionError
+    :return: True if the error was raised before the request was sent
+             (refused or timed out connection, unresolved host)
+    """
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+
+    reason = getattr(error.args[0] if error.args else None, 'reason', None)
+
+    return isinstance(reason, NewConnectionError)
+
+
+def get_columns_indexes(header, fields):
+    """
+    Map fields of the observation template on columns of the data
+    :param header: list of names of columns of the data
+    :param fields: fields of DataArray of the observation template
+    :return: list of indexes of columns in the order of fields (None for
+             quality indexes not present in the data)
+    """
+
+    columnsIndexes = list()
+
+    for field in fields:
+        if field['definition'] in header:
+            columnsIndexes.append(header.index(field['definition']))
+        elif field['definition'].endswith(':qualityIndex'):
+            columnsIndexes.append(None)
+        else:
+            raise ValueError('Observed property {} not found in the '
+                             'data'.format(field['definition']))
+
+    # insert_observations takes the time from the first field
+    if header[columnsIndexes[0]] != \
+            'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601':
+        raise ValueError('The first field of the procedure is not the time')
+
+    return columnsIndexes
+
+
+def get_data(response, message):
+    """
+    Get data from a response of the WA REST API
+    :param response: requests.Response
+    :param message: Error message used if the request was not successful
+    :return: data part of the response
+    """
+
+    try:
+        content = response.json()
+    except ValueError:
+        raise IOError('{} (HTTP {})'.format(message, response.status_code))
+
+    if response.status_code != 200 or not content.get('success'):
+        raise IOError('{} ({})'.format(message, content.get('message')))
+
+    return content.get('data')
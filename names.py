@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ names
+
+ Normalization of names of procedures and columns (norwegian characters)
+ and variants of procedure names used as aliases in the geometry index
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+# norwegian characters (and their broken encodings met in the archive) with
+# their istSOS acceptable replacements
+replacements = [('ø', 'o'), ('Ø', 'o'), ('æ', 'ae'), ('å', 'a'), ('Ы', 'o'),
+                ('Э', 'O'), ('Ж', 'a'), ('П', 'A'), ('Å', 'A')]
+
+# prefixes of procedure names removed to get their short form
+namePrefixes = ['TOV', 'Nyveg', 'NYV', 'Veg']
+
+if hasattr(str, 'maketrans'):
+    _tables = {False: str.maketrans(dict(replacements)),
+               True: str.maketrans(dict((c, None) for c, r in replacements))}
+else:
+    # multibyte characters cannot be translated in python 2 strings
+    _tables = None
+
+
+def memoize(maxSize=4096):
+    """
+    remember results of a function of hashable arguments (functools.lru_cache
+    if available, otherwise a dictionary cleared when it grows over maxSize
+    items)
+    :param maxSize: maximum number of remembered results
+    :return: decorator
+    """
+
+    try:
+        from functools import lru_cache
+        return lru_cache(maxsize=maxSize)
+    except ImportError:
+        pass
+
+    def decorator(function):
+        results = dict()
+
+        def memoized(*args, **kwargs):
+            key = args + tuple(sorted(kwargs.items()))
+            try:
+                return results[key]
+            except KeyError:
+                if len(results) >= maxSize:
+                    results.clear()
+                result = function(*args, **kwargs)
+                results[key] = result
+                return result
+
+        memoized.__doc__ = function.__doc__
+        memoized.cache_clear = results.clear
+
+        return memoized
+
+    return decorator
+
+
+@memoize()
+def standardize_name(word, shorten=False):
+    """
+    Convert word containing norwegian characters to istSOS acceptable standard
+    :param word: Name of a procedure, column or directory
+    :param shorten: return input string with missing norwegian characters
+    :return: standardized name
+    """
+
+    if _tables is not None:
+        return word.translate(_tables[shorten])
+
+    for character, replacement in replacements:
+        if character in word:
+            if shorten is True:
+                replacement = ''
+            word = word.replace(character, replacement)
+
+    return word
+
+
+@memoize()
+def get_name_variants(procedureName):
+    """
+    Get all often used variants of procedure name
+    :param procedureName: Name of procedure (e.g. name of GPX waypoint)
+    :return names: tuple containing mostly used variations of procedure name,
+                   the short standardized name first
+    """
+
+    name = standardize_name(procedureName)
+
+    for prefix in namePrefixes:
+        if prefix in name:
+            name = name.replace(prefix, '')
+    while name[0].isalpha() is False:
+        name = name[1:]
+    if '--' in name:
+        name = name.replace('--', '-')
+
+    names = [name]
+
+    if '-' in name:
+        names.append(name.replace('-', ''))
+        names.append(name.replace('-', '_'))
+    else:
+        for i in reversed(range(len(name))):
+            try:
+                int(name[i])
+            except ValueError:
+                names.append('-'.join([name[:i + 1], name[i + 1:]]))
+                names.append('_'.join([name[:i + 1], name[i + 1:]]))
+                break
+
+    return tuple(names)
+
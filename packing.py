@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ packing
+
+ Packing of .dat files of procedures into as few large .dat files as
+ possible in one directory, so that all procedures of an offering can be
+ uploaded with one run of csv2istsos
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import datetime
+import os
+import shutil
+from istsosdat import merge_observations
+from staging import timeColumn, get_offset_minutes
+
+
+def pack_procedure(datFiles, packPath, procedure, packRows=100000,
+                   duplicates='first'):
+    """
+    pack .dat files of one procedure into files with at most packRows
+    observations merged by time, the original files are copied unchanged if
+    they cannot be merged (different columns or offsets), conflicts of
+    observations raise ValueError with the 'error' policy
+    :param datFiles: paths to .dat files of the procedure
+    :param packPath: path to the directory with packed files
+    :param procedure: name of the procedure (prefix of packed files)
+    :param packRows: maximal number of observations in one packed file
+    :param duplicates: policy for observations with the same timestamp (see
+                       istsosdat.merge_observations)
+    :return packedFiles: list of paths to packed files
+    """
+
+    datFiles = sorted(datFiles)
+    packedFiles = list()
+
+    mismatch = get_mismatch(datFiles)
+    if mismatch is not None:
+        print('WARNING: .dat files of {} not packed ({})'.format(procedure,
+                                                                 mismatch))
+        for datFile in datFiles:
+            packedFile = os.path.join(packPath, os.path.basename(datFile))
+            shutil.copyfile(datFile, packedFile)
+            packedFiles.append(packedFile)
+        return packedFiles
+
+    try:
+        for packedFile in write_packed_files(datFiles, packPath, procedure,
+                                             packRows, duplicates):
+            packedFiles.append(packedFile)
+    except ValueError:
+        for packedFile in packedFiles:
+            os.remove(packedFile)
+        raise
+
+    return packedFiles
+
+
+def get_mismatch(datFiles):
+    """
+    find why .dat files cannot be merged, files with different columns or
+    offsets of timestamps are uploaded as they are
+    :param datFiles: paths to .dat files
+    :return: description of the mismatch or None if they can be merged
+    """
+
+    header = None
+    offset = None
+
+    for datFile in datFiles:
+        rows = iter_dat_observations(datFile)
+        fileHeader = next(rows, None)
+        if fileHeader is None:
+            continue
+        if header is None:
+            header = fileHeader
+        elif fileHeader != header:
+            return 'different columns in {}'.format(
+                os.path.basename(datFile))
+
+        row = next(rows, None)
+        if row is None:
+            continue
+        fileOffset = row[header.index(timeColumn)][26:]
+        if offset is None:
+            offset = fileOffset
+        elif fileOffset != offset:
+            return 'different offsets in {}'.format(
+                os.path.basename(datFile))
+
+    return None
+
+
+def write_packed_files(datFiles, packPath, procedure, packRows=100000,
+                       duplicates='first'):
+    """
+    write observations of .dat files merged by time into files with at most
+    packRows observations (generator), each file is named after its last
+    observation (in UTC), the last one after the last original file if it
+    is later
+    :param datFiles: paths to .dat files of the procedure sorted by name
+    :param packPath: path to the directory with packed files
+    :param procedure: name of the procedure (prefix of packed files)
+    :param packRows: maximal number of observations in one packed file
+    :param duplicates: policy for observations with the same timestamp
+    :return: yields paths to packed files
+    """
+
+    rows = merge_observations([iter_dat_observations(f) for f in datFiles],
+                              duplicates)
+    header = next(rows, None)
+    if header is None:
+        return
+
+    timeIndex = header.index(timeColumn)
+    partPath = os.path.join(packPath, '{}_.part'.format(procedure))
+    p = None
+    count = 0
+    lastRow = None
+
+    try:
+        for row in rows:
+            if p is None:
+                p = open(partPath, 'w')
+                p.write(','.join(header) + '\n')
+            p.write(','.join(row) + '\n')
+            lastRow = row
+            count += 1
+
+            if count == packRows:
+                p.close()
+                p = None
+                count = 0
+                yield rename_part(partPath, procedure,
+                                  get_dat_suffix(lastRow[timeIndex]))
+
+        if p is not None:
+            p.close()
+            p = None
+            suffix = get_dat_suffix(lastRow[timeIndex])
+            # keep the end of the last original file, e.g. end of month
+            originalSuffix = os.path.basename(datFiles[-1])[-21:-4]
+            if originalSuffix.isdigit():
+                suffix = max(suffix, originalSuffix)
+            yield rename_part(partPath, procedure, suffix)
+    finally:
+        if p is not None:
+            p.close()
+            os.remove(partPath)
+
+
+def rename_part(partPath, procedure, suffix):
+    """
+    give the written part its final name
+    :param partPath: path to the written part
+    :param procedure: name of the procedure
+    :param suffix: suffix in format YYYYMMDDhhmmssfff
+    :return packedFile: path to the packed file
+    """
+
+    packedFile = os.path.join(os.path.dirname(partPath),
+                              '{}_{}.dat'.format(procedure, suffix))
+    os.rename(partPath, packedFile)
+
+    return packedFile
+
+
+def iter_dat_observations(datPath):
+    """
+    read observations from .dat file (generator)
+    :param datPath: path to the .dat file
+    :return: yields list of names of columns first, then lists of values
+    """
+
+    with open(datPath, 'r') as d:
+        for line in d:
+            line = line.rstrip('\r\n')
+            if line:
+                yield line.split(',')
+
+
+def get_dat_suffix(timestamp):
+    """
+    get suffix of .dat file name for its last observation
+    :param timestamp: timestamp in format YYYY-MM-DDTHH:MM:SS.SSSSSS+HH:MM
+    :return: UTC time in format YYYYMMDDhhmmssfff (rounded up to
+             milliseconds)
+    """
+
+    utc = datetime.datetime.strptime(timestamp[:26],
+                                     '%Y-%m-%dT%H:%M:%S.%f') - \
+        datetime.timedelta(minutes=get_offset_minutes(timestamp[26:]))
+    utc += datetime.timedelta(microseconds=999)
+
+    return '{}{:03d}'.format(utc.strftime('%Y%m%d%H%M%S'),
+                             utc.microsecond // 1000)
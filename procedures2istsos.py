@@ -21,27 +21,37 @@
  ***************************************************************************/
 """
 
-import requests
 import json
 import argparse
+import functools
 import os, sys
+from multiprocessing.pool import ThreadPool
 import istsosdat
+import istsoswa
+from geometryindex import get_geometry_index, get_geometry_index_path, \
+    get_epsg_code, get_target_code
 
 
 def main():
 
-    insert_procedures(args.__dict__['url'],
-                      args.__dict__['service'],
-                      args.__dict__['path'],
-                      args.__dict__['device_type'],
-                      args.__dict__['geometry_index'],
-                      args.__dict__['istsos_path'],
-                      args.__dict__['username'],
-                      args.__dict__['password'])
+    failures = insert_procedures(args.__dict__['url'],
+                                 args.__dict__['service'],
+                                 args.__dict__['path'],
+                                 args.__dict__['device_type'],
+                                 args.__dict__['geometry_index'],
+                                 args.__dict__['istsos_path'],
+                                 args.__dict__['username'],
+                                 args.__dict__['password'],
+                                 args.__dict__['concurrency'],
+                                 args.__dict__['target_crs'])
+
+    if failures:
+        sys.exit(1)
 
 
 def insert_procedures(url, service, procedurePath, deviceType, geometryIndex,
-                      istsosPath, username, password):
+                      istsosPath, username, password, concurrency=1,
+                      targetCrs=None):
     """
     Insert procedures from your path to your server
     :param url: url address of your server
@@ -53,20 +63,26 @@ def insert_procedures(url, service, procedurePath, deviceType, geometryIndex,
     :param istsosPath: Path to a directory where is istsos installed
     :param username: Username used to access istSOS server
     :param password: Password used to access istSOS server
+    :param concurrency: Number of procedures registered at the same time
+    :param targetCrs: EPSG code of coordinate system of locations (None to
+                      keep coordinates of the geometry index)
+    :return failures: number of procedures which could not be registered
     """
 
     walk_dir = procedurePath
     proceduresURL = '{}wa/istsos/services/{}/procedures'.format(url,
                                                                 service)
-    # TODO: See issue about changing csv to something better
-    if geometryIndex[-4:] != '.csv':
-        geometryIndex = '{}_{}.csv'.format(geometryIndex, service)
+    geometryIndex = get_geometry_index_path(geometryIndex, service)
 
     sys.path.append(istsosPath)
     from lib.requests.auth import HTTPBasicAuth
     auth = HTTPBasicAuth(username, password)
     requestsList = list()
 
+    if targetCrs:
+        # all coordinates are transformed at once, not for each procedure
+        get_geometry_index(geometryIndex).reproject(targetCrs)
+
     for root, subdirs, files in os.walk(walk_dir):
         if subdirs == [] and files != []:
             observedProperties = get_observed_properties(root, deviceType,
@@ -80,36 +96,74 @@ def insert_procedures(url, service, procedurePath, deviceType, geometryIndex,
             if deviceType == 'templogger':
                 requestsList.append(get_procedure_request(
                     root.split(os.sep)[-1],
-                    observedProperties, locationName, geometryIndex))
+                    observedProperties, locationName, geometryIndex,
+                    targetCrs))
             elif deviceType == 'TOV':
                 for file in files:
                     if file[-4:] == '.xls':
                         requestsList.append(get_procedure_request(
                             file[:-4], observedProperties,
-                            locationName, geometryIndex))
-
-    for request in requestsList:
-        r = requests.post(proceduresURL, data=json.dumps(request), auth=auth)
-        if not r.json()['success']:
+                            locationName, geometryIndex, targetCrs))
+
+    session = istsoswa.get_session(auth, concurrency)
+    pool = ThreadPool(concurrency)
+    try:
+        # map keeps the order of requests, so the report is ordered
+        responses = pool.map(
+            functools.partial(insert_procedure, session, proceduresURL),
+            requestsList, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    failures = 0
+    for request, response in zip(requestsList, responses):
+        if not response.get('success'):
+            failures += 1
             print('Problem with procedure {}'.format(
                 request['system_id']))
-            print(r.json())
+            print(response)
+
+    print('{} of {} procedures registered'.format(
+        len(requestsList) - failures, len(requestsList)))
+
+    return failures
+
+
+def insert_procedure(session, proceduresURL, request):
+    """
+    Register one procedure on the server
+    :param session: requests.Session shared by all requests
+    :param proceduresURL: URL of procedures of the service
+    :param request: dictionary from get_procedure_request
+    :return: decoded response of the server
+    """
+
+    try:
+        r = istsoswa.post_with_retry(session, proceduresURL,
+                                     json.dumps(request))
+        return r.json()
+    except (IOError, ValueError) as e:
+        return {'success': False,
+                'message': '{}: {}'.format(type(e).__name__, e)}
 
 
 def get_procedure_request(procedureName, observedProperties, locationName,
-                          geometryIndex):
+                          geometryIndex, targetCrs=None):
     """
     Get dictionary for procedure import
     :param procedureName: Name of your sensor
     :param observedProperties: List of observed properties
     :param locationName: Geographical name of procedure location
     :param geometryIndex: Path to the CSV file with procedures coords metadata
+    :param targetCrs: EPSG code of coordinate system of the location
     :return procedure: dictionary containing all necessary aspects to import
     """
 
     procedureName = istsosdat.standardize_norwegian(procedureName)
     procedureName = istsosdat.get_procedure_id(procedureName, geometryIndex)
-    location = get_location(locationName, procedureName, geometryIndex)
+    location = get_location(locationName, procedureName, geometryIndex,
+                            targetCrs)
 
     procedure = {
         'system_id': procedureName,
@@ -172,44 +226,45 @@ def get_observed_properties(directory, deviceType, files):
     return outputs
 
 
-def get_location(locationName, procedure, geometryIndex):
+def get_location(locationName, procedure, geometryIndex, targetCrs=None):
     """
     Get location based on sensor location and its name
     :param locationName: Geographical name of procedure location
     :param procedure: Name of procedure
     :param geometryIndex: Path to the CSV file with procedures coords metadata
+    :param targetCrs: EPSG code of coordinate system of the location (None to
+                      keep coordinates of the geometry index)
     :return location: json dictionary containing location name, crs and coords
     """
 
     procedure = istsosdat.standardize_norwegian(procedure)
 
-    with open(geometryIndex, 'r') as geometry:
-        z = '0'
-        for line in geometry.readlines():
-            lineFeatures = line.split(',')
-            lineFeatures.append('0')
-
-            if procedure[0] in ['B', 'b'] and procedure[-2:] == 'cm':
-                z = procedure.split(
-                    'cm')[0].strip().split('-')[-1].split(' ')[-1]
-
-            if procedure in lineFeatures or \
-                            '{}-temp'.format(procedure) in lineFeatures:
-                coordinates = [lineFeatures[-3], lineFeatures[-2], z]
-                # TODO: Make crs more general
-                if lineFeatures[-4] == '32V':
-                    crs = '32632'
-                elif lineFeatures[-4] in ['33W', '33N', '33V']:
-                    crs = '32633'
-                elif lineFeatures[-4] == '34W':
-                    crs = '32634'
-                elif lineFeatures[-4] == 'WGS84':
-                    crs = '4326'
-                else:
-                    raise ValueError('Unexpected coordinate system')
-                break
+    z = '0'
+    if procedure[0] in ['B', 'b'] and procedure[-2:] == 'cm':
+        z = procedure.split('cm')[0].strip().split('-')[-1].split(' ')[-1]
+
+    geometry = get_geometry_index(geometryIndex)
+    if targetCrs:
+        geometry.reproject(targetCrs)
+
+    record = geometry.get_record(procedure)
+    if record is None:
+        raise ValueError('Procedure {} not found in {}'.format(procedure,
+                                                               geometryIndex))
+
+    if targetCrs:
+        crs = get_target_code(targetCrs)
+        try:
+            x, y = record['coordinates'][crs]
+        except KeyError:
+            raise ValueError('Unexpected coordinate system {}'.format(
+                record['crs']))
+        coordinates = [str(x), str(y), z]
+    else:
+        crs = get_epsg_code(record['crs'])
+        coordinates = [record['x'], record['y'], z]
 
-    locationName = '{}-{}'.format(locationName, lineFeatures[0])
+    locationName = '{}-{}'.format(locationName, record['procid'])
     locationName = istsosdat.standardize_norwegian(locationName)
 
     if 'templogger' in geometryIndex:
@@ -270,7 +325,7 @@ if __name__ == '__main__':
         default=os.path.join(os.path.dirname(__file__),
                              'metadata',
                              'geometry_index'),
-        help='Path to the CSV file with sensors metadata '
+        help='Path to the CSV or SQLite file with sensors metadata '
              '(names, crs, coordinates)')
 
     parser.add_argument(
@@ -289,6 +344,19 @@ if __name__ == '__main__':
         type=str,
         help='Password used to access istSOS server')
 
+    parser.add_argument(
+        '-concurrency',
+        type=int,
+        default=4,
+        help='Number of procedures registered on the server at the same time')
+
+    parser.add_argument(
+        '-target_crs',
+        type=str,
+        help='EPSG code of coordinate system of locations on the server (e.g. '
+             '4326), coordinates of all procedures are transformed into it '
+             '(default: keep coordinates of the geometry index)')
+
     args = parser.parse_args()
 
     if args.__dict__['service'] == '' or args.__dict__['service'] is None:
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ qualitycontrol
+
+ Quality control of observations parsed into arrays (range, step, spike and
+ flatline checks of whole columns at once) with istSOS quality indexes of
+ each value, checks are configured per unit of observed properties
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import json
+import string
+import runstats
+
+# istSOS quality indexes, each level means that all checks of the previous
+# levels passed too
+qualityMissing = 0
+qualityRaw = 100
+qualityInRange = 101
+qualityConsistent = 102
+
+# suffix of names of quality index columns in .dat header
+qualitySuffix = ':qualityIndex'
+
+# checks of units in format {unit: {check: limit}}, step and spike are
+# limits of changes between consecutive observations, flatline is the number
+# of equal consecutive values considered as a stuck sensor, units are keys
+# of get_unit_key (°C is 'C'), flatlines of temperatures are not checked by
+# default as soil temperatures stay equal for weeks (e.g. frozen ground)
+defaultChecks = {
+    'C': {'min': -50, 'max': 60, 'step': 10, 'spike': 8, 'flatline': None},
+    'F': {'min': -58, 'max': 140, 'step': 18, 'spike': 14, 'flatline': None},
+    '%': {'min': 0, 'max': 100, 'step': 60, 'spike': 40, 'flatline': 48}}
+
+qualityChecks = ['min', 'max', 'step', 'spike', 'flatline']
+
+
+def load_quality_checks(path=None):
+    """
+    load checks of units, default checks are updated with the ones from the
+    JSON file
+    :param path: path to the JSON file in format {unit: {check: limit}} with
+                 checks min, max, step, spike and flatline (null to disable
+                 a check)
+    :return checks: dictionary in format {unit key: {check: limit}}
+    """
+
+    checks = dict((unit, dict(limits)) for unit, limits in
+                  defaultChecks.items())
+
+    if path is None:
+        return checks
+
+    with open(path, 'r') as c:
+        loaded = json.load(c)
+
+    for unit, limits in loaded.items():
+        unknown = set(limits.keys()).difference(qualityChecks)
+        if unknown:
+            raise ValueError('Unknown quality checks {} of unit {}'.format(
+                ', '.join(sorted(unknown)), unit))
+        checks.setdefault(get_unit_key(unit), dict()).update(limits)
+
+    return checks
+
+
+def get_unit_key(unit):
+    """
+    get unit comparable regardless of the degree sign and its SWD
+    replacement (°C, *C and C are the same)
+    :param unit: unit as written in metadata
+    :return: unit without non-ASCII characters, '*' and spaces
+    """
+
+    return ''.join(c for c in unit if c in string.printable and
+                   c not in '* \t\r\n')
+
+
+def get_column_checks(indexFile, checks):
+    """
+    find checks of observation columns by their units in INDEX.SWD
+    :param indexFile: path to INDEX.SWD with names and units of columns
+    :param checks: checks of units (see load_quality_checks)
+    :return columnChecks: dictionary in format {column name: {check: limit}},
+                          columns with units without checks are omitted
+    """
+
+    from istsosdat import get_metadata
+
+    columnChecks = dict()
+
+    for column in get_metadata(indexFile, returnUnits=True).split(','):
+        if '(' not in column:
+            continue
+        name, unit = column.split('(', 1)
+        unitChecks = checks.get(get_unit_key(unit.rsplit(')', 1)[0]))
+        if unitChecks:
+            columnChecks.update({name.strip(): unitChecks})
+
+    return columnChecks
+
+
+def check_quality(arrays, columnChecks):
+    """
+    add quality index column after each checked value column
+    :param arrays: bulkparse.ObservationArrays
+    :param columnChecks: checks of columns (see get_column_checks)
+    :return: bulkparse.ObservationArrays with quality index columns
+    """
+
+    from bulkparse import ObservationArrays
+
+    header = list()
+    values = list()
+    decimals = list()
+    valueIndex = 0
+
+    with runstats.measure('quality_control') as stage:
+        for index, name in enumerate(arrays.header):
+            header.append(name)
+            if index == arrays.timeIndex:
+                continue
+
+            columnValues = arrays.values[valueIndex]
+            values.append(columnValues)
+            decimals.append(arrays.decimals[valueIndex])
+            valueIndex += 1
+
+            if name in columnChecks:
+                header.append('{}{}'.format(name, qualitySuffix))
+                values.append(get_quality_indexes(
+                    columnValues, columnChecks[name]).astype('f8'))
+                decimals.append(0)
+
+        stage.rows = len(arrays)
+
+    return ObservationArrays(header, arrays.time, values, decimals,
+                             arrays.offset, arrays.timeIndex)
+
+
+def get_quality_indexes(values, checks):
+    """
+    check values of one column
+    :param values: numpy array of floats (NaN for missing values)
+    :param checks: dictionary in format {check: limit}, missing checks are
+                   skipped
+    :return qualityIndexes: numpy array of integers
+    """
+
+    import numpy
+
+    numeric = numpy.isfinite(values)
+    inRange = numeric & check_range(values, checks.get('min'),
+                                    checks.get('max'))
+    # values out of range are not used as neighbours of other values
+    consistent = inRange.copy()
+
+    if checks.get('step') is not None:
+        consistent &= ~check_steps(values, inRange, checks['step'])
+    if checks.get('spike') is not None:
+        consistent &= ~check_spikes(values, inRange, checks['spike'])
+    if checks.get('flatline') is not None:
+        consistent &= ~check_flatlines(values, inRange, checks['flatline'])
+
+    qualityIndexes = numpy.full(len(values), qualityMissing, 'i8')
+    qualityIndexes[numeric] = qualityRaw
+    qualityIndexes[inRange] = qualityInRange
+    qualityIndexes[consistent] = qualityConsistent
+
+    return qualityIndexes
+
+
+def check_range(values, minimum=None, maximum=None):
+    """
+    :param values: numpy array of floats
+    :param minimum: the lowest possible value (None for unlimited)
+    :param maximum: the highest possible value (None for unlimited)
+    :return: numpy array of booleans, True for values within the range
+    """
+
+    import numpy
+
+    with numpy.errstate(invalid='ignore'):
+        inRange = numpy.ones(len(values), bool)
+        if minimum is not None:
+            inRange &= values >= minimum
+        if maximum is not None:
+            inRange &= values <= maximum
+
+    return inRange
+
+
+def check_steps(values, valid, step):
+    """
+    find values changed from the previous valid value by more than step,
+    only the first jump fails, a return to the value before a failed jump
+    (isolated spike, see check_spikes) does not
+    :param values: numpy array of floats
+    :param valid: numpy array of booleans, values compared with neighbours
+    :param step: the greatest possible change
+    :return: numpy array of booleans, True for failed values
+    """
+
+    import numpy
+
+    previous = get_previous_valid(valid)
+    found = valid & (previous >= 0)
+
+    jumped = numpy.zeros(len(values), bool)
+    jumped[found] = numpy.abs(
+        values[found] - values[previous[found]]) > step
+
+    # values after a jump compared with the value before the jump
+    returned = numpy.zeros(len(values), bool)
+    after = found.copy()
+    after[found] = jumped[previous[found]]
+    beforeJump = previous[previous[after]]
+    returned[after] = numpy.abs(values[after] - values[beforeJump]) <= step
+
+    return jumped & ~returned
+
+
+def check_spikes(values, valid, spike):
+    """
+    find spikes, values differing from both valid neighbours in the same
+    direction by more than spike (GTSPP spike test)
+    :param values: numpy array of floats
+    :param valid: numpy array of booleans, values compared with neighbours
+    :param spike: the greatest possible difference from neighbours
+    :return: numpy array of booleans, True for failed values
+    """
+
+    import numpy
+
+    previous = get_previous_valid(valid)
+    following = get_previous_valid(valid[::-1])[::-1]
+    found = valid & (previous >= 0) & (following >= 0)
+    following = len(values) - 1 - following[found]
+
+    before = values[previous[found]]
+    after = values[following]
+    failed = numpy.zeros(len(values), bool)
+    failed[found] = numpy.abs(values[found] - (before + after) / 2) - \
+        numpy.abs(after - before) / 2 > spike
+
+    return failed
+
+
+def check_flatlines(values, valid, count):
+    """
+    find values equal to at least count - 1 previous valid values (the first
+    values of a flatline are not failed)
+    :param values: numpy array of floats
+    :param valid: numpy array of booleans, values compared with neighbours
+    :param count: number of equal values considered as a flatline
+    :return: numpy array of booleans, True for failed values
+    """
+
+    import numpy
+
+    validValues = values[valid]
+    indexes = numpy.arange(len(validValues))
+    changed = numpy.ones(len(validValues), bool)
+    changed[1:] = validValues[1:] != validValues[:-1]
+    runStarts = numpy.maximum.accumulate(numpy.where(changed, indexes, 0))
+
+    failed = numpy.zeros(len(values), bool)
+    failed[valid] = indexes - runStarts >= count - 1
+
+    return failed
+
+
+def get_previous_valid(valid):
+    """
+    :param valid: numpy array of booleans
+    :return: numpy array of indexes of the previous valid item of each item
+             (-1 if there is none)
+    """
+
+    import numpy
+
+    indexes = numpy.where(valid, numpy.arange(len(valid)), -1)
+    previous = numpy.empty(len(valid), 'i8')
+    previous[:1] = -1
+    previous[1:] = numpy.maximum.accumulate(indexes)[:-1]
+
+    return previous
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ runstats
+
+ Statistics of stages of ingestion runs (wall time, rows, bytes, files and
+ peak memory per stage and per procedure) saved as a JSON report
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# collector of this process, None when statistics are not collected
+_collector = None
+
+
+class Stage(object):
+    """
+    One measured run of a stage, rows, bytes and files are filled by the
+    measured code
+    """
+
+    def __init__(self, name, procedure=None):
+        self.name = name
+        self.procedure = procedure
+        self.rows = 0
+        self.bytes = 0
+        self.files = 0
+
+
+class RunStats(object):
+    """
+    Sums of measured stages in format {(stage, procedure): record}
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.records = dict()
+        # stages being measured, the innermost last
+        self.openStages = list()
+
+    def add(self, name, seconds, rows=0, bytes=0, files=0, procedure=None,
+            calls=1):
+        """
+        add a measured stage, its rows are counted also in the open stages
+        :param name: name of the stage
+        :param seconds: wall time of the stage
+        :param rows: number of processed rows
+        :param bytes: number of processed bytes
+        :param files: number of processed files
+        :param procedure: procedure of the stage (default: procedure of the
+                          innermost open stage)
+        :param calls: number of runs of the stage
+        """
+
+        if procedure is None and self.openStages:
+            procedure = self.openStages[-1].procedure
+
+        record = self.records.setdefault((name, procedure), {
+            'seconds': 0, 'rows': 0, 'bytes': 0, 'files': 0, 'calls': 0,
+            'peak_rss_kb': None})
+        record['seconds'] += seconds
+        record['rows'] += rows
+        record['bytes'] += bytes
+        record['files'] += files
+        record['calls'] += calls
+        record['peak_rss_kb'] = get_max(record['peak_rss_kb'],
+                                        get_peak_rss())
+
+        self.count_rows(rows)
+
+    def count_rows(self, rows):
+        """
+        count rows in all open stages
+        :param rows: number of processed rows
+        """
+
+        for stage in self.openStages:
+            stage.rows += rows
+
+    def merge(self, records):
+        """
+        add records collected in another process
+        :param records: list of tuples (stage, procedure, record)
+        """
+
+        for name, procedure, record in records:
+            old = self.records.get((name, procedure))
+            if old is None:
+                self.records.update({(name, procedure): dict(record)})
+                continue
+            for key in ['seconds', 'rows', 'bytes', 'files', 'calls']:
+                old[key] += record[key]
+            old['peak_rss_kb'] = get_max(old['peak_rss_kb'],
+                                         record['peak_rss_kb'])
+
+    def get_records(self):
+        """
+        :return: list of tuples (stage, procedure, record), picklable to be
+                 returned from other processes
+        """
+
+        return [(name, procedure, record) for (name, procedure), record in
+                self.records.items()]
+
+    def get_report(self):
+        """
+        :return report: dictionary with totals of stages and stages of each
+                        procedure
+        """
+
+        stages = dict()
+        procedures = dict()
+
+        for (name, procedure), record in sorted(
+                self.records.items(), key=lambda r: (r[0][0], r[0][1] or '')):
+            total = stages.setdefault(name, {
+                'seconds': 0, 'rows': 0, 'bytes': 0, 'files': 0, 'calls': 0,
+                'peak_rss_kb': None})
+            for key in ['seconds', 'rows', 'bytes', 'files', 'calls']:
+                total[key] += record[key]
+            total['peak_rss_kb'] = get_max(total['peak_rss_kb'],
+                                           record['peak_rss_kb'])
+
+            if procedure is not None:
+                procedures.setdefault(procedure, dict()).update(
+                    {name: get_rates(dict(record))})
+
+        for total in stages.values():
+            get_rates(total)
+
+        return {'command': sys.argv,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                         time.localtime(self.started)),
+                'seconds': time.time() - self.started,
+                'peak_rss_kb': get_peak_rss(),
+                'stages': stages,
+                'procedures': procedures}
+
+    def save(self, path):
+        """
+        save the report as a JSON file
+        :param path: path to the JSON file
+        """
+
+        with open(path, 'w') as s:
+            json.dump(self.get_report(), s, indent=2, sort_keys=True)
+
+
+def enable():
+    """
+    start collecting statistics in this process
+    :return: RunStats
+    """
+
+    global _collector
+
+    if _collector is None:
+        _collector = RunStats()
+
+    return _collector
+
+
+def get_collector():
+    """
+    :return: RunStats of this process or None if statistics are not
+             collected
+    """
+
+    return _collector
+
+
+@contextmanager
+def measure(name, procedure=None):
+    """
+    measure wall time of a block of code as a stage (nothing is recorded if
+    statistics are not collected)
+    :param name: name of the stage
+    :param procedure: procedure of the stage (default: procedure of the
+                      enclosing stage)
+    :return: yields Stage whose rows, bytes and files can be set
+    """
+
+    stage = Stage(name, procedure)
+    collector = _collector
+
+    if collector is None:
+        yield stage
+        return
+
+    if procedure is None and collector.openStages:
+        stage.procedure = collector.openStages[-1].procedure
+
+    collector.openStages.append(stage)
+    start = time.time()
+    try:
+        yield stage
+    finally:
+        seconds = time.time() - start
+        collector.openStages.remove(stage)
+        collector.add(name, seconds, stage.rows, stage.bytes, stage.files,
+                      stage.procedure)
+
+
+def add(name, seconds, rows=0, bytes=0, files=0, procedure=None):
+    """
+    add a stage measured by the caller (see RunStats.add), nothing is
+    recorded if statistics are not collected
+    """
+
+    if _collector is not None:
+        _collector.add(name, seconds, rows, bytes, files, procedure)
+
+
+def count_rows(rows):
+    """
+    count rows in all open stages (nothing is counted if statistics are not
+    collected)
+    :param rows: number of processed rows
+    """
+
+    if _collector is not None:
+        _collector.count_rows(rows)
+
+
+def collect(function, *args):
+    """
+    call the function with statistics collected separately (e.g. in a
+    process of multiprocessing.Pool)
+    :param function: function to be called as function(*args)
+    :return: tuple (result of the function, list of collected records for
+             RunStats.merge)
+    """
+
+    global _collector
+
+    previous = _collector
+    _collector = RunStats()
+    try:
+        result = function(*args)
+        return result, _collector.get_records()
+    finally:
+        _collector = previous
+
+
+def get_rates(record):
+    """
+    add rows per second to the record
+    :param record: dictionary with seconds and rows
+    :return record: the same dictionary
+    """
+
+    if record['rows'] and record['seconds']:
+        record.update({'rows_per_second': record['rows'] / record['seconds']})
+    else:
+        record.update({'rows_per_second': None})
+
+    return record
+
+
+def get_max(a, b):
+    """
+    :return: the greater of two values, None is less than anything
+    """
+
+    if a is None:
+        return b
+    if b is None:
+        return a
+
+    return max(a, b)
+
+
+def get_files_size(paths):
+    """
+    :param paths: paths to files
+    :return: sum of sizes of existing files in bytes
+    """
+
+    return sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+
+
+def get_peak_rss():
+    """
+    :return: peak resident set size of this process in kB (None if not
+             available on this platform)
+    """
+
+    # ru_maxrss of a new process on Linux starts from the peak of its parent
+    try:
+        with open('/proc/self/status', 'r') as s:
+            for line in s:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on macOS, kilobytes elsewhere
+        peak //= 1024
+
+    return peak
+
+
+def save_profile(profiler, path, top=30):
+    """
+    save cProfile statistics (readable by pstats) and print the most time
+    consuming functions
+    :param profiler: cProfile.Profile
+    :param path: path to the file with statistics
+    :param top: number of printed functions
+    """
+
+    import pstats
+
+    profiler.dump_stats(path)
+    pstats.Stats(path).sort_stats('cumulative').print_stats(top)
@@ -21,11 +21,12 @@
  ***************************************************************************/
 """
 
+import itertools
 from istsosdat import *
 
 
 def csv2dat(path, observationColumns, timestampColumn, timestampFormat, offset,
-            procedure, d):
+            procedure, d, timestampSuffix=None, engine='text'):
     """
     extract user's desired data from .csv file and save them in istSOS
     acceptable format in .dat file
@@ -36,65 +37,102 @@ def csv2dat(path, observationColumns, timestampColumn, timestampFormat, offset,
     :param offset: offset of timestamp
     :param procedure: who provides the observations
     :param d: a flag to decide whether parse just one file or whole directory
+    :param timestampSuffix: suffix of .dat files for files without dates in
+                            names (today's timestamp if not given)
+    :param engine: 'text' to convert files line by line, 'numpy' to parse
+                   whole files into arrays (see bulkparse)
+    :return results: list of tuples (path to the file, error message or None)
     """
 
     if d is False:
-        i = open(path, 'r')
-        datPath = get_dat_filepath(path[:-4], procedure)
-        o = open(datPath, 'w')
+        files = [path]
+    else:
+        files = get_csv_files(path)
+
+    return convert_files(files, csv_file2dat, observationColumns,
+                         timestampColumn, timestampFormat, offset, procedure,
+                         timestampSuffix, engine)
+
+
+def csv_file2dat(path, observationColumns, timestampColumn, timestampFormat,
+                 offset, procedure, timestampSuffix=None, engine='text'):
+    """
+    convert one .csv file into istSOS acceptable .dat file
+    :param path: path to the .csv file
+    :param observationColumns: names of columns with observation data
+    :param timestampColumn: name of column with timestamps
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :param procedure: who provides the observations
+    :param timestampSuffix: suffix of .dat files for files without dates in
+                            names (today's timestamp if not given)
+    :param engine: 'text' to convert the file line by line, 'numpy' to parse
+                   the whole file into arrays
+    :return datPath: path to the created .dat file
+    """
+
+    if engine == 'numpy':
+        from bulkparse import read_csv_arrays
+        arrays = read_csv_arrays(path, observationColumns, timestampColumn,
+                                 timestampFormat, offset)
+        datPath = get_dat_filepath(path[:-4], procedure, timestampSuffix)
+        arrays.to_dat(datPath)
+        return datPath
+
+    rows = iter_csv_observations(path, observationColumns, timestampColumn,
+                                 timestampFormat, offset)
+    # find the header before the .dat file is created
+    header = next(rows)
+
+    datPath = get_dat_filepath(path[:-4], procedure, timestampSuffix)
+    write_dat(datPath, itertools.chain([header], rows))
+
+    return datPath
 
+
+def iter_csv_observations(path, observationColumns, timestampColumn,
+                          timestampFormat, offset):
+    """
+    read observations from .csv file line by line (generator)
+    :param path: path to the .csv file
+    :param observationColumns: names of columns with observation data
+    :param timestampColumn: name of column with timestamps
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :return: yields list of names of columns first, then lists of values
+    """
+
+    with open(path, 'r') as i:
+        headerLine = None
         for line in i:
             if all(col in line for col in observationColumns.split(',') + [timestampColumn]):
                 headerLine = line
                 break
-            else:
-                headerLine = None
 
         if not headerLine:
-            print('ERROR: Could not find header line in file {}'.format(i.name))
-            exit(0)
+            raise ValueError('Could not find header line in file {}'.format(
+                path))
 
         header, columnsIndexes = get_header(headerLine,
                                             timestampColumn,
                                             observationColumns)
-        o.write(header)
+        yield header.rstrip('\n').split(',')
 
-        for line in i:
-            o.write(get_observations(line, timestampFormat, offset,
-                                     columnsIndexes))
+        for row in project_observations(i, timestampFormat, offset,
+                                        columnsIndexes):
+            yield row
 
-        i.close()
-        o.close()
-    else:
-        import glob
-        files = glob.glob("{}*.csv".format(path))
-        for f in glob.glob("{}*.CSV".format(path)):
-            files.append(f)
-
-        for file in files:
-            i = open(file, 'r')
-            datPath = get_dat_filepath(file[:-4], procedure)
-            o = open(datPath, 'w')
-
-            for line in i:
-                if all(col in line for col in observationColumns.split(',') + [timestampColumn]):
-                    headerLine = line
-                    break
-                else:
-                    headerLine = None
-
-            if not headerLine:
-                print('ERROR: Could not find header line in file {}'.format(i.name))
-                exit(0)
-
-            header, columnsIndexes = get_header(headerLine,
-                                                timestampColumn,
-                                                observationColumns)
-            o.write(header)
-
-            for line in i:
-                o.write(get_observations(line, timestampFormat, offset,
-                                         columnsIndexes))
-
-            i.close()
-            o.close()
+
+def get_csv_files(path):
+    """
+    get all .csv files with observations in the directory
+    :param path: path to the directory (or a prefix of files in it)
+    :return files: sorted list of paths to .csv files
+    """
+
+    import glob
+    files = glob.glob("{}*.csv".format(path))
+    for f in glob.glob("{}*.CSV".format(path)):
+        files.append(f)
+
+    return sorted(files)
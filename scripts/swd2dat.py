@@ -21,12 +21,15 @@
  ***************************************************************************/
 """
 
+import os
 from os import sep
 from istsosdat import *
 
 
 def swd2dat(path, observationColumns, timestampColumn, timestampFormat, offset,
-            procedure, d, useTemplate):
+            procedure, d, useTemplate, timestampSuffix=None, checkpoints=None,
+            engine='text', qualityChecks=None, merge=None,
+            deferCheckpoints=False):
     """
     extract user's desired data from .swd file and save them in istSOS
     acceptable format in .dat file
@@ -38,66 +41,291 @@ def swd2dat(path, observationColumns, timestampColumn, timestampFormat, offset,
     :param procedure: who provides the observations
     :param d: a flag to decide whether parse just one file or whole directory
     :param useTemplate: if given, use observation columns names from INDEX.SWD
+    :param timestampSuffix: suffix of .dat files for files without dates in
+                            names (today's timestamp if not given)
+    :param checkpoints: path to the SQLite manifest with checkpoints, only
+                        lines appended since the last run are converted if
+                        given
+    :param engine: 'text' to convert files line by line, 'numpy' to parse
+                   whole files into arrays (see bulkparse, not used with
+                   checkpoints)
+    :param qualityChecks: checks of units (see
+                          qualitycontrol.load_quality_checks), quality index
+                          columns are added to columns with units in
+                          INDEX.SWD if given (whole files are parsed into
+                          arrays)
+    :param merge: policy for duplicate timestamps ('first', 'last' or
+                  'error', see merge_observations), all files are merged
+                  into one .dat file sorted by time if given (not usable
+                  with checkpoints)
+    :param deferCheckpoints: save checkpoints as pending (committed after
+                             the upload of the .dat files)
+    :return results: list of tuples (path to the file, error message or None)
     """
 
     if d is False:
-        i = open(path, 'r')
-        datPath = get_dat_filepath(path[:-4], procedure)
-        o = open(datPath, 'w')
+        files = [path]
+        indexFile = '{}{}INDEX.SWD'.format(path.rsplit(sep, 1)[0], sep)
+    else:
+        files = get_swd_files(path)
 
-        if useTemplate is True:
+        if path[-1] == sep:
+            indexFile = '{}INDEX.SWD'.format(path)
+        else:
             indexFile = '{}{}INDEX.SWD'.format(path.rsplit(sep, 1)[0], sep)
+
+    if useTemplate is True:
+        try:
             observationColumns = get_metadata(indexFile)
+        except (IOError, IndexError) as e:
+            error = 'Cannot read template {} ({})'.format(indexFile, e)
+            return [(file, error) for file in files]
+
+    if qualityChecks is not None:
+        from qualitycontrol import get_column_checks
+        try:
+            qualityChecks = get_column_checks(indexFile, qualityChecks)
+        except (IOError, IndexError) as e:
+            error = 'Cannot read units from {} ({})'.format(indexFile, e)
+            return [(file, error) for file in files]
+
+    if merge is not None:
+        if checkpoints is not None:
+            error = 'Merging of appended lines is not supported'
+            return [(file, error) for file in files]
+        return merge_swd_files(files, observationColumns, timestampColumn,
+                               timestampFormat, offset, procedure,
+                               timestampSuffix, merge, engine, qualityChecks)
+
+    return convert_files(files, swd_file2dat, observationColumns,
+                         timestampColumn, timestampFormat, offset, procedure,
+                         timestampSuffix, checkpoints, engine, qualityChecks,
+                         deferCheckpoints)
+
+
+def swd_file2dat(path, observationColumns, timestampColumn, timestampFormat,
+                 offset, procedure, timestampSuffix=None, checkpoints=None,
+                 engine='text', qualityChecks=None, deferCheckpoints=False):
+    """
+    convert one .swd file into istSOS acceptable .dat file
+    :param path: path to the .swd file
+    :param observationColumns: names of columns with observation data
+    :param timestampColumn: name of column with timestamps
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :param procedure: who provides the observations
+    :param timestampSuffix: suffix of .dat files for files without dates in
+                            names (today's timestamp if not given)
+    :param checkpoints: path to the SQLite manifest with checkpoints, new
+                        lines are appended to the .dat file if given
+    :param engine: 'text' to convert the file line by line, 'numpy' to parse
+                   the whole file into arrays (not used with checkpoints)
+    :param qualityChecks: checks of columns (see
+                          qualitycontrol.get_column_checks), quality index
+                          columns are added if given (the whole file is
+                          parsed into arrays, not usable with checkpoints)
+    :param deferCheckpoints: write only lines after the saved checkpoint
+                             into a new .dat file instead of appending them
+                             and save the checkpoint as pending (committed
+                             after the upload of the .dat file)
+    :return datPath: path to the created .dat file
+    """
+
+    datPath = get_dat_filepath(path[:-4], procedure, timestampSuffix)
 
+    if checkpoints is not None and qualityChecks is not None:
+        raise ValueError('Quality control of appended lines is not '
+                         'supported, checks need whole files')
+
+    if checkpoints is None and (engine == 'numpy' or
+                                qualityChecks is not None):
+        from bulkparse import read_swd_arrays
+        arrays = read_swd_arrays(path, observationColumns, timestampColumn,
+                                 timestampFormat, offset)
+        if qualityChecks is not None:
+            from qualitycontrol import check_quality
+            arrays = check_quality(arrays, qualityChecks)
+        arrays.to_dat(datPath)
+        return datPath
+
+    if checkpoints is None:
+        write_dat(datPath, iter_swd_observations(path, observationColumns,
+                                                 timestampColumn,
+                                                 timestampFormat, offset))
+        return datPath
+
+    from importmanifest import ImportManifest
+    manifest = ImportManifest(checkpoints)
+
+    try:
+        checkpoint = manifest.get_checkpoint(path)
+        existed = os.path.isfile(datPath)
+        count = write_dat(datPath,
+                          iter_swd_observations(path, observationColumns,
+                                                timestampColumn,
+                                                timestampFormat, offset,
+                                                checkpoint),
+                          append=not deferCheckpoints)
+        if count == 0 and (deferCheckpoints or not existed):
+            remove_failed_dat(datPath)
+        # saved only when the new lines are safely in the .dat file
+        manifest.save_checkpoint(checkpoint, pending=deferCheckpoints)
+    finally:
+        manifest.close()
+
+    return datPath
+
+
+def merge_swd_files(files, observationColumns, timestampColumn,
+                    timestampFormat, offset, procedure, timestampSuffix=None,
+                    duplicates='first', engine='text', qualityChecks=None):
+    """
+    convert .swd files of one procedure into one .dat file with observations
+    merged by time, the .dat file is named after the last file
+    :param files: paths to the .swd files sorted by name (by month)
+    :param observationColumns: names of columns with observation data
+    :param timestampColumn: name of column with timestamps
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :param procedure: who provides the observations
+    :param timestampSuffix: suffix of .dat files for files without dates in
+                            names (today's timestamp if not given)
+    :param duplicates: policy for duplicate timestamps ('first', 'last' or
+                       'error')
+    :param engine: 'text' to merge files line by line, 'numpy' to parse
+                   whole files into arrays
+    :param qualityChecks: checks of columns (see
+                          qualitycontrol.get_column_checks), quality index
+                          columns are added if given (whole files are parsed
+                          into arrays)
+    :return results: list of tuples (path to the file, error message or None)
+                     with the same result for all files
+    """
+
+    if not files:
+        return list()
+
+    datPath = get_dat_filepath(files[-1][:-4], procedure, timestampSuffix)
+
+    try:
+        if engine == 'numpy' or qualityChecks is not None:
+            from bulkparse import read_swd_arrays, merge_arrays
+            arraysList = [read_swd_arrays(f, observationColumns,
+                                          timestampColumn, timestampFormat,
+                                          offset) for f in files]
+            arrays = merge_arrays(arraysList, duplicates)
+            if qualityChecks is not None:
+                from qualitycontrol import check_quality
+                arrays = check_quality(arrays, qualityChecks)
+            droppedCount = sum(len(a) for a in arraysList) - len(arrays)
+            arrays.to_dat(datPath)
+        else:
+            counts = dict()
+            streams = [iter_swd_observations(f, observationColumns,
+                                             timestampColumn,
+                                             timestampFormat, offset)
+                       for f in files]
+            write_dat(datPath, merge_observations(streams, duplicates,
+                                                  counts))
+            droppedCount = counts.get('dropped', 0)
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+        return [(file, error) for file in files]
+
+    if droppedCount:
+        print('Dropped {} duplicate observation(s) merging {} file(s) into '
+              '{}'.format(droppedCount, len(files), datPath))
+
+    return [(file, None) for file in files]
+
+
+def iter_swd_observations(path, observationColumns, timestampColumn,
+                          timestampFormat, offset, checkpoint=None):
+    """
+    read observations from .swd file line by line (generator)
+    :param path: path to the .swd file
+    :param observationColumns: names of columns with observation data
+    :param timestampColumn: name of column with timestamps
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :param checkpoint: checkpoint from ImportManifest.get_checkpoint, only
+                       lines after it are read if given (updated in place)
+    :return: yields list of names of columns first, then lists of values
+    """
+
+    if checkpoint is not None:
+        for row in iter_swd_tail_observations(path, observationColumns,
+                                              timestampColumn,
+                                              timestampFormat, offset,
+                                              checkpoint):
+            yield row
+        return
+
+    with open(path, 'r') as i:
         header, columnsIndexes = get_header(i.readline(),
                                             timestampColumn,
                                             observationColumns)
-        o.write(header)
+        yield header.rstrip('\n').split(',')
 
         i.readline()
         i.readline()
 
-        for line in i.readlines():
-            o.write(get_observations(line, timestampFormat, offset,
-                                     columnsIndexes))
+        for row in project_observations(i, timestampFormat, offset,
+                                        columnsIndexes):
+            yield row
 
-        i.close()
-        o.close()
+
+def iter_swd_tail_observations(path, observationColumns, timestampColumn,
+                               timestampFormat, offset, checkpoint):
+    """
+    read observations appended to .swd file since the checkpoint (generator)
+    :param path: path to the .swd file
+    :param observationColumns: names of columns with observation data
+    :param timestampColumn: name of column with timestamps
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :param checkpoint: checkpoint from ImportManifest.get_checkpoint (updated
+                       in place)
+    :return: yields list of names of columns first, then lists of values
+    """
+
+    lines = iter_tail_lines(path, 3, checkpoint)
+    header, columnsIndexes = get_header(next(lines), timestampColumn,
+                                        observationColumns)
+    header = header.rstrip('\n').split(',')
+    yield header
+
+    next(lines)
+    next(lines)
+
+    timeIndex = header.index('urn:ogc:def:parameter:x-istsos:1.0:time:iso8601')
+    # a rewritten file is read again, skip what was already read from it
+    if checkpoint['restarted'] is True:
+        lastTimestamp = checkpoint['timestamp']
     else:
-        import glob
-        files = glob.glob("{}*.swd".format(path))
-        for f in glob.glob("{}*.SWD".format(path)):
-            files.append(f)
-
-        index = 0
-        for f in files:
-            if f.split(sep)[-1] in ['INDEX.SWD', 'index.swd']:
-                files.pop(index)
-            index += 1
-
-        if useTemplate is True:
-            if path[-1] == sep:
-                indexFile = '{}INDEX.SWD'.format(path)
-            else:
-                indexFile = '{}{}INDEX.SWD'.format(path.rsplit(sep, 1)[0], sep)
-            observationColumns = get_metadata(indexFile)
+        lastTimestamp = None
 
-        for file in files:
-            i = open(file, 'r')
-            datPath = get_dat_filepath(file[:-4], procedure)
-            o = open(datPath, 'w')
+    for row in project_observations(lines, timestampFormat, offset,
+                                    columnsIndexes):
+        if lastTimestamp is not None and row[timeIndex] <= lastTimestamp:
+            continue
+        if checkpoint['timestamp'] is None or \
+                row[timeIndex] > checkpoint['timestamp']:
+            checkpoint.update({'timestamp': row[timeIndex]})
+        yield row
 
-            header, columnsIndexes = get_header(i.readline(),
-                                                timestampColumn,
-                                                observationColumns)
-            o.write(header)
 
-            i.readline()
-            i.readline()
+def get_swd_files(path):
+    """
+    get all .swd files with observations in the directory
+    :param path: path to the directory (or a prefix of files in it)
+    :return files: list of paths to .swd files without index files
+    """
 
-            for line in i.readlines():
-                o.write(get_observations(line, timestampFormat, offset,
-                                         columnsIndexes))
+    import glob
+    files = glob.glob("{}*.swd".format(path))
+    for f in glob.glob("{}*.SWD".format(path)):
+        files.append(f)
 
-            i.close()
-            o.close()
+    return sorted(f for f in files if f.split(sep)[-1] not in ['INDEX.SWD',
+                                                               'index.swd'])
@@ -22,10 +22,12 @@
 """
 
 import xlrd
+import itertools
 from os import sep
 from istsosdat import *
 
-def xls2dat(path, dateColumn, timestampFormat, offset, procedure, d):
+def xls2dat(path, dateColumn, timestampFormat, offset, procedure, d,
+            timestampSuffix=None):
     """
     extract user's desired data from .swd file and save them in istSOS
     acceptable format in .dat file
@@ -35,107 +37,209 @@ def xls2dat(path, dateColumn, timestampFormat, offset, procedure, d):
     :param offset: offset of timestamp
     :param procedure: who provides the observations
     :param d: a flag to decide whether parse just one file or whole directory
+    :param timestampSuffix: suffix of .dat files for files without dates in
+                            names (today's timestamp if not given)
+    :return results: list of tuples (path to the file, error message or None)
     """
 
     if d is False:
-        xlWorkbook = xlrd.open_workbook(path)
-        xlSheet = xlWorkbook.sheet_by_index(0)
-        fileLength = xlSheet.nrows
-
-        firstRow = list()
-        for column in xlSheet.row(3):
-            if column.ctype:
-                firstRow.append(column.value)
-
-        datPath = get_dat_filepath(path[:-4], procedure)
-        o = open(datPath, 'w')
-
-        if timestampFormat == 'DATE+TIME':
-            observationColumns = list(firstRow)
-            observationColumns.remove('Date')
-            observationColumns.remove('Time')
-            for i in ['Month', 'Year', 'Tre-id']:
-                if i in observationColumns:
-                    observationColumns.remove(i)
-
-            header, columnsIndexes, timeColumnIndex = get_header(
-                ','.join(firstRow), dateColumn, ','.join(observationColumns),
-                'Time')
-        else:
-            header, columnsIndexes = get_header(','.join(firstRow), dateColumn,
-                                                ','.join(firstRow))
-        o.write(header)
-
-        columnsMax = max(columnsIndexes.values()) + 1
-
-        for rowIndex in range(4, fileLength):
-            cells = list()
-            for colIndex in range(columnsMax):
-                cell = xlSheet.cell(rowIndex, colIndex).value
-                if not isinstance(cell, unicode):
-                    cell = str(cell)
-                cells.append(cell)
-
-            dateIndex = columnsIndexes[
-                'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601']
-            cells[dateIndex] = 'DATE{}TIME{}'.format(cells[dateIndex],
-                                                     cells[timeColumnIndex])
-            o.write(get_observations('\t'.join(cells), timestampFormat, offset,
-                                     columnsIndexes))
-
-        o.close()
+        files = [path]
     else:
-        import glob
-        files = glob.glob("{}*.xls".format(path))
-        for f in glob.glob("{}*.XLS".format(path)):
-            files.append(f)
-
-        for file in files:
-            xlWorkbook = xlrd.open_workbook(file)
-            xlSheet = xlWorkbook.sheet_by_index(0)
-            fileLength = xlSheet.nrows
-
-            firstRow = list()
-            for column in xlSheet.row(3):
-                if column.ctype:
-                    firstRow.append(column.value)
-
-            datPath = get_dat_filepath(file[:-4], procedure)
-            o = open(datPath, 'w')
-
-            if timestampFormat == 'DATE+TIME':
-                observationColumns = list(firstRow)
-                observationColumns.remove('Date')
-                observationColumns.remove('Time')
-                for i in ['Month', 'Year', 'Tre-id']:
-                    if i in observationColumns:
-                        observationColumns.remove(i)
-
-                header, columnsIndexes, timeColumnIndex = get_header(
-                    ','.join(firstRow), dateColumn,
-                    ','.join(observationColumns),
-                    'Time')
+        files = get_xls_files(path)
+
+    return convert_files(files, xls_file2dat, dateColumn, timestampFormat,
+                         offset, procedure, timestampSuffix)
+
+
+def xls_file2dat(path, dateColumn, timestampFormat, offset, procedure,
+                 timestampSuffix=None):
+    """
+    convert one .xls file into istSOS acceptable .dat file
+    :param path: path to the .xls file
+    :param dateColumn: name of column with dates
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :param procedure: who provides the observations
+    :param timestampSuffix: suffix of .dat files for files without dates in
+                            names (today's timestamp if not given)
+    :return datPath: path to the created .dat file
+    """
+
+    rows = iter_xls_observations(path, dateColumn, timestampFormat, offset)
+    # open the workbook before the .dat file is created
+    header = next(rows)
+
+    datPath = get_dat_filepath(path[:-4], procedure, timestampSuffix)
+    write_dat(datPath, itertools.chain([header], rows))
+
+    return datPath
+
+
+def iter_xls_observations(path, dateColumn, timestampFormat, offset):
+    """
+    read observations from the first sheet of .xls file row by row
+    (generator)
+    :param path: path to the .xls file
+    :param dateColumn: name of column with dates
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :return: yields list of names of columns first, then lists of values
+    """
+
+    xlWorkbook = xlrd.open_workbook(path, on_demand=True)
+    try:
+        for row in iter_sheet_observations(xlWorkbook.sheet_by_index(0),
+                                           dateColumn, timestampFormat,
+                                           offset):
+            yield row
+    finally:
+        xlWorkbook.release_resources()
+
+
+def iter_sheet_observations(xlSheet, dateColumn, timestampFormat, offset):
+    """
+    read observations from the sheet (generator)
+    :param xlSheet: xlrd sheet with names of columns in the fourth row
+    :param dateColumn: name of column with dates
+    :param timestampFormat: schema of original timestamp format
+    :param offset: offset of timestamp
+    :return: yields list of names of columns first, then lists of values
+    """
+
+    firstRow = list()
+    for column in xlSheet.row(3):
+        if column.ctype:
+            firstRow.append(column.value)
+
+    if timestampFormat == 'DATE+TIME':
+        observationColumns = list(firstRow)
+        observationColumns.remove('Date')
+        observationColumns.remove('Time')
+        for i in ['Month', 'Year', 'Tre-id']:
+            if i in observationColumns:
+                observationColumns.remove(i)
+
+        header, columnsIndexes, timeColumnIndex = get_header(
+            '\t'.join(firstRow), dateColumn, ','.join(observationColumns),
+            'Time')
+    else:
+        timeColumnIndex = None
+        header, columnsIndexes = get_header('\t'.join(firstRow),
+                                            dateColumn,
+                                            ','.join(firstRow))
+    yield header.rstrip('\n').split(',')
+
+    rows, cellsIndexes = read_xls_columns(xlSheet, columnsIndexes,
+                                          timeColumnIndex, offset)
+    if timeColumnIndex is not None:
+        # timestamps were already standardized by read_xls_columns
+        timestampFormat = 'YYYY-MM-DDTHH:MM:SS.SSSSSS+HH:MM'
+    for row in project_cells(rows, timestampFormat, offset, cellsIndexes):
+        yield row
+
+
+def read_xls_columns(xlSheet, columnsIndexes, timeColumnIndex=None,
+                     offset=None):
+    """
+    read only wanted columns of the sheet in bulk
+    :param xlSheet: xlrd sheet with observations from the fifth row
+    :param columnsIndexes: ObservationPlan (dict in format
+                           {observation name: column index})
+    :param timeColumnIndex: index of column with times if they are separated
+                            from dates (DATE+TIME format), dates and times
+                            are then combined into standardized timestamps
+    :param offset: offset of timestamp (used only with timeColumnIndex)
+    :return rows: iterable of tuples of typed cells of wanted columns
+    :return cellsIndexes: ObservationPlan with indexes of cells in rows
+    """
+
+    dateIndex = columnsIndexes[
+        'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601']
+    wanted = sorted(set(columnsIndexes.values()))
+
+    columns = list()
+    for colIndex in wanted:
+        values = xlSheet.col_values(colIndex, start_rowx=4)
+        if colIndex == dateIndex:
+            if timeColumnIndex is not None:
+                times = xlSheet.col_values(timeColumnIndex, start_rowx=4)
+                values = get_xls_timestamps(values, times,
+                                            xlSheet.book.datemode, offset)
             else:
-                header, columnsIndexes = get_header(','.join(firstRow),
-                                                    dateColumn,
-                                                    ','.join(firstRow[2:]))
-            o.write(header)
-
-            columnsMax = max(columnsIndexes.values()) + 1
-
-            for rowIndex in range(4, fileLength):
-                cells = list()
-                for colIndex in range(columnsMax):
-                    cell = xlSheet.cell(rowIndex, colIndex).value
-                    if not isinstance(cell, unicode):
-                        cell = str(cell)
-                    cells.append(cell)
-
-                    dateIndex = columnsIndexes[
-                        'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601']
-                    cells[dateIndex] = 'DATE{}TIME{}'.format(
-                        cells[dateIndex], cells[timeColumnIndex])
-                o.write(get_observations('\t'.join(cells), timestampFormat,
-                                         offset, columnsIndexes))
-
-            o.close()
\ No newline at end of file
+                values = [format_cell(v) for v in values]
+        columns.append(values)
+
+    cellsIndexes = ObservationPlan(
+        dict((name, wanted.index(index)) for name, index in
+             columnsIndexes.items()))
+
+    return zip(*columns), cellsIndexes
+
+
+def get_xls_timestamps(dates, times, datemode, offset):
+    """
+    combine columns of dates and times into timestamps in
+    YYYY-MM-DDTHH:MM:SS.SSSSSS+HH:MM format, cells stored as Excel serial
+    numbers are added together and rounded to seconds, text cells
+    (DD.MM.YYYY and HH:MM:SS) are parsed as in the DATE+TIME format
+    :param dates: values of cells with dates
+    :param times: values of cells with times
+    :param datemode: datemode of the workbook (0 for 1900, 1 for 1904 based)
+    :param offset: offset of timestamp
+    :return timestamps: list of standardized timestamps
+    """
+
+    import datetime
+
+    if datemode == 1:
+        epoch = datetime.date(1904, 1, 1)
+    else:
+        epoch = datetime.date(1899, 12, 30)
+
+    days = DateMemo(lambda d: (epoch + datetime.timedelta(d)).isoformat())
+    clock = DateMemo(lambda s: 'T{:02d}:{:02d}:{:02d}.000000{}'.format(
+        s // 3600, s // 60 % 60, s % 60, offset), 86400)
+    parseText = get_timestamp_parser('DATE+TIME', offset)
+
+    timestamps = list()
+    for date, time in zip(dates, times):
+        if isinstance(date, float) and isinstance(time, float):
+            day, second = divmod(int(round((date + time) * 86400)), 86400)
+            timestamps.append(days[day] + clock[second])
+        else:
+            timestamps.append(parseText('DATE{}TIME{}'.format(
+                get_xls_text(date, datemode, '{2:02d}.{1:02d}.{0:04d}'),
+                get_xls_text(time, datemode, '{3:02d}:{4:02d}:{5:02d}'))))
+
+    return timestamps
+
+
+def get_xls_text(value, datemode, textFormat):
+    """
+    get text of a date or time cell
+    :param value: value of the cell (text or Excel serial number)
+    :param datemode: datemode of the workbook
+    :param textFormat: format of the text of serial numbers, filled with
+                       items of xlrd.xldate_as_tuple
+    :return: text of the cell
+    """
+
+    if isinstance(value, float):
+        return textFormat.format(*xlrd.xldate_as_tuple(value, datemode))
+
+    return value
+
+
+def get_xls_files(path):
+    """
+    get all .xls files with observations in the directory
+    :param path: path to the directory (or a prefix of files in it)
+    :return files: sorted list of paths to .xls files
+    """
+
+    import glob
+    files = glob.glob("{}*.xls".format(path))
+    for f in glob.glob("{}*.XLS".format(path)):
+        files.append(f)
+
+    return sorted(files)
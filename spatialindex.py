@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ spatialindex
+
+ Grid spatial index of procedures from the geometry index (coordinates in
+ UTM zones or WGS84) with nearest neighbour and within radius queries
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import argparse
+import math
+
+# mean radius of the Earth in meters
+earthRadius = 6371008.8
+
+
+class SpatialIndex(object):
+    """
+    Procedures in cells of a regular longitude/latitude grid, queries visit
+    only cells intersecting the searched area
+    """
+
+    def __init__(self, cellSize=0.01):
+        """
+        :param cellSize: size of grid cells in degrees (0.01 is about 1 km)
+        """
+
+        self.cellSize = cellSize
+        self.lonCells = int(math.ceil(360 / cellSize))
+        # cells in format {(lat index, lon index): [(lon, lat, record)]}
+        self.cells = dict()
+        self.count = 0
+
+    def get_cell(self, lon, lat):
+        """
+        :param lon: longitude in degrees
+        :param lat: latitude in degrees
+        :return: tuple (lat index, lon index) of the cell
+        """
+
+        return (int(math.floor(lat / self.cellSize)),
+                int(math.floor((lon + 180) / self.cellSize)) % self.lonCells)
+
+    def add(self, lon, lat, record):
+        """
+        Add a procedure to the index
+        :param lon: longitude in degrees
+        :param lat: latitude in degrees
+        :param record: anything describing the procedure (e.g. record of
+                       geometryindex.GeometryIndex)
+        """
+
+        self.cells.setdefault(self.get_cell(lon, lat), []).append(
+            (lon, lat, record))
+        self.count += 1
+
+    def within(self, lon, lat, radius):
+        """
+        Find procedures not farther than radius from the point
+        :param lon: longitude in degrees
+        :param lat: latitude in degrees
+        :param radius: maximal distance in meters
+        :return found: list of tuples (distance in meters, record) sorted by
+                       distance
+        """
+
+        found = list()
+
+        for cell in self.get_cells_around(lon, lat, radius):
+            for pointLon, pointLat, record in self.cells.get(cell, ()):
+                distance = get_distance(lon, lat, pointLon, pointLat)
+                if distance <= radius:
+                    found.append((distance, record))
+
+        found.sort(key=lambda f: f[0])
+
+        return found
+
+    def nearest(self, lon, lat, maxDistance=None):
+        """
+        Find the nearest procedure, the searched radius grows twice until
+        something is found
+        :param lon: longitude in degrees
+        :param lat: latitude in degrees
+        :param maxDistance: maximal distance in meters (None for unlimited)
+        :return: tuple (distance in meters, record) or None if nothing found
+        """
+
+        radius = self.cellSize * math.pi / 180 * earthRadius
+        limit = maxDistance or math.pi * earthRadius
+
+        while self.count:
+            found = self.within(lon, lat, min(radius, limit))
+            if found:
+                return found[0]
+            if radius >= limit:
+                break
+            radius *= 2
+
+    def get_cells_around(self, lon, lat, radius):
+        """
+        Get cells intersecting the bounding box of the circle
+        :param lon: longitude in degrees
+        :param lat: latitude in degrees
+        :param radius: radius of the circle in meters
+        :return: list of tuples (lat index, lon index)
+        """
+
+        latDelta = math.degrees(radius / earthRadius)
+        south, west = self.get_cell(lon, max(lat - latDelta, -90))
+        north = self.get_cell(lon, min(lat + latDelta, 90))[0]
+
+        # meridians converge, use the latitude of the box nearest to a pole
+        farthestLat = min(abs(lat) + latDelta, 90)
+        if farthestLat < 90:
+            lonDelta = latDelta / math.cos(math.radians(farthestLat))
+        else:
+            lonDelta = 180
+
+        if lonDelta >= 180:
+            lonIndexes = range(self.lonCells)
+        else:
+            west = self.get_cell(lon - lonDelta, lat)[1]
+            east = self.get_cell(lon + lonDelta, lat)[1]
+            width = (east - west) % self.lonCells
+            lonIndexes = [i % self.lonCells for i in
+                          range(west, west + width + 1)]
+
+        return [(latIndex, lonIndex) for latIndex in range(south, north + 1)
+                for lonIndex in lonIndexes]
+
+    def __len__(self):
+        return self.count
+
+
+def build_spatial_index(geometryIndex, cellSize=0.01):
+    """
+    Build spatial index of procedures from the geometry index, procedures
+    with unknown coordinate systems are skipped
+    :param geometryIndex: Path to the CSV file with procedures coords metadata
+                          (or already loaded GeometryIndex)
+    :param cellSize: size of grid cells in degrees
+    :return spatialIndex: SpatialIndex of records of GeometryIndex
+    """
+
+    from geometryindex import get_geometry_index
+
+    geometryIndex = get_geometry_index(geometryIndex)
+    geometryIndex.reproject('4326')
+    spatialIndex = SpatialIndex(cellSize)
+
+    for record in geometryIndex.procedures:
+        coordinates = record['coordinates'].get('4326')
+        if coordinates is not None:
+            spatialIndex.add(coordinates[0], coordinates[1], record)
+
+    return spatialIndex
+
+
+def utm_to_wgs84(easting, northing, zone, northern=True):
+    """
+    Convert UTM coordinates into WGS84 (series of Snyder, Map Projections -
+    A Working Manual, error under 2 cm inside the zone, under 1 m at the
+    edges of UTM eastings)
+    :param easting: easting in meters
+    :param northing: northing in meters
+    :param zone: number of UTM zone
+    :param northern: False for the southern hemisphere
+    :return: tuple (longitude, latitude) in degrees
+    """
+
+    k0 = 0.9996
+    a = 6378137.0
+    e2 = 0.00669437999014
+    ep2 = e2 / (1 - e2)
+    e1 = (1 - math.sqrt(1 - e2)) / (1 + math.sqrt(1 - e2))
+
+    x = easting - 500000.0
+    y = northing
+    if northern is False:
+        y -= 10000000.0
+
+    mu = y / k0 / (a * (1 - e2 / 4 - 3 * e2 ** 2 / 64 - 5 * e2 ** 3 / 256))
+    phi1 = mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * math.sin(2 * mu) + \
+        (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * math.sin(4 * mu) + \
+        (151 * e1 ** 3 / 96) * math.sin(6 * mu) + \
+        (1097 * e1 ** 4 / 512) * math.sin(8 * mu)
+
+    sin1 = math.sin(phi1)
+    cos1 = math.cos(phi1)
+    tan1 = math.tan(phi1)
+    n1 = a / math.sqrt(1 - e2 * sin1 ** 2)
+    t1 = tan1 ** 2
+    c1 = ep2 * cos1 ** 2
+    r1 = a * (1 - e2) / (1 - e2 * sin1 ** 2) ** 1.5
+    d = x / (n1 * k0)
+
+    lat = phi1 - n1 * tan1 / r1 * (
+        d ** 2 / 2 -
+        (5 + 3 * t1 + 10 * c1 - 4 * c1 ** 2 - 9 * ep2) * d ** 4 / 24 +
+        (61 + 90 * t1 + 298 * c1 + 45 * t1 ** 2 - 252 * ep2 - 3 * c1 ** 2) *
+        d ** 6 / 720)
+    lon = (d - (1 + 2 * t1 + c1) * d ** 3 / 6 +
+           (5 - 2 * c1 + 28 * t1 - 3 * c1 ** 2 + 8 * ep2 + 24 * t1 ** 2) *
+           d ** 5 / 120) / cos1
+
+    return (zone - 1) * 6 - 177 + math.degrees(lon), math.degrees(lat)
+
+
+def get_distance(lon1, lat1, lon2, lat2):
+    """
+    Get great circle distance of two points (haversine formula)
+    :return: distance in meters
+    """
+
+    lat1 = math.radians(lat1)
+    lat2 = math.radians(lat2)
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * \
+        math.sin(math.radians(lon2 - lon1) / 2) ** 2
+
+    return 2 * earthRadius * math.asin(min(1, math.sqrt(h)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Find procedures of the geometry index near a point.')
+
+    parser.add_argument(
+        '-index_file',
+        type=str,
+        dest='index_file',
+        required=True,
+        help='Path to the index file')
+
+    parser.add_argument(
+        '-lon',
+        type=float,
+        required=True,
+        help='Longitude of the point (WGS84)')
+
+    parser.add_argument(
+        '-lat',
+        type=float,
+        required=True,
+        help='Latitude of the point (WGS84)')
+
+    parser.add_argument(
+        '-radius',
+        type=float,
+        help='List all procedures within the radius in meters (default: '
+             'only the nearest one)')
+
+    args = parser.parse_args()
+
+    spatialIndex = build_spatial_index(args.__dict__['index_file'])
+    if args.__dict__['radius'] is None:
+        found = [spatialIndex.nearest(args.__dict__['lon'],
+                                      args.__dict__['lat'])]
+    else:
+        found = spatialIndex.within(args.__dict__['lon'],
+                                    args.__dict__['lat'],
+                                    args.__dict__['radius'])
+
+    for distance, record in filter(None, found):
+        print('{} ({:.1f} m)'.format(record['procid'], distance))
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ staging
+
+ Columnar binary staging of observations (.npy arrays of timestamps and
+ values, memory-mappable) as an alternative to text .dat intermediates
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import argparse
+import itertools
+import json
+import operator
+import os
+import shutil
+from istsosdat import write_dat
+
+timeColumn = 'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601'
+
+
+def write_staging(stagingPath, rows, procedure=None, offering=None,
+                  chunkSize=65536):
+    """
+    write observations into a staging directory (time.npy with UTC
+    datetime64[us], <column number>.npy with float64 values and meta.json),
+    the directory is removed if anything fails, only the greatest number of
+    decimal places of each column is kept and not numeric values are staged
+    as missing (NaN)
+    :param stagingPath: path to the staging directory
+    :param rows: iterable of lists of values, the first one with the names
+                 of columns (as yielded by iter_observations)
+    :param procedure: who provides the observations (saved in meta.json)
+    :param offering: offering of the procedure (saved in meta.json)
+    :param chunkSize: number of timestamps parsed at once
+    :return count: number of staged observations
+    """
+
+    import numpy
+
+    rows = iter(rows)
+    header = next(rows)
+    timeIndex = header.index(timeColumn)
+    valueIndexes = [i for i in range(len(header)) if i != timeIndex]
+
+    meta = {'columns': [header[i] for i in valueIndexes],
+            'decimals': [0] * len(valueIndexes),
+            'offset': None,
+            'procedure': procedure,
+            'offering': offering}
+
+    # chunks of microseconds since epoch and of values of each column
+    times = list()
+    values = [list() for i in valueIndexes]
+
+    if os.path.isdir(stagingPath):
+        shutil.rmtree(stagingPath)
+    os.makedirs(stagingPath)
+
+    try:
+        for chunk in iter(lambda: list(itertools.islice(rows, chunkSize)),
+                          []):
+            columns = [list(map(operator.itemgetter(i), chunk))
+                       for i in range(len(header))]
+
+            offsets = set(map(operator.itemgetter(slice(-6, None)),
+                              columns[timeIndex]))
+            if meta['offset'] is None:
+                meta['offset'] = chunk[0][timeIndex][-6:]
+            if offsets != set([meta['offset']]):
+                raise ValueError('Timestamps have other offsets than {} '
+                                 '({})'.format(meta['offset'],
+                                               ', '.join(sorted(offsets))))
+
+            times.append(get_utc_microseconds(
+                list(map(operator.itemgetter(slice(None, -6)),
+                         columns[timeIndex])), meta['offset']))
+            for column, index in enumerate(valueIndexes):
+                columnValues, decimals = parse_values(columns[index])
+                values[column].append(columnValues)
+                meta['decimals'][column] = max(meta['decimals'][column],
+                                               decimals)
+
+        meta.update({'count': sum(len(t) for t in times)})
+
+        numpy.save(os.path.join(stagingPath, 'time.npy'),
+                   numpy.concatenate(times or [numpy.zeros(0, 'i8')]).view(
+                       'datetime64[us]'))
+        for column in range(len(values)):
+            numpy.save(os.path.join(stagingPath, '{}.npy'.format(column)),
+                       numpy.concatenate(values[column] or
+                                         [numpy.zeros(0, 'f8')]))
+
+        with open(os.path.join(stagingPath, 'meta.json'), 'w') as m:
+            json.dump(meta, m)
+    except Exception:
+        shutil.rmtree(stagingPath)
+        raise
+
+    return meta['count']
+
+
+class StagedObservations(object):
+    """
+    Observations from a staging directory, arrays are memory-mapped
+    """
+
+    def __init__(self, stagingPath):
+        """
+        :param stagingPath: path to the staging directory
+        """
+
+        import numpy
+
+        self.path = stagingPath
+
+        with open(os.path.join(stagingPath, 'meta.json'), 'r') as m:
+            self.meta = json.load(m)
+
+        self.columns = self.meta['columns']
+        self.time = numpy.load(os.path.join(stagingPath, 'time.npy'),
+                               mmap_mode='r')
+        self.values = [numpy.load(os.path.join(stagingPath,
+                                               '{}.npy'.format(column)),
+                                  mmap_mode='r')
+                       for column in range(len(self.columns))]
+
+    def __len__(self):
+        return self.meta['count']
+
+    def iter_rows(self, chunkSize=65536):
+        """
+        read observations in istSOS format (generator), values are
+        normalised: all values of a column have its greatest number of
+        decimal places (100 is read as 100.0 if the column contains 54.5)
+        and not numeric values of the staged file are empty
+        :param chunkSize: number of observations formatted at once
+        :return: yields list of names of columns first (as in .dat header),
+                 then lists of values
+        """
+
+        import numpy
+
+        yield [timeColumn] + self.columns
+
+        # offset is None in directories without observations
+        offset = self.meta['offset']
+        offsetDelta = numpy.timedelta64(0, 'm')
+        if offset:
+            offsetDelta = numpy.timedelta64(get_offset_minutes(offset), 'm')
+
+        for start in range(0, len(self), chunkSize):
+            end = min(start + chunkSize, len(self))
+            timestamps = numpy.datetime_as_string(
+                self.time[start:end] + offsetDelta, unit='us')
+            columns = [format_values(self.values[column][start:end],
+                                     self.meta['decimals'][column])
+                       for column in range(len(self.columns))]
+
+            for i in range(end - start):
+                yield ['{}{}'.format(timestamps[i], offset)] + \
+                      [column[i] for column in columns]
+
+    def to_dat(self, datPath):
+        """
+        export observations into istSOS .dat file, values are normalised as
+        in iter_rows (the .dat file equals the original one only if values
+        of each column have the same number of decimal places)
+        :param datPath: path to the .dat file
+        :return count: number of written observations
+        """
+
+        return write_dat(datPath, self.iter_rows())
+
+
+def get_staging_path(datPath):
+    """
+    get the path to the staging directory used instead of .dat file
+    :param datPath: path to the .dat file (see get_dat_filepath)
+    :return: path to the staging directory
+    """
+
+    return '{}.stage'.format(datPath[:-4])
+
+
+def get_utc_microseconds(timestamps, offset):
+    """
+    convert local ISO timestamps into microseconds since epoch in UTC
+    :param timestamps: list of timestamps without offset
+                       (YYYY-MM-DDTHH:MM:SS.SSSSSS)
+    :param offset: offset of timestamps in format +HH:MM
+    :return: numpy array of int64
+    """
+
+    import numpy
+
+    local = numpy.array(timestamps, dtype='datetime64[us]')
+    utc = local - numpy.timedelta64(get_offset_minutes(offset), 'm')
+
+    return utc.view('i8')
+
+
+def get_offset_minutes(offset):
+    """
+    :param offset: offset in format +HH:MM
+    :return: offset in minutes
+    """
+
+    minutes = int(offset[1:3]) * 60 + int(offset[4:6])
+    if offset[0] == '-':
+        return -minutes
+    return minutes
+
+
+def parse_values(values):
+    """
+    convert values of one column into floats
+    :param values: sequence of values from istSOS rows
+    :return: tuple (numpy array of floats with NaN for empty or not numeric
+             values, maximal number of decimal places)
+    """
+
+    import numpy
+
+    strings = numpy.array(values, dtype=str)
+
+    try:
+        floats = strings.astype('f8')
+    except ValueError:
+        floats = numpy.array([get_float(v) for v in values], dtype='f8')
+
+    points = numpy.char.find(strings, '.')
+    decimals = numpy.where(points >= 0,
+                           numpy.char.str_len(strings) - points - 1, 0)
+
+    return floats, int(decimals.max()) if len(values) else 0
+
+
+def get_float(value):
+    """
+    :param value: value from istSOS row
+    :return: float, NaN for empty or not numeric values
+    """
+
+    try:
+        return float(value)
+    except ValueError:
+        return float('nan')
+
+
+def format_values(values, decimals):
+    """
+    format float values with given number of decimal places (the same for
+    the whole column)
+    :param values: numpy array of floats
+    :param decimals: number of decimal places
+    :return: list of strings, NaN values as empty strings
+    """
+
+    formatString = '{{:.{}f}}'.format(decimals)
+
+    return [formatString.format(v) if v == v else '' for v in values.tolist()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export a staging directory into istSOS .dat file.')
+
+    parser.add_argument(
+        '-path',
+        type=str,
+        dest='path',
+        required=True,
+        help='Path to the staging directory')
+
+    parser.add_argument(
+        '-output',
+        type=str,
+        help='Path to the .dat file (default: the staging path with .dat '
+             'extension)')
+
+    args = parser.parse_args()
+
+    staged = StagedObservations(args.__dict__['path'].rstrip(os.sep))
+    output = args.__dict__['output'] or '{}.dat'.format(
+        staged.path[:-len('.stage')])
+    print('{} observations exported into {}'.format(staged.to_dat(output),
+                                                    output))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the numpy engine parsing whole files into arrays
+"""
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+import convert2dat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+demoPath = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'demo',
+                        'demo-sample-service')
+
+
+def convert_demo(directory, engine):
+    """
+    convert .swd files of all demo loggers with the engine
+    :param directory: path to the directory with a copy of demo data
+    :param engine: 'text' or 'numpy'
+    :return: dictionary in format {path relative to directory: content}
+    """
+
+    for index in sorted(glob.glob(os.path.join(directory, '*', '*',
+                                               'INDEX.SWD'))):
+        observationsPath = os.path.join(os.path.dirname(index), '')
+        results = convert2dat.convert(convert2dat.get_config(
+            observationsPath,
+            timestamp_column=observationsPath.split(os.sep)[-2],
+            timestamp_format='YYYY-MM-DD HH:MM',
+            procedure='P',
+            file_extension='swd',
+            timestamp_suffix='20170101000000',
+            engine=engine,
+            d=True,
+            t=True))
+        assert all(r[1] is None for r in results), results
+
+    contents = dict()
+    for datPath in glob.glob(os.path.join(directory, '*', '*', '*.dat')):
+        with open(datPath, 'rb') as d:
+            contents.update({os.path.relpath(datPath, directory): d.read()})
+
+    return contents
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class EngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_engines_give_the_same_dat_files(self):
+        contents = dict()
+        for engine in ['text', 'numpy']:
+            engineDirectory = os.path.join(self.directory, engine)
+            shutil.copytree(demoPath, engineDirectory)
+            contents.update({engine: convert_demo(engineDirectory, engine)})
+
+        self.assertEqual(len(contents['text']), 352)
+        self.assertEqual(sorted(contents['numpy']),
+                         sorted(contents['text']))
+        for path in contents['text']:
+            self.assertEqual(contents['numpy'][path], contents['text'][path],
+                             path)
+
+    def test_engines_give_the_same_values(self):
+        rows = dict()
+        for engine in ['text', 'numpy']:
+            loggerPath = os.path.join(self.directory, engine, 'L1', '')
+            os.makedirs(loggerPath)
+            with open(os.path.join(loggerPath, 'INDEX.SWD'), 'w') as i:
+                i.write('TMP\tTemperature (*C)\t\r\nHMD\tRH (%)\r\n')
+            with open(os.path.join(loggerPath, 'SD201107.SWD'), 'w') as s:
+                s.write('L1\tTemperature (*C)\tRH (%)\r\n\t*C\t%\r\n'
+                        '\tTMP\tHMD\r\n'
+                        '2011-07-20 16:15\t1\t71,4\r\n'
+                        '2011-07-20 18:15\t-0,5\t\r\n'
+                        '2011-07-20 20:15\t12,25\t100\r\n'
+                        '2011-07-20 22:15\t\t9,0\r\n')
+
+            convert2dat.convert(convert2dat.get_config(
+                loggerPath,
+                timestamp_column='L1',
+                timestamp_format='YYYY-MM-DD HH:MM',
+                procedure='P',
+                file_extension='swd',
+                engine=engine,
+                d=True,
+                t=True))
+            with open(os.path.join(loggerPath, 'P_20110731235959000.dat'),
+                      'r') as d:
+                rows.update({engine: [l.split(',') for l in
+                                      d.read().splitlines()]})
+
+        self.assertEqual(rows['numpy'][0], rows['text'][0])
+        self.assertEqual(len(rows['numpy']), 5)
+        for numpyRow, textRow in zip(rows['numpy'][1:], rows['text'][1:]):
+            self.assertEqual(numpyRow[0], textRow[0])
+            self.assertEqual([float(v) if v else None for v in numpyRow[1:]],
+                             [float(v) if v else None for v in textRow[1:]])
+        # numpy writes values with decimal places of their column
+        self.assertEqual(rows['numpy'][1][1:], ['1.00', '71.4'])
+        self.assertEqual(rows['text'][1][1:], ['1', '71.4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of direct upload of observations against the local stand-in of the
+WA REST API
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from benchmark.istsos_standin import StandinServer, timeColumn
+
+try:
+    import requests
+    from requests.packages.urllib3.exceptions import MaxRetryError, \
+        NewConnectionError
+    from istsoswa import ObservationUploader, post_with_retry
+except ImportError:
+    ObservationUploader = None
+
+procedure = 'B4 200cm'
+
+
+@unittest.skipIf(ObservationUploader is None, 'requests is not installed')
+class ObservationUploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.logPath = os.path.join(self.directory, 'requests.jsonl')
+        self.server = StandinServer(
+            ('127.0.0.1', 0),
+            {procedure: ['Temperature', 'Temperature:qualityIndex', 'RH'],
+             None: list()},
+            5, self.logPath)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def get_rows(self, count):
+        yield [timeColumn, 'RH', 'Temperature']
+        for i in range(count):
+            yield ['2011-07-20T{:02d}:15:00.000000+01:00'.format(i),
+                   '{}.5'.format(50 + i), '{}.1'.format(10 + i)]
+
+    def read_log(self):
+        with open(self.logPath, 'r') as log:
+            return [json.loads(line) for line in log]
+
+    def test_batches(self):
+        uploader = ObservationUploader(self.url, 'test', batchSize=5)
+
+        self.assertEqual(uploader.upload('test', procedure,
+                                         self.get_rows(12)), 12)
+        self.assertEqual(self.server.summary['errors'], list())
+        self.assertEqual(self.server.summary['requests'], 3)
+        self.assertEqual(self.server.summary['observations'],
+                         {procedure: 12})
+
+        requests = self.read_log()
+        values = [r['body']['Observation']['result']['DataArray']['values']
+                  for r in requests]
+        self.assertEqual([len(v) for v in values], [5, 5, 2])
+        # columns in the order of the template, quality indexes filled
+        self.assertEqual(values[0][0], ['2011-07-20T00:15:00.000000+01:00',
+                                        '10.1', '100', '50.5'])
+        self.assertEqual(
+            requests[2]['body']['Observation']['samplingTime'],
+            {'beginPosition': '2011-07-20T10:15:00.000000+01:00',
+             'endPosition': '2011-07-20T11:15:00.000000+01:00'})
+
+    def test_rejected_batch(self):
+        uploader = ObservationUploader(self.url, 'test', batchSize=10)
+
+        with self.assertRaises(IOError):
+            uploader.upload('test', procedure, self.get_rows(12))
+        self.assertEqual(len(self.server.summary['errors']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class FakeSession(object):
+    """
+    Session raising or returning prepared outcomes of POST requests
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.attempts = 0
+
+    def post(self, url, data=None):
+        self.attempts += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@unittest.skipIf(ObservationUploader is None, 'requests is not installed')
+class PostWithRetryTest(unittest.TestCase):
+
+    def get_refused(self):
+        return requests.ConnectionError(MaxRetryError(
+            None, '/insertobservation',
+            NewConnectionError(None, 'Connection refused')))
+
+    def test_refused_connection_is_repeated(self):
+        session = FakeSession([self.get_refused(), self.get_refused(), 'OK'])
+
+        self.assertEqual(post_with_retry(session, 'url', '{}', backoff=0),
+                         'OK')
+        self.assertEqual(session.attempts, 3)
+
+    def test_connect_timeout_is_repeated(self):
+        session = FakeSession([requests.exceptions.ConnectTimeout(), 'OK'])
+
+        self.assertEqual(post_with_retry(session, 'url', '{}', backoff=0),
+                         'OK')
+        self.assertEqual(session.attempts, 2)
+
+    def test_retries_are_limited(self):
+        session = FakeSession([self.get_refused()] * 3)
+
+        self.assertRaises(requests.ConnectionError, post_with_retry,
+                          session, 'url', '{}', retries=2, backoff=0)
+        self.assertEqual(session.attempts, 3)
+
+    def test_sent_request_is_not_repeated(self):
+        session = FakeSession([requests.ConnectionError('Connection reset'),
+                               'OK'])
+
+        self.assertRaises(requests.ConnectionError, post_with_retry,
+                          session, 'url', '{}', backoff=0)
+        self.assertEqual(session.attempts, 1)
+
+    def test_server_error_is_not_repeated(self):
+        response = requests.Response()
+        response.status_code = 500
+        session = FakeSession([response, 'OK'])
+
+        self.assertIs(post_with_retry(session, 'url', '{}', backoff=0),
+                      response)
+        self.assertEqual(session.attempts, 1)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of merging of overlapping .swd files of one procedure
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from istsosdat import merge_observations
+from scripts.swd2dat import iter_swd_observations, merge_swd_files
+
+try:
+    import numpy
+    from bulkparse import read_swd_arrays, merge_arrays
+except ImportError:
+    numpy = None
+
+timeColumn = 'urn:ogc:def:parameter:x-istsos:1.0:time:iso8601'
+
+
+def get_row(time, value):
+    return ['2011-07-20T{}:00.000000+01:00'.format(time), value]
+
+
+class MergeTest(unittest.TestCase):
+
+    engines = ['text']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files = list()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_swd(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as s:
+            s.write('L1\tTemperature (*C)\r\n\t*C\r\n\tTMP\r\n')
+            for line in lines:
+                s.write('2011-07-20 {}\r\n'.format(line))
+        self.files.append(path)
+
+    def write_overlapping(self, duplicate):
+        self.write_swd('SD201107.SWD', ['00:15\t1,0', '02:15\t2,0',
+                                        '04:15\t3,0'])
+        self.write_swd('SD201108.SWD', ['01:15\t1,5', '04:15\t' + duplicate,
+                                        '06:15\t4,0'])
+
+    def merge(self, duplicates, engine='text'):
+        """
+        :return: tuple (merged rows with header, number of dropped rows)
+        """
+
+        arguments = ('Temperature', 'L1', 'YYYY-MM-DD HH:MM', '+01:00')
+
+        if engine == 'numpy':
+            arraysList = [read_swd_arrays(f, *arguments) for f in self.files]
+            arrays = merge_arrays(arraysList, duplicates)
+            return list(arrays.iter_rows()), \
+                sum(len(a) for a in arraysList) - len(arrays)
+
+        counts = dict()
+        rows = list(merge_observations(
+            [iter_swd_observations(f, *arguments) for f in self.files],
+            duplicates, counts))
+        return rows, counts['dropped']
+
+    def test_identical_duplicates(self):
+        self.write_overlapping('3,0')
+
+        for engine in self.engines:
+            for duplicates in ['first', 'last', 'error']:
+                self.assertEqual(self.merge(duplicates, engine), (
+                    [[timeColumn, 'Temperature'],
+                     get_row('00:15', '1.0'), get_row('01:15', '1.5'),
+                     get_row('02:15', '2.0'), get_row('04:15', '3.0'),
+                     get_row('06:15', '4.0')], 1))
+
+    def test_conflicting_duplicates(self):
+        self.write_overlapping('9,0')
+
+        for engine in self.engines:
+            rows, dropped = self.merge('first', engine)
+            self.assertEqual(rows[4], get_row('04:15', '3.0'))
+            self.assertEqual((len(rows), dropped), (6, 1))
+
+            rows, dropped = self.merge('last', engine)
+            self.assertEqual(rows[4], get_row('04:15', '9.0'))
+            self.assertEqual((len(rows), dropped), (6, 1))
+
+            with self.assertRaises(ValueError):
+                self.merge('error', engine)
+
+    def test_unsorted_file(self):
+        self.write_swd('SD201107.SWD', ['00:15\t1,0', '05:15\t5,0',
+                                        '03:15\t3,0', '06:15\t6,0'])
+
+        for engine in self.engines:
+            self.assertEqual(self.merge('first', engine), (
+                [[timeColumn, 'Temperature'],
+                 get_row('00:15', '1.0'), get_row('05:15', '5.0'),
+                 get_row('06:15', '6.0')], 1))
+
+            with self.assertRaises(ValueError):
+                self.merge('error', engine)
+
+    def test_merged_dat_file(self):
+        self.write_overlapping('9,0')
+
+        for engine in self.engines:
+            results = merge_swd_files(self.files, 'Temperature', 'L1',
+                                      'YYYY-MM-DD HH:MM', '+01:00', 'P',
+                                      duplicates='last', engine=engine)
+            self.assertEqual([r[1] for r in results], [None, None])
+            with open(os.path.join(self.directory,
+                                   'P_20110831235959000.dat'), 'r') as d:
+                self.assertEqual(d.read().splitlines()[4],
+                                 ','.join(get_row('04:15', '9.0')))
+
+            results = merge_swd_files(self.files, 'Temperature', 'L1',
+                                      'YYYY-MM-DD HH:MM', '+01:00', 'P',
+                                      duplicates='error', engine=engine)
+            self.assertTrue(all(r[1].startswith('ValueError')
+                                for r in results))
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class MergeArraysTest(MergeTest):
+
+    engines = ['numpy']
+
+
+if __name__ == '__main__':
+    unittest.main()
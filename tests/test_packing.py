@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of packing of .dat files of procedures
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from packing import pack_procedure
+from staging import timeColumn
+
+
+class PackProcedureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.packPath = os.path.join(self.directory, 'pack')
+        os.mkdir(self.packPath)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_dat(self, name, header, rows):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as d:
+            d.write(','.join(header) + '\n')
+            for row in rows:
+                d.write(','.join(row) + '\n')
+        return path
+
+    def read_packed(self, packedFiles):
+        lines = list()
+        for packedFile in packedFiles:
+            with open(packedFile, 'r') as p:
+                lines.append(p.read().splitlines())
+        return lines
+
+    def get_files(self, second):
+        return [
+            self.write_dat('P_20110731235959000.dat', [timeColumn, 'T'],
+                           [['2011-07-01T00:00:00.000000+01:00', '1.0'],
+                            ['2011-07-01T01:00:00.000000+01:00', '2.0']]),
+            self.write_dat('P_20110831235959000.dat', [timeColumn, 'T'],
+                           [['2011-07-01T01:00:00.000000+01:00', second],
+                            ['2011-07-01T02:00:00.000000+01:00', '3.0']])]
+
+    def test_merged(self):
+        packedFiles = pack_procedure(self.get_files('2.0'), self.packPath,
+                                     'P', duplicates='error')
+
+        self.assertEqual(
+            [os.path.basename(f) for f in packedFiles],
+            ['P_20110831235959000.dat'])
+        self.assertEqual(self.read_packed(packedFiles), [[
+            '{},T'.format(timeColumn),
+            '2011-07-01T00:00:00.000000+01:00,1.0',
+            '2011-07-01T01:00:00.000000+01:00,2.0',
+            '2011-07-01T02:00:00.000000+01:00,3.0']])
+
+    def test_conflict_is_not_packed(self):
+        with self.assertRaises(ValueError):
+            pack_procedure(self.get_files('5.0'), self.packPath, 'P',
+                           duplicates='error')
+
+        self.assertEqual(os.listdir(self.packPath), list())
+
+    def test_different_columns_are_copied(self):
+        datFiles = [
+            self.write_dat('P_20110731235959000.dat', [timeColumn, 'T'],
+                           [['2011-07-01T00:00:00.000000+01:00', '1.0']]),
+            self.write_dat('P_20110831235959000.dat', [timeColumn, 'RH'],
+                           [['2011-08-01T00:00:00.000000+01:00', '50.0']])]
+
+        packedFiles = pack_procedure(datFiles, self.packPath, 'P',
+                                     duplicates='error')
+
+        self.assertEqual(sorted(os.listdir(self.packPath)),
+                         ['P_20110731235959000.dat',
+                          'P_20110831235959000.dat'])
+        self.assertEqual(len(packedFiles), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of quality control of observations
+"""
+
+import unittest
+import convert2dat
+from qualitycontrol import get_quality_indexes, check_steps, check_spikes, \
+    check_flatlines
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class QualityControlOptionsTest(unittest.TestCase):
+
+    def get_error(self, path, **kwargs):
+        kwargs.update({'qc': True})
+        return convert2dat.get_quality_control_error(
+            convert2dat.get_config(path, **kwargs))
+
+    def test_swd_conversion(self):
+        self.assertIsNone(self.get_error('logger/', d=True))
+
+    def test_unsupported(self):
+        self.assertIsNotNone(self.get_error('data.csv',
+                                            file_extension='.csv'))
+        self.assertIsNotNone(self.get_error('logger/', d=True,
+                                            staging=True))
+        self.assertIsNotNone(self.get_error('logger/', d=True,
+                                            checkpoints='manifest.sqlite'))
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class QualityIndexesTest(unittest.TestCase):
+
+    def get_failed(self, check, values, limit, valid=None):
+        values = numpy.array(values, dtype='f8')
+        if valid is None:
+            valid = numpy.isfinite(values)
+        return numpy.flatnonzero(check(values, valid, limit)).tolist()
+
+    def test_quality_indexes(self):
+        values = numpy.array([numpy.nan, 70, 20, 21, 50, 22, 23])
+        checks = {'min': -50, 'max': 60, 'step': 10, 'spike': 8}
+
+        # missing, out of range, consistent and failed steps and spikes
+        self.assertEqual(get_quality_indexes(values, checks).tolist(),
+                         [0, 100, 102, 102, 101, 102, 102])
+
+    def test_without_checks(self):
+        values = numpy.array([1, numpy.nan, 1e6])
+
+        self.assertEqual(get_quality_indexes(values, dict()).tolist(),
+                         [102, 0, 102])
+
+    def test_steps(self):
+        self.assertEqual(self.get_failed(check_steps, [10, 30, 10], 10), [1])
+        self.assertEqual(self.get_failed(check_steps, [10, 30, 30, 30], 10),
+                         [1])
+        self.assertEqual(self.get_failed(check_steps, [10, 30, 50], 10),
+                         [1, 2])
+        self.assertEqual(self.get_failed(check_steps, [10, 20, 30], 10), [])
+        # invalid values are skipped
+        self.assertEqual(self.get_failed(check_steps, [10, 99, 15], 10,
+                                         numpy.array([True, False, True])),
+                         [])
+
+    def test_spikes(self):
+        self.assertEqual(self.get_failed(check_spikes, [10, 20, 10], 5), [1])
+        self.assertEqual(self.get_failed(check_spikes, [10, 20, 30], 5), [])
+        # values without both neighbours are not checked
+        self.assertEqual(self.get_failed(check_spikes, [50, 10, 10], 5), [])
+
+    def test_flatlines(self):
+        self.assertEqual(self.get_failed(check_flatlines, [5, 5, 5, 5, 6], 3),
+                         [2, 3])
+        self.assertEqual(self.get_failed(check_flatlines,
+                                         [5, numpy.nan, 5, 5], 3), [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
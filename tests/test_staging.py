@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of columnar staging of observations
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from staging import timeColumn
+
+try:
+    import numpy
+    from staging import StagedObservations, write_staging
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class StagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stagingPath = os.path.join(self.directory, 'P.stage')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def round_trip(self, rows):
+        count = write_staging(self.stagingPath, rows, 'P', 'test')
+        staged = StagedObservations(self.stagingPath)
+        self.assertEqual(len(staged), count)
+
+        datPath = os.path.join(self.directory, 'P.dat')
+        self.assertEqual(staged.to_dat(datPath), count)
+        with open(datPath, 'r') as d:
+            return [line.rstrip('\n').split(',') for line in d]
+
+    def test_round_trip(self):
+        rows = [[timeColumn, 'Temperature', 'RH'],
+                ['2011-07-01T00:15:00.000000+01:00', '-1.25', '71'],
+                ['2011-07-01T00:30:00.000000+01:00', '0.50', '72'],
+                ['2011-10-30T02:45:00.123456+01:00', '12.00', '100']]
+
+        self.assertEqual(self.round_trip(rows), rows)
+
+    def test_negative_offset(self):
+        rows = [[timeColumn, 'Temperature'],
+                ['2011-12-31T23:45:00.000000-03:30', '1'],
+                ['2012-01-01T00:00:00.000000-03:30', '2']]
+
+        self.assertEqual(self.round_trip(rows), rows)
+
+    def test_values_are_normalised(self):
+        rows = [[timeColumn, 'Temperature'],
+                ['2011-07-01T00:15:00.000000+01:00', '100'],
+                ['2011-07-01T00:30:00.000000+01:00', '54.5'],
+                ['2011-07-01T00:45:00.000000+01:00', 'n/a'],
+                ['2011-07-01T01:00:00.000000+01:00', '']]
+
+        self.assertEqual([r[1] for r in self.round_trip(rows)[1:]],
+                         ['100.0', '54.5', '', ''])
+
+    def test_empty_staging(self):
+        self.assertEqual(self.round_trip([[timeColumn, 'Temperature']]),
+                         [[timeColumn, 'Temperature']])
+
+    def test_mixed_offsets_are_rejected(self):
+        rows = [[timeColumn, 'Temperature'],
+                ['2011-07-01T00:15:00.000000+01:00', '1'],
+                ['2011-07-01T00:30:00.000000+02:00', '2']]
+
+        self.assertRaises(ValueError, write_staging, self.stagingPath, rows)
+        self.assertFalse(os.path.exists(self.stagingPath))
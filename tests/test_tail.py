@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of checkpoints of growing .swd files (-tail)
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+import convert2dat
+import data2istsos
+from importmanifest import ImportManifest
+from scripts.swd2dat import swd_file2dat
+
+repositoryPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+demoPath = os.path.join(repositoryPath, 'demo', 'demo-sample-service',
+                        'Templogstasjoner Torino', 'B4 200cm')
+header = 'L1\tTemperature (*C)\r\n\t*C\r\n\tTMP\r\n'
+
+
+def get_lines(firstHour, lastHour):
+    return ['2011-07-01 {:02d}:00\t{},5\r\n'.format(h, h) for h in
+            range(firstHour, lastHour + 1)]
+
+
+def read_values(datPath):
+    if not os.path.isfile(datPath):
+        return list()
+
+    with open(datPath, 'r') as d:
+        return [line.rstrip('\n').split(',')[1] for line in d][1:]
+
+
+class TailTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'SD201107.SWD')
+        self.manifestPath = os.path.join(self.directory, 'manifest.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, lines, mode='w'):
+        with open(self.path, mode) as s:
+            if mode == 'w':
+                s.write(header)
+            s.write(''.join(lines))
+
+    def convert(self, deferCheckpoints=False):
+        return swd_file2dat(self.path, 'Temperature', 'L1',
+                            'YYYY-MM-DD HH:MM', '+01:00', 'P',
+                            checkpoints=self.manifestPath,
+                            deferCheckpoints=deferCheckpoints)
+
+    def get_checkpoint(self):
+        manifest = ImportManifest(self.manifestPath)
+        try:
+            return manifest.get_checkpoint(self.path)
+        finally:
+            manifest.close()
+
+    def test_appended_file_continues_from_checkpoint(self):
+        self.write(get_lines(0, 2))
+        datPath = self.convert()
+        self.assertEqual(read_values(datPath), ['0.5', '1.5', '2.5'])
+
+        # the last line is still being written by the logger
+        self.write(get_lines(3, 4) + ['2011-07-01 05:00\t5'], 'a')
+        self.convert()
+        self.assertEqual(read_values(datPath),
+                         ['0.5', '1.5', '2.5', '3.5', '4.5'])
+
+        self.write([',5\r\n'], 'a')
+        self.convert()
+        self.assertEqual(read_values(datPath),
+                         ['0.5', '1.5', '2.5', '3.5', '4.5', '5.5'])
+        self.assertEqual(self.get_checkpoint()['offset'],
+                         os.path.getsize(self.path))
+
+    def test_rotated_file_is_read_from_start(self):
+        self.write(get_lines(0, 3))
+        datPath = self.convert()
+        os.remove(datPath)
+
+        # rewritten with older and newer lines, longer than the read part
+        self.write(get_lines(2, 6))
+        self.convert()
+        self.assertEqual(read_values(datPath), ['4.5', '5.5', '6.5'])
+
+    def test_truncated_file_is_read_from_start(self):
+        self.write(get_lines(0, 3))
+        datPath = self.convert()
+        os.remove(datPath)
+
+        self.write(get_lines(3, 4))
+        self.convert()
+        self.assertEqual(read_values(datPath), ['4.5'])
+        self.assertEqual(self.get_checkpoint()['offset'],
+                         os.path.getsize(self.path))
+
+    def test_deferred_checkpoint_is_used_after_commit(self):
+        self.write(get_lines(0, 1))
+        datPath = self.convert(deferCheckpoints=True)
+        self.assertEqual(read_values(datPath), ['0.5', '1.5'])
+        self.assertIsNone(self.get_checkpoint()['offset'])
+
+        # not uploaded, the same lines are written again with the new ones
+        self.write(get_lines(2, 2), 'a')
+        self.convert(deferCheckpoints=True)
+        self.assertEqual(read_values(datPath), ['0.5', '1.5', '2.5'])
+
+        manifest = ImportManifest(self.manifestPath)
+        try:
+            manifest.commit_checkpoints([self.directory])
+        finally:
+            manifest.close()
+        self.assertEqual(self.get_checkpoint()['offset'],
+                         os.path.getsize(self.path))
+
+        self.convert(deferCheckpoints=True)
+        self.assertEqual(read_values(datPath), [])
+
+
+class TailUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.observationsPath = os.path.join(self.directory, 'B4 200cm',
+                                             '')
+        os.mkdir(self.observationsPath)
+        for name in ['INDEX.SWD', 'SD201107.SWD']:
+            shutil.copyfile(os.path.join(demoPath, name),
+                            os.path.join(self.observationsPath, name))
+        self.path = os.path.join(self.observationsPath, 'SD201107.SWD')
+        self.datPath = os.path.join(self.observationsPath,
+                                    'B4 200cm_20110731235959000.dat')
+
+        # csv2istsos failing while the file fail exists
+        self.istsosPath = os.path.join(self.directory, 'istsos')
+        os.makedirs(os.path.join(self.istsosPath, 'scripts'))
+        self.failPath = os.path.join(self.istsosPath, 'fail')
+        with open(os.path.join(self.istsosPath, 'scripts', 'csv2istsos.py'),
+                  'w') as c:
+            c.write('import os\n'
+                    'import sys\n'
+                    'sys.exit(int(os.path.exists({!r})))\n'.format(
+                        self.failPath))
+
+        self.manifestPath = os.path.join(self.directory, 'manifest.sqlite')
+        data2istsos.args = argparse.Namespace(
+            u=True, direct_upload=False, f=False, tail=True,
+            incremental=False, staging=False, manifest=self.manifestPath,
+            jobs=1, pack_rows=None, device_type='templogger',
+            istsos_path=self.istsosPath, service='test',
+            url='http://localhost/istsos', username=None, password=None)
+
+        self.configs = [convert2dat.get_config(
+            self.observationsPath,
+            timestamp_column='B4 200cm',
+            timestamp_format='YYYY-MM-DD HH:MM',
+            procedure='B4 200cm',
+            offering='test',
+            file_extension='swd',
+            d=True,
+            t=True)]
+        self.geometryIndex = os.path.join(repositoryPath, 'metadata',
+                                          'geometry_index_templogger.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def import_data(self):
+        return data2istsos.import_data(
+            self.configs, {'test': [self.observationsPath]},
+            self.geometryIndex)
+
+    def get_checkpoint(self):
+        manifest = ImportManifest(self.manifestPath)
+        try:
+            return manifest.get_checkpoint(self.path)
+        finally:
+            manifest.close()
+
+    def test_failed_upload_leaves_checkpoint(self):
+        open(self.failPath, 'w').close()
+        failures = self.import_data()
+
+        self.assertEqual(failures, [(self.path, 'not uploaded')])
+        self.assertIsNone(self.get_checkpoint()['offset'])
+        rowsCount = len(read_values(self.datPath))
+        self.assertTrue(rowsCount > 0)
+
+        # the failed rows are uploaded again once csv2istsos succeeds
+        os.remove(self.failPath)
+        failures = self.import_data()
+
+        self.assertEqual(failures, list())
+        self.assertEqual(self.get_checkpoint()['offset'],
+                         os.path.getsize(self.path))
+        self.assertFalse(os.path.exists(self.datPath))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of polling of data2istsos -watch
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+import convert2dat
+import data2istsos
+
+demoPath = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'demo',
+                        'demo-sample-service', 'Templogstasjoner Torino',
+                        'B4 200cm')
+
+
+class PollTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.observationsPath = os.path.join(self.directory, 'B4 200cm',
+                                             '')
+        shutil.copytree(demoPath, self.observationsPath)
+        self.broken = os.path.join(self.observationsPath, 'SD201108.SWD')
+        with open(self.broken, 'w') as b:
+            b.write('B4 200cm\tTemperature (*F)\tRH (%)\n'
+                    '\t*F\t%\n'
+                    '\tTMP\tHMD\n'
+                    '2011-08-01 00:15\t62,1\t71,4\n'
+                    '2011-08-01 02:15\n')
+
+        data2istsos.args = argparse.Namespace(
+            u=False, direct_upload=False, f=False, tail=False,
+            incremental=False, staging=False, manifest=os.path.join(
+                self.directory, 'manifest.sqlite'),
+            jobs=1, pack_rows=None, device_type='templogger', settle=0)
+
+        self.configs = [convert2dat.get_config(
+            self.observationsPath,
+            timestamp_column='B4 200cm',
+            timestamp_format='YYYY-MM-DD HH:MM',
+            procedure='B4_200cm',
+            offering='test',
+            file_extension='swd',
+            timestamp_suffix='20170101000000',
+            d=True,
+            t=True)]
+        self.procedureDirectories = {'test': [self.observationsPath]}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def poll(self, imported):
+        data2istsos.poll(self.configs, self.procedureDirectories, None,
+                         imported, dict())
+
+    def test_failed_file_is_polled_again(self):
+        imported = dict()
+        self.poll(imported)
+
+        self.assertNotIn(self.broken, imported)
+        self.assertEqual(len(imported), 11)
+
+        ready = data2istsos.get_ready_configs(self.configs, dict(imported),
+                                              dict(), 0)
+        self.assertEqual([c.__dict__['path'] for c in ready], [self.broken])
+
+        shutil.copyfile(os.path.join(demoPath, 'SD201108.SWD'), self.broken)
+        self.poll(imported)
+
+        self.assertIn(self.broken, imported)
+        self.assertEqual(len(imported), 12)
+
+
+class UploadFailuresTest(unittest.TestCase):
+
+    def test_files_of_failed_directories(self):
+        results = [('a/B1/SD1.SWD', None), ('a/B2/SD1.SWD', None),
+                   ('a/B2/SD2.SWD', 'ValueError: broken')]
+
+        self.assertEqual(
+            data2istsos.get_upload_failures(results, ['a/B1/']),
+            [('a/B2/SD1.SWD', 'not uploaded')])
+
+
+if __name__ == '__main__':
+    unittest.main()